@@ -0,0 +1,84 @@
+"""
+Compares the legacy 300 DPI PNG render against the adaptive modes.
+
+    python -m benchmarks.bench_render [--pages 1,5,20] [--width 1600]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+from modules.pdf_processor import encode_pixmap, fit_dpi, open_document, rasterize
+
+DATA_DIR = "data"
+
+MODES = [
+    ("legacy png@300", None, "png", None),
+    ("adaptive png", "fit", "png", None),
+    ("adaptive jpeg q80", "fit", "jpeg", 80),
+    ("adaptive webp q80", "fit", "webp", 80),
+    ("preview jpeg@40", 40, "jpeg", 60),
+]
+
+
+def bench_file(pdf_path, pages, width_px, repeat):
+    rows = []
+    with open_document(pdf_path) as doc:
+        for label, dpi_spec, fmt, quality in MODES:
+            sizes, raster_ms, encode_ms = [], [], []
+            for page in pages:
+                if page > doc.page_count:
+                    continue
+                if dpi_spec is None:
+                    dpi = 300
+                elif dpi_spec == "fit":
+                    dpi = fit_dpi(doc.load_page(page - 1).rect.width, width_px)
+                else:
+                    dpi = dpi_spec
+                for _ in range(repeat):
+                    t0 = time.perf_counter()
+                    pix = rasterize(doc, page, dpi)
+                    t1 = time.perf_counter()
+                    data = encode_pixmap(pix, fmt, quality or 85)
+                    t2 = time.perf_counter()
+                    raster_ms.append((t1 - t0) * 1000)
+                    encode_ms.append((t2 - t1) * 1000)
+                sizes.append(len(data))
+            if sizes:
+                rows.append({
+                    "mode": label,
+                    "kb": statistics.mean(sizes) / 1024,
+                    "raster_ms": statistics.median(raster_ms),
+                    "encode_ms": statistics.median(encode_ms),
+                })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", default="1,5,20,50")
+    parser.add_argument("--width", type=int, default=1600, help="target width in device pixels")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    pages = [int(p) for p in args.pages.split(",")]
+
+    names = sorted(n for n in os.listdir(DATA_DIR) if n.lower().endswith(".pdf")) if os.path.isdir(DATA_DIR) else []
+    if not names:
+        sys.exit(f"no PDF files found in {DATA_DIR}/")
+    for name in names:
+        rows = bench_file(os.path.join(DATA_DIR, name), pages, args.width, args.repeat)
+        print(f"\n{name} (pages {args.pages}, width {args.width}px)")
+        if not rows:
+            print(f"  skipped: none of pages {args.pages} exist in this file")
+            continue
+        print(f"{'mode':<20}{'avg KB':>10}{'raster ms':>12}{'encode ms':>12}")
+        base = rows[0]
+        for r in rows:
+            print(
+                f"{r['mode']:<20}{r['kb']:>10.1f}{r['raster_ms']:>12.1f}{r['encode_ms']:>12.1f}"
+                f"   ({r['kb'] / base['kb']:.0%} bytes, {r['encode_ms'] / max(base['encode_ms'], 1e-9):.0%} encode)"
+            )
+
+if __name__ == "__main__":
+    main()
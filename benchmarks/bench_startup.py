@@ -0,0 +1,109 @@
+"""
+Time-to-first-render of the Streamlit app in a fresh process.
+
+    python -m benchmarks.bench_startup [--repeat 3]
+
+Every sample spawns a new interpreter that runs main.py once through
+streamlit.testing's AppTest, the way a new server process serves its first
+visitor. "cold" points the render cache and the document manifest at an empty
+directory; "warm" reuses a directory primed by an earlier run, as after an app
+restart. Reported per sample:
+
+    process_ms    spawn to exit, as seen by this process
+    first_run_ms  the first script run (imports, file listing, page render)
+    heavy         heavy modules the first run imported (fitz, google.genai, ...)
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.dirname(BENCH_DIR)
+MAIN_PATH = os.path.join(BASE_DIR, "main.py")
+HEAVY_MODULES = ("fitz", "google.genai", "PIL.Image", "streamlit.components.v1")
+
+
+def probe():
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(MAIN_PATH, default_timeout=120)
+    t0 = time.perf_counter()
+    at.run()
+    first_run_ms = (time.perf_counter() - t0) * 1000
+    print(json.dumps({
+        "first_run_ms": first_run_ms,
+        "images": len(at.get("image")),
+        "errors": [str(e.value) for e in at.exception],
+        "heavy": [m for m in HEAVY_MODULES if m in sys.modules],
+    }))
+
+
+def sample(cache_dir: str) -> dict:
+    env = dict(
+        os.environ,
+        RENDER_DISK_CACHE_DIR=os.path.join(cache_dir, "renders"),
+        DOCUMENT_MANIFEST_PATH=os.path.join(cache_dir, "manifest.json"),
+    )
+    t0 = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_startup", "--probe"],
+        cwd=BASE_DIR, env=env, capture_output=True, text=True,
+    )
+    process_ms = (time.perf_counter() - t0) * 1000
+    lines = [line for line in proc.stdout.splitlines() if line.startswith("{")]
+    if proc.returncode != 0 or not lines:
+        raise RuntimeError(f"startup probe failed:\n{proc.stderr[-2000:]}")
+    result = json.loads(lines[-1])
+    if result["errors"] or not result["images"]:
+        raise RuntimeError(f"startup probe rendered nothing: {result}")
+    result["process_ms"] = process_ms
+    return result
+
+
+def measure_startup(repeat: int = 3) -> dict:
+    """Best cold and warm samples, as {"startup.<mode>.<metric>": value}."""
+    results = {}
+    modes = {"cold": [], "warm": []}
+    warm_dir = tempfile.mkdtemp(prefix="bench-startup-")
+    try:
+        sample(warm_dir)  # prime
+        for _ in range(repeat):
+            cold_dir = tempfile.mkdtemp(prefix="bench-startup-")
+            try:
+                modes["cold"].append(sample(cold_dir))
+            finally:
+                shutil.rmtree(cold_dir, ignore_errors=True)
+            modes["warm"].append(sample(warm_dir))
+    finally:
+        shutil.rmtree(warm_dir, ignore_errors=True)
+    for mode, samples in modes.items():
+        for metric in ("process_ms", "first_run_ms"):
+            results[f"startup.{mode}.{metric}"] = min(s[metric] for s in samples)
+    results["heavy"] = {mode: samples[-1]["heavy"] for mode, samples in modes.items()}
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--probe", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.probe:
+        probe()
+        return 0
+    results = measure_startup(args.repeat)
+    heavy = results.pop("heavy")
+    for metric, value in results.items():
+        print(f"{metric:<32}{value:>10,.0f}")
+    for mode, modules in heavy.items():
+        print(f"{mode} first run imported: {', '.join(modules) or '-'}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,569 @@
+"""
+Benchmark suite for the viewer, logger and answer pipeline.
+
+    python -m benchmarks.run                      # run, write results, compare to baseline
+    python -m benchmarks.run --quick              # smaller log sizes / fewer repeats
+    python -m benchmarks.run --only logger        # cases whose name starts with "logger"
+    python -m benchmarks.run --only startup       # time to first render in a fresh process
+    python -m benchmarks.run --only render_service  # render throughput by worker count
+    python -m benchmarks.run --update-baseline    # store this run as the new baseline
+
+Results go to benchmarks/results.json. Each metric is compared with
+benchmarks/baseline.json; a metric that is worse than its baseline by more
+than its tolerance (default --tolerance, 0.5 = 50%) counts as a regression
+and makes the command exit with status 1. Timings are the best of several
+runs and tolerances are wide, so the check catches order-of-magnitude slips
+rather than machine noise.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from types import SimpleNamespace
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.dirname(BENCH_DIR)
+DATA_DIR = os.path.join(BASE_DIR, "data")
+RESULTS_PATH = os.path.join(BENCH_DIR, "results.json")
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+
+# Noisy metrics (sub-millisecond timings, fsync-bound throughput) get a
+# looser tolerance than the default; keys are metric name prefixes.
+TOLERANCES = {
+    "get_total_pages.warm_ms": 1.0,
+    "render.cache_hit_ms": 1.0,
+    "logger.": 1.0,
+    "sources.": 0.5,
+    "metrics.": 1.0,
+    "startup.": 1.0,
+    "thumbnails.": 1.0,
+    "render_service.": 1.0,
+    "log_analytics.": 1.0,
+}
+
+
+def tolerance_for(metric: str, default: float) -> float:
+    for prefix, tolerance in TOLERANCES.items():
+        if metric.startswith(prefix):
+            return tolerance
+    return default
+
+
+def measure(fn, repeat=5, warmup=1):
+    """Best wall time of fn() over `repeat` runs, in milliseconds (least sensitive to noise)."""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return min(samples)
+
+
+def pdf_paths():
+    return sorted(os.path.join(DATA_DIR, f) for f in os.listdir(DATA_DIR) if f.lower().endswith(".pdf"))
+
+
+@contextmanager
+def temp_env(**env):
+    old = {k: os.environ.get(k) for k in env}
+    os.environ.update(env)
+    try:
+        yield
+    finally:
+        for k, v in old.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+
+
+@contextmanager
+def isolated_logger():
+    """Points modules.logger at an empty temporary log directory."""
+    import modules.logger as logger
+
+    saved = {k: getattr(logger, k) for k in ("LOG_DIR", "LOG_FILE", "SEGMENT_DIR", "LOCK_FILE")}
+    tmp = tempfile.mkdtemp(prefix="bench-log-")
+    logger.LOG_DIR = tmp
+    logger.LOG_FILE = os.path.join(tmp, "chat_logs.json")
+    logger.SEGMENT_DIR = os.path.join(tmp, "chat_logs")
+    logger.LOCK_FILE = os.path.join(logger.SEGMENT_DIR, ".lock")
+    logger._index.clear()
+    logger._feedback.clear()
+    logger._scanned.clear()
+    try:
+        yield logger
+    finally:
+        for k, v in saved.items():
+            setattr(logger, k, v)
+        logger._index.clear()
+        logger._feedback.clear()
+        logger._scanned.clear()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+# =====================================================
+# Synthetic Gemini responses
+# =====================================================
+def page_texts(pdf_path, pages):
+    from modules.pdf_processor import open_document
+
+    with open_document(pdf_path) as doc:
+        return {p: doc.load_page(p - 1).get_text() for p in pages if p <= doc.page_count}
+
+
+def synthetic_chunks(n_chunks=20):
+    """Grounding chunks cut from real pages, half of them straddling a page marker."""
+    pdf_path = pdf_paths()[0]
+    title = os.path.splitext(os.path.basename(pdf_path))[0]
+    texts = page_texts(pdf_path, range(2, 2 + n_chunks + 1))
+    chunks = []
+    for i, page in enumerate(sorted(texts)[:-1]):
+        if i % 2:
+            text = texts[page][-150:] + f"\n--- PAGE {page + 1} ---\n" + texts[page + 1][:150]
+        else:
+            text = f"--- PAGE {page} ---\n" + texts[page][100:400]
+        chunks.append(SimpleNamespace(retrieved_context=SimpleNamespace(title=title, text=text)))
+    return chunks
+
+
+class StubModels:
+    """Answers instantly with a fixed text and grounding chunks."""
+
+    def __init__(self, chunks, answer="답변입니다. " * 50):
+        self.chunks = chunks
+        self.answer = answer
+
+    def _response(self, text, chunks):
+        metadata = SimpleNamespace(grounding_chunks=chunks) if chunks else None
+        return SimpleNamespace(text=text, candidates=[SimpleNamespace(grounding_metadata=metadata)])
+
+    def generate_content(self, **_):
+        return self._response(self.answer, self.chunks)
+
+    def generate_content_stream(self, **_):
+        words = self.answer.split(" ")
+        for i in range(0, len(words), 10):
+            yield self._response(" ".join(words[i:i + 10]) + " ", None)
+        yield self._response(None, self.chunks)
+
+
+# =====================================================
+# Cases
+# =====================================================
+def bench_render(args):
+    from modules.pdf_processor import encode_pixmap, file_signature, open_document, rasterize, render_page
+
+    results = {}
+    for pdf_path in pdf_paths():
+        name = os.path.splitext(os.path.basename(pdf_path))[0]
+        with open_document(pdf_path) as doc:
+            pages = [p for p in (1, 10, 50) if p <= doc.page_count]
+        for dpi in (72, 150, 300):
+            for page in pages:
+                def core():
+                    with open_document(pdf_path) as doc:
+                        pix = rasterize(doc, page, dpi)
+                    return encode_pixmap(pix, "png")
+                key = f"render.{name}.p{page}.dpi{dpi}"
+                results[f"{key}.ms"] = measure(core, repeat=args.repeat)
+                results[f"{key}.bytes"] = len(core())
+
+    pdf_path = pdf_paths()[0]
+    sig = file_signature(pdf_path)
+    render_page(pdf_path, sig, 1, 150, "jpeg", 80)
+    results["render.cache_hit_ms"] = measure(lambda: render_page(pdf_path, sig, 1, 150, "jpeg", 80), repeat=50)
+    return results
+
+
+def bench_total_pages(args):
+    from modules.pdf_processor import DOCUMENT_POOL, file_signature, get_total_pages
+
+    pdf_path = pdf_paths()[0]
+    sig = file_signature(pdf_path)
+
+    def cold():
+        get_total_pages.clear()
+        DOCUMENT_POOL.invalidate()
+        return get_total_pages(pdf_path, sig)
+
+    return {
+        "get_total_pages.cold_ms": measure(cold, repeat=args.repeat),
+        "get_total_pages.warm_ms": measure(lambda: get_total_pages(pdf_path, sig), repeat=50),
+    }
+
+
+def bench_logger(args):
+    results = {}
+    sizes = (1000, 10000) if args.quick else (1000, 10000, 100000)
+    ops = 200
+    with isolated_logger() as logger:
+        filler = logger.create_log_entry("신용리스크 표준방법 RW 설명해줘", "답변 " * 200, [{"title": "시행세칙", "page": 12}])
+        existing = 0
+        for size in sizes:
+            batch = []
+            for i in range(size - existing):
+                entry = dict(filler)
+                entry["id"] = f"bench-{existing + i}"
+                batch.append(entry)
+                if len(batch) == 5000:
+                    logger.save_logs(batch)
+                    batch = []
+            logger.save_logs(batch)
+            existing = size
+
+            entries = [logger.create_log_entry("q", "a", []) for _ in range(ops)]
+            t0 = time.perf_counter()
+            for entry in entries:
+                logger.save_log(entry)
+            elapsed = time.perf_counter() - t0
+            results[f"logger.save_log.{size}.ops_per_s"] = ops / elapsed
+
+            t0 = time.perf_counter()
+            for i, entry in enumerate(entries):
+                logger.update_log_feedback(entry["id"], bool(i % 2))
+            elapsed = time.perf_counter() - t0
+            results[f"logger.update_log_feedback.{size}.ops_per_s"] = ops / elapsed
+            existing += ops
+
+            results[f"logger.load_logs.{size}.ms"] = measure(logger.load_logs, repeat=min(args.repeat, 3), warmup=0)
+    return results
+
+
+def bench_sources(args):
+    from modules.citation import resolve_chunks
+    from modules.qa import dedupe_sources, extract_sources, normalize_source_name
+
+    chunks = synthetic_chunks()
+    response = StubModels(chunks).generate_content()
+    files = [os.path.basename(p) for p in pdf_paths()]
+    marked = extract_sources(response)
+    resolved = extract_sources(response, resolve_chunks)
+    titles = [s["title"] for s in resolved] * 50
+    return {
+        "sources.extract_marked_ms": measure(lambda: extract_sources(response), repeat=50),
+        "sources.resolve_ms": measure(lambda: extract_sources(response, resolve_chunks), repeat=args.repeat),
+        "sources.resolve_per_chunk_ms": measure(lambda: extract_sources(response, resolve_chunks), repeat=args.repeat) / len(chunks),
+        "sources.dedupe_ms": measure(lambda: dedupe_sources(marked * 50), repeat=50),
+        "sources.normalize_source_name_us": measure(
+            lambda: [normalize_source_name(t, files) for t in titles], repeat=50
+        ) * 1000 / len(titles),
+    }
+
+
+def bench_turn(args):
+    """One full question turn (answer, sources, log entry, log write) against a stub client."""
+    from modules.answer_cache import AnswerCache
+    from modules.citation import resolve_chunks
+    from modules.qa import answer_question, dedupe_sources, stream_answer
+
+    client = SimpleNamespace(models=StubModels(synthetic_chunks()))
+    tmp = tempfile.mkdtemp(prefix="bench-cache-")
+    results = {}
+    try:
+        with isolated_logger() as logger:
+            counter = iter(range(10 ** 9))
+
+            def turn(fn, cache, question=None):
+                q = question or f"질문 {next(counter)}"
+                result = fn(client, q, cache=cache, resolver=resolve_chunks)
+                sources = dedupe_sources(result["sources"])
+                entry = logger.create_log_entry(q, result["text"], sources, cached=result["cached"])
+                logger.save_log(entry)
+                cache.link_log(result["cache_key"], entry["id"])
+
+            cache = AnswerCache(os.path.join(tmp, "answers.sqlite3"))
+            results["turn.miss_ms"] = measure(lambda: turn(answer_question, cache), repeat=args.repeat)
+            results["turn.stream_miss_ms"] = measure(lambda: turn(stream_answer, cache), repeat=args.repeat)
+            results["turn.cache_hit_ms"] = measure(lambda: turn(answer_question, cache, "고정 질문"), repeat=args.repeat)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return results
+
+
+def bench_metrics(args):
+    """Per-span cost of the stage instrumentation, disabled (the default) and enabled."""
+    from modules import metrics
+
+    n = 10000
+
+    def spans():
+        for _ in range(n):
+            with metrics.span("bench"):
+                pass
+
+    tmp = tempfile.mkdtemp(prefix="bench-metrics-")
+    saved = (metrics.ENABLED, metrics.METRICS_DIR, metrics._span_log)
+    try:
+        metrics.ENABLED = False
+        disabled = measure(spans, repeat=args.repeat)
+        metrics.ENABLED = True
+        metrics.METRICS_DIR = tmp
+        metrics._span_log = None
+        enabled = measure(spans, repeat=args.repeat)
+    finally:
+        metrics.ENABLED, metrics.METRICS_DIR, log = saved
+        if metrics._span_log is not None and metrics._span_log is not log:
+            handler = metrics._span_log.handlers[-1]  # the one added for this run
+            metrics._span_log.removeHandler(handler)
+            handler.close()
+        metrics._span_log = log
+        metrics.REGISTRY.reset()
+        shutil.rmtree(tmp, ignore_errors=True)
+    return {
+        "metrics.span_disabled_us": disabled * 1000 / n,
+        "metrics.span_enabled_us": enabled * 1000 / n,
+    }
+
+
+def bench_thumbnails(args):
+    """Building every page's thumbnail sheets for one manual, serially and on the process pool."""
+    import modules.thumbnails as thumbnails
+    from modules.pdf_processor import file_signature, get_total_pages
+
+    pdf_path = pdf_paths()[0]
+    sig = file_signature(pdf_path)
+    pages = get_total_pages(pdf_path, sig)
+    saved = thumbnails.THUMB_DIR
+    results = {}
+    try:
+        for workers in sorted({1, thumbnails.THUMB_WORKERS}):
+            thumbnails.THUMB_DIR = tempfile.mkdtemp(prefix="bench-thumbs-")
+            t0 = time.perf_counter()
+            index = thumbnails.build_sheets(pdf_path, sig, pages, workers=workers)
+            results[f"thumbnails.build.w{workers}_ms"] = (time.perf_counter() - t0) * 1000
+            results["thumbnails.sheet_bytes"] = sum(
+                os.path.getsize(thumbnails.sheet_path(sig, n)) for n in range(len(index["sheets"]))
+            )
+            shutil.rmtree(thumbnails.THUMB_DIR, ignore_errors=True)
+    finally:
+        thumbnails.THUMB_DIR = saved
+    return results
+
+
+def bench_log_analytics(args):
+    """Full and incremental analytics runs over logs of growing size, with peak Python memory."""
+    import tracemalloc
+    from modules import log_analytics
+
+    results = {}
+    sizes = (1000, 10000) if args.quick else (1000, 10000, 100000)
+    out = tempfile.mkdtemp(prefix="bench-analytics-")
+    try:
+        with isolated_logger() as logger:
+            existing = 0
+            early_ids = []
+            for size in sizes:
+                batch = []
+                for i in range(existing, size):
+                    sources = [] if i % 9 == 0 else [{"title": "시행세칙", "page": i % 40 + 1}]
+                    entry = logger.create_log_entry(
+                        f"질문 {i % 500}" if i % 4 else f"질문 {i}", "답변 " * 50, sources,
+                        cached=i % 5 == 0, ttft_ms=float(i % 7000), total_ms=float(i % 15000),
+                    )
+                    batch.append(entry)
+                    if len(batch) == 5000:
+                        logger.save_logs(batch)
+                        batch = []
+                logger.save_logs(batch)
+                early_ids = early_ids or [e["id"] for e in batch[:10]]
+                existing = size
+
+                t0 = time.perf_counter()
+                log_analytics.run(out, full=True)
+                results[f"log_analytics.full.{size}.ms"] = (time.perf_counter() - t0) * 1000
+
+                tracemalloc.start()
+                log_analytics.run(out, full=True)
+                results[f"log_analytics.full.{size}.peak_kb"] = tracemalloc.get_traced_memory()[1] / 1024
+                tracemalloc.stop()
+
+            # 100 new entries plus feedback on entries counted by an earlier run,
+            # which costs one extra pass over the older records
+            logger.save_logs([logger.create_log_entry(f"새 질문 {i}", "a", []) for i in range(100)])
+            for log_id in early_ids:
+                logger.update_log_feedback(log_id, True)
+            t0 = time.perf_counter()
+            log_analytics.run(out)
+            results["log_analytics.incremental.ms"] = (time.perf_counter() - t0) * 1000
+    finally:
+        shutil.rmtree(out, ignore_errors=True)
+    return results
+
+
+def bench_render_service(args):
+    """
+    Pages per second for a batch of cache misses: rendered by N threads in
+    this process (GIL-bound) and by the render service with N worker processes.
+    """
+    import modules.pdf_processor as pdf_processor
+    from concurrent.futures import ThreadPoolExecutor
+    from modules.render_service import RenderService
+
+    pdf_path = pdf_paths()[0]
+    sig = pdf_processor.file_signature(pdf_path)
+    pages = range(1, min(pdf_processor.get_total_pages(pdf_path, sig), 8 if args.quick else 24) + 1)
+    saved_dir = pdf_processor.DISK_CACHE.cache_dir
+    cpus = os.cpu_count() or 1
+    results = {}
+
+    def run_batch(render_all):
+        pdf_processor.RENDER_CACHE.clear()
+        pdf_processor.DISK_CACHE.cache_dir = tempfile.mkdtemp(prefix="bench-renders-")
+        try:
+            t0 = time.perf_counter()
+            render_all()
+            return len(pages) / (time.perf_counter() - t0)
+        finally:
+            shutil.rmtree(pdf_processor.DISK_CACHE.cache_dir, ignore_errors=True)
+
+    try:
+        for n in sorted({1, 2, 4, cpus}):
+            if n > max(cpus, 2):
+                continue
+            with ThreadPoolExecutor(n) as threads:
+                results[f"render_service.threads{n}.pages_per_s"] = run_batch(lambda: list(threads.map(
+                    lambda p: pdf_processor.render_page(pdf_path, sig, p, 150, "jpeg", 80), pages,
+                )))
+
+            service = RenderService(processes=n, session_pending=len(pages), queue_limit=len(pages))
+            service.start(wait=True)
+            try:
+                results[f"render_service.procs{n}.pages_per_s"] = run_batch(lambda: [
+                    f.result() for f in [service.submit(pdf_path, sig, p, 150, "jpeg", 80) for p in pages]
+                ])
+            finally:
+                service.shutdown()
+    finally:
+        pdf_processor.DISK_CACHE.cache_dir = saved_dir
+    return results
+
+
+def bench_startup(args):
+    """Time to first render of main.py in a fresh process (see benchmarks/bench_startup.py)."""
+    from benchmarks.bench_startup import measure_startup
+
+    results = measure_startup(repeat=1 if args.quick else 3)
+    results.pop("heavy")
+    return results
+
+
+CASES = {
+    "render": bench_render,
+    "get_total_pages": bench_total_pages,
+    "logger": bench_logger,
+    "sources": bench_sources,
+    "turn": bench_turn,
+    "metrics": bench_metrics,
+    "thumbnails": bench_thumbnails,
+    "log_analytics": bench_log_analytics,
+    "render_service": bench_render_service,
+    "startup": bench_startup,
+}
+
+
+# =====================================================
+# Baseline comparison
+# =====================================================
+def higher_is_better(metric: str) -> bool:
+    return metric.endswith("per_s")
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Returns [(metric, baseline, current, change)] for metrics worse than their tolerance."""
+    regressions = []
+    for metric, base in baseline.items():
+        current = results.get(metric)
+        if current is None or not base:
+            continue
+        if metric.endswith(".bytes"):
+            change = current / base - 1
+        elif higher_is_better(metric):
+            change = base / current - 1 if current else float("inf")
+        else:
+            change = current / base - 1
+        if change > tolerance_for(metric, tolerance):
+            regressions.append((metric, base, current, change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", action="append", help="run only cases with this name prefix")
+    parser.add_argument("--quick", action="store_true")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--tolerance", type=float, default=0.5)
+    parser.add_argument("--output", default=RESULTS_PATH)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args(argv)
+    if args.quick:
+        args.repeat = min(args.repeat, 3)
+
+    results = {}
+    tmp_cache = tempfile.mkdtemp(prefix="bench-renders-")
+    try:
+        # Keep benchmark renders out of the real on-disk cache
+        import modules.pdf_processor as pdf_processor
+        pdf_processor.DISK_CACHE.cache_dir = tmp_cache
+        for name, case in CASES.items():
+            if args.only and not any(name.startswith(prefix) for prefix in args.only):
+                continue
+            gc.collect()  # don't bill one case for the garbage of the previous one
+            t0 = time.perf_counter()
+            results.update(case(args))
+            print(f"[{name}] done in {time.perf_counter() - t0:.1f}s", file=sys.stderr)
+    finally:
+        shutil.rmtree(tmp_cache, ignore_errors=True)
+
+    payload = {
+        "meta": {
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "quick": args.quick,
+        },
+        "results": {k: round(v, 4) for k, v in sorted(results.items())},
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=4)
+
+    for metric, value in payload["results"].items():
+        print(f"{metric:<55}{value:>14,.3f}")
+
+    if args.update_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, "r", encoding="utf-8") as f:
+                baseline = json.load(f).get("results", {})
+        baseline.update(payload["results"])
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"meta": payload["meta"], "results": dict(sorted(baseline.items()))}, f, ensure_ascii=False, indent=4)
+        print(f"baseline updated: {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("no baseline stored; run with --update-baseline to create one")
+        return 0
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f).get("results", {})
+    regressions = compare(payload["results"], baseline, args.tolerance)
+    for metric, base, current, change in regressions:
+        print(f"REGRESSION {metric}: {base:,.3f} -> {current:,.3f} ({change:+.0%})")
+    if not regressions:
+        print(f"no regressions against {args.baseline}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,23 +1,57 @@
+# Spawned render/thumbnail workers import this module's spec instead of
+# re-running the app (see modules/procpool.py). Set before any other import,
+# since importing a module may already start a worker pool.
+from modules.procpool import worker_main_spec
+__spec__ = worker_main_spec()
+
 import os
-import re
 import base64
+import functools
+import uuid
 import streamlit as st
-import streamlit.components.v1 as components
-
-
-from google import genai
-from google.genai import types
 
 from dotenv import load_dotenv
-from modules.pdf_processor import render_page, get_total_pages
+from modules.pdf_processor import render_page, file_signature, fit_dpi, fit_page_dpi, get_total_pages, is_rendered
+from modules.manifest import MANIFEST
+from modules.prefetch import PREFETCHER
+from modules.render_service import RENDER_SERVICE, RENDER_SERVICE_ENABLED, RenderBusyError
 import modules.logger as logger
+from modules.log_writer import LOG_WRITER
+from modules.qa import normalize_source_name, dedupe_sources
+from modules.dispatcher import DISPATCHER, GeminiBusyError
+from modules.search_index import build_index
+from modules.citation import resolve_chunks
+from modules.thumbnails import build_sheets, prune as prune_thumbnails, sheet_of_page, sheet_path
+from modules import metrics
 
 # 1. Load environment variables
 load_dotenv('../../etc/.env') # Adjust path if necessary, user provided '../../etc/.env'
 
+# Rendering settings
+# "adaptive" picks the DPI from the viewer width and ships compressed images;
+# "legacy" keeps the original 300 DPI PNG output.
+RENDER_MODE = os.getenv("RENDER_MODE", "adaptive")
+RENDER_FORMAT = os.getenv("RENDER_FORMAT", "jpeg")      # png | jpeg | webp
+RENDER_QUALITY = int(os.getenv("RENDER_QUALITY", "80"))
+VIEWER_WIDTH_PX = int(os.getenv("VIEWER_WIDTH_PX", "800"))  # CSS width of the viewer column
+VIEWER_PIXEL_RATIO = float(os.getenv("VIEWER_PIXEL_RATIO", "2"))
+PREVIEW_DPI = int(os.getenv("PREVIEW_DPI", "40"))
+PREFETCH_RADIUS = int(os.getenv("PREFETCH_RADIUS", "2"))  # pages warmed around the current one
+WARMUP_ON_BOOT = os.getenv("WARMUP_ON_BOOT", "0") == "1"  # render page 1 of every manual on the first run
+
+SEARCH_RESULTS = 10
+CHAT_WINDOW_TURNS = int(os.getenv("CHAT_WINDOW_TURNS", "10"))  # turns drawn per "load older" page
+
+# Answer settings
+STREAM_ANSWERS = os.getenv("GEMINI_STREAMING", "1") == "1"
+
 # 2. Configure Streamlit
 st.set_page_config(layout="wide", page_title="업무 메뉴얼")
 
+# Per-stage timings (no-op unless METRICS_ENABLED=1); ended at the bottom or before st.rerun()
+run_span = metrics.span("script_run")
+metrics.serve()
+
 # 3. Initialize Session State
 if "current_page" not in st.session_state:
     st.session_state.current_page = 1
@@ -29,6 +63,12 @@ if "pending_auto_jump" not in st.session_state:
     st.session_state.pending_auto_jump = None
 if "scroll_to_top" not in st.session_state:
     st.session_state.scroll_to_top = False
+if "session_id" not in st.session_state:
+    st.session_state.session_id = str(uuid.uuid4())
+if "highlight" not in st.session_state:
+    st.session_state.highlight = None
+if "chat_window" not in st.session_state:
+    st.session_state.chat_window = CHAT_WINDOW_TURNS
 
 
 # Check for pending auto-jump (must be done before widgets are rendered)
@@ -38,22 +78,117 @@ if st.session_state.pending_auto_jump:
     st.session_state.file_selector = target['file']
     st.session_state.current_page = target['page']
     st.session_state.page_input = str(target['page'])
+    st.session_state.highlight = target
+    st.session_state.overview_mode = False
     st.session_state.pending_auto_jump = None # Clear after applying
 
 # 4. Helper Functions
-def get_pdf_files(data_dir="data"):
-    """Scans the data directory for PDF files."""
-    pdf_files = []
-    if os.path.exists(data_dir):
-        for f in os.listdir(data_dir):
-            if f.lower().endswith(".pdf"):
-                pdf_files.append(f)
-    return sorted(pdf_files)
+@st.cache_resource(show_spinner="문서 색인 중...", max_entries=1)
+def get_search_index(signatures):
+    """Loads the local full-text index; `signatures` ((file, sig), ...) keys the rebuild."""
+    return build_index()
+
+def viewer_render_args(pdf_path, sig, page):
+    """Returns the render_page arguments (dpi, fmt, quality) the viewer uses for a page."""
+    if RENDER_MODE == "legacy":
+        return {"dpi": 300, "fmt": "png", "quality": 85}
+    target_px = int(VIEWER_WIDTH_PX * VIEWER_PIXEL_RATIO)
+    # Page widths come from the manifest, so picking the DPI never opens the PDF
+    width = MANIFEST.page_width(os.path.basename(pdf_path), page)
+    return {
+        "dpi": fit_dpi(width, target_px) if width else fit_page_dpi(pdf_path, sig, page, target_px),
+        "fmt": RENDER_FORMAT,
+        "quality": RENDER_QUALITY,
+    }
+
+def prefetch_pages(group, scope, targets):
+    """Queues background renders for (pdf_path, page) targets."""
+    requests = []
+    for pdf_path, page in targets:
+        sig = file_signature(pdf_path)
+        args = viewer_render_args(pdf_path, sig, page)
+        requests.append((pdf_path, sig, page, args["dpi"], args["fmt"], args["quality"]))
+    PREFETCHER.schedule(st.session_state.session_id, group, scope, requests)
+
+@st.cache_resource(show_spinner=False)
+def warm_up_first_pages(signatures):
+    """Queues page 1 of every manual for background rendering, once per process and document set."""
+    requests = []
+    for name, sig in signatures:
+        pdf_path = os.path.join("data", name)
+        args = viewer_render_args(pdf_path, sig, 1)
+        requests.append((pdf_path, sig, 1, args["dpi"], args["fmt"], args["quality"]))
+    return PREFETCHER.schedule("boot", "first_pages", signatures, requests)
+
+@st.cache_resource(show_spinner=False)
+def use_render_service():
+    """Sends background prefetches through the render process pool, once per server process."""
+    PREFETCHER.render = functools.partial(RENDER_SERVICE.render, session_id="prefetch")
+    return RENDER_SERVICE
+
+def render_viewer_page(pdf_path, sig, page, highlights=(), **render_args):
+    """Renders a page on the render process pool (or on this thread with RENDER_SERVICE=0)."""
+    if RENDER_SERVICE_ENABLED:
+        return RENDER_SERVICE.render(
+            pdf_path, sig, page, highlights=highlights,
+            session_id=st.session_state.session_id, **render_args,
+        )
+    return render_page(pdf_path, sig=sig, page=page, highlights=highlights, **render_args)
+
+def rerun():
+    """Closes this run's timing span, then reruns the script."""
+    run_span.end()
+    st.rerun()
 
 def set_page(page):
     st.session_state.current_page = int(page)
     st.session_state.page_input = str(page)
 
+@st.cache_resource(show_spinner="썸네일 생성 중...")
+def get_thumbnail_index(pdf_path, sig, page_count):
+    """Sprite-sheet index of a PDF; sheets are rebuilt only when its signature changes."""
+    prune_thumbnails({s for _, s in MANIFEST.signatures()})
+    return build_sheets(pdf_path, sig, page_count)
+
+def jump_from_overview(pick_key):
+    """Callback for the overview page picker: opens the picked page and leaves overview mode."""
+    page = st.session_state.get(pick_key)
+    if page:
+        set_page(page)
+        st.session_state.overview_mode = False
+        st.session_state[pick_key] = None
+
+def show_page_overview(pdf_path, sig, total_pages):
+    """Draws one sprite sheet of thumbnails (one image request) with a page picker under it."""
+    index = get_thumbnail_index(pdf_path, sig, total_pages)
+    sheets = index["sheets"]
+    sheet_key = f"overview_sheet_{sig}"
+    current_sheet = sheet_of_page(index, st.session_state.current_page)
+    if len(sheets) > 1:
+        if sheet_key not in st.session_state:
+            st.session_state[sheet_key] = current_sheet
+        sheet_no = st.segmented_control(
+            "페이지 범위",
+            options=list(range(len(sheets))),
+            format_func=lambda n: f"{sheets[n][0]}–{sheets[n][1]}",
+            key=sheet_key,
+            label_visibility="collapsed",
+        )
+        if sheet_no is None:
+            sheet_no = current_sheet
+    else:
+        sheet_no = 0
+    first, last = sheets[sheet_no]
+    st.image(sheet_path(sig, sheet_no), use_container_width=True)
+    pick_key = f"overview_pick_{sig}_{sheet_no}"
+    st.pills(
+        "페이지 이동",
+        options=list(range(first, last + 1)),
+        key=pick_key,
+        on_change=jump_from_overview,
+        args=(pick_key,),
+    )
+
 def on_page_change():
     """Callback for page number input change."""
     try:
@@ -65,29 +200,16 @@ def on_page_change():
     except ValueError:
         pass # Ignore invalid input
 
-def normalize_source_name(source_name: str, available_files: list) -> str:
-    """
-    Matches the source name from Gemini to the actual file in the data directory.
-    Tries exact match, then adding .pdf.
-    """
-    if source_name in available_files:
-        return source_name
-    
-    # Try adding .pdf
-    candidate = f"{source_name}.pdf"
-    if candidate in available_files:
-        return candidate
-        
-    return source_name
-
-def jump_to_source(title: str, page: int, available_files: list):
-    """Callback to jump to a specific source and page."""
+def jump_to_source(title: str, page: int, available_files: list, rects=None):
+    """Callback to jump to a specific source and page, highlighting `rects` if given."""
     real_source = normalize_source_name(title, available_files)
     if real_source in available_files:
         st.session_state.current_file = real_source
         st.session_state.file_selector = real_source
         st.session_state.current_page = page
         st.session_state.page_input = str(page)
+        st.session_state.highlight = {'file': real_source, 'page': page, 'rects': rects or []}
+        st.session_state.overview_mode = False
     else:
         st.toast(f"Cannot find file: {title}")
 
@@ -95,17 +217,60 @@ def handle_bad_feedback(log_id):
     """Callback to handle bad feedback."""
     # Toggle local state (optional, if we want to toggle back and forth)
     # But user asked for "bad" button, usually it's a one-way set or toggle.
-    # Let's find the message in history and toggle it.
-    for msg in st.session_state.chat_history:
-        if msg.get("log_id") == log_id:
-            new_state = not msg.get("bad", False)
-            msg["bad"] = new_state
-            logger.update_log_feedback(log_id, new_state)
-            if new_state:
-                st.toast("Feedback recorded: Bad 👎")
-            else:
-                st.toast("Feedback undone.")
-            break
+    msg = st.session_state.messages_by_log.get(log_id)
+    if msg is not None:
+        new_state = not msg.get("bad", False)
+        msg["bad"] = new_state
+        LOG_WRITER.submit_feedback(log_id, new_state)
+        if new_state:
+            # Never serve an answer marked bad from the cache again
+            LOG_WRITER.submit_cache_eviction(log_id)
+            st.toast("Feedback recorded: Bad 👎")
+        else:
+            st.toast("Feedback undone.")
+
+def append_message(msg):
+    """
+    Appends a chat message and files it under its turn. Deduplicated source
+    buttons (label, stable widget key, jump target) are computed here, once,
+    so redrawing the chat does no per-message work beyond the widgets.
+    """
+    seq = len(st.session_state.chat_history)
+    if msg.get("sources"):
+        msg["source_buttons"] = [
+            {
+                "key": f"src_{seq}_{idx}",
+                "label": f"📄 {src['title']} (p.{src['page']})",
+                "title": src['title'],
+                "page": src['page'],
+                "rects": src.get('rects'),
+            }
+            for idx, src in enumerate(dedupe_sources(msg["sources"]))
+        ]
+    st.session_state.chat_history.append(msg)
+    turns = st.session_state.chat_turns
+    if msg["role"] == "user" or not turns:
+        turns.append([msg])
+    else:
+        turns[-1].append(msg)
+    if "log_id" in msg:
+        st.session_state.messages_by_log[msg["log_id"]] = msg
+
+def load_older_turns():
+    """Callback for the "load older" button: widens the chat window by one page."""
+    st.session_state.chat_window += CHAT_WINDOW_TURNS
+
+# Turns are grouped as messages arrive; rebuild once for sessions that predate that
+if "chat_turns" not in st.session_state:
+    history = st.session_state.chat_history
+    st.session_state.chat_history = []
+    st.session_state.chat_turns = []
+    st.session_state.messages_by_log = {}
+    for msg in history:
+        append_message(msg)
+
+if RENDER_SERVICE_ENABLED:
+    use_render_service()
 
 # 5. Layout
 col1, col2 = st.columns([0.7, 1])
@@ -116,7 +281,10 @@ with col1:
     
     with st.container(height=1500):
         # File Selection
-        pdf_files = get_pdf_files()
+        with metrics.span("list_files"):
+            pdf_files = MANIFEST.names()
+            if WARMUP_ON_BOOT:
+                warm_up_first_pages(MANIFEST.signatures())
         if not pdf_files:
             st.error("No PDF files found in 'data/' directory.")
             selected_file = None
@@ -136,12 +304,21 @@ with col1:
             if selected_file != st.session_state.current_file:
                  st.session_state.current_file = selected_file
                  st.session_state.current_page = 1 # Reset to page 1 on file change
+                 # Neighbour renders of the previous file are no longer useful
+                 PREFETCHER.cancel(st.session_state.session_id, "nav")
 
         if selected_file:
             pdf_path = os.path.join("data", selected_file)
+            pdf_doc = MANIFEST.get(selected_file)
+            if pdf_doc is not None:
+                pdf_sig = pdf_doc["sha256"]
+                total_pages = pdf_doc["pages"]
+            else:
+                # Not in the manifest (yet), e.g. the file changed since the last directory check
+                pdf_sig = file_signature(pdf_path)
+                total_pages = get_total_pages(pdf_path, pdf_sig)
             
             # Page Navigation
-            total_pages = get_total_pages(pdf_path, sig=str(os.path.getsize(pdf_path)))
             
             # Validation for page number
             if st.session_state.current_page < 1:
@@ -154,7 +331,7 @@ with col1:
                 if st.button("◀ Prev", use_container_width=True):
                     if st.session_state.current_page > 1:
                         st.session_state.current_page -= 1
-                        st.rerun()
+                        rerun()
             with c2:
                 # Page Input Field
                 st.text_input(
@@ -170,18 +347,70 @@ with col1:
                 if st.button("Next ▶", use_container_width=True):
                     if st.session_state.current_page < total_pages:
                         st.session_state.current_page += 1
-                        st.rerun()
-
-            # Render PDF
-            # We can extract keywords from the last query for highlighting if needed
-            
-            img_bytes = render_page(
-                pdf_path, 
-                sig=str(os.path.getsize(pdf_path)), 
-                page=st.session_state.current_page, 
-                dpi=300, 
+                        rerun()
+
+            # Full-text search over every manual (local index)
+            search_query = st.text_input(
+                "문서 검색",
+                key="search_query",
+                placeholder="문서 내 검색어를 입력하세요...",
+                label_visibility="collapsed",
             )
-            st.image(img_bytes, use_container_width=True)
+            if search_query.strip():
+                with metrics.span("search"):
+                    results = get_search_index(MANIFEST.signatures()).query(search_query, limit=SEARCH_RESULTS)
+                with st.expander(f"🔍 검색 결과 {len(results)}건", expanded=True):
+                    if not results:
+                        st.caption("검색 결과가 없습니다.")
+                    for idx, (hit_file, hit_page, score, snippet) in enumerate(results):
+                        st.button(
+                            f"📄 {hit_file} (p.{hit_page})",
+                            key=f"search_hit_{idx}",
+                            on_click=jump_to_source,
+                            args=(hit_file, hit_page, pdf_files),
+                        )
+                        st.caption(snippet)
+
+            # Page overview: thumbnail sprite sheets instead of the single page
+            if st.toggle("🗂 페이지 한눈에 보기", key="overview_mode"):
+                show_page_overview(pdf_path, pdf_sig, total_pages)
+            else:
+                # Render PDF
+                # We can extract keywords from the last query for highlighting if needed
+                page_no = st.session_state.current_page
+                render_args = viewer_render_args(pdf_path, pdf_sig, page_no)
+
+                viewer = st.empty()
+                # Progressive delivery: ship a cheap preview first unless the sharp
+                # image is already cached (e.g. warmed by the prefetcher).
+                if RENDER_MODE != "legacy" and not is_rendered(pdf_sig, page_no, **render_args):
+                    with metrics.span("page_preview"):
+                        try:
+                            preview = render_viewer_page(pdf_path, pdf_sig, page_no, dpi=PREVIEW_DPI, fmt="jpeg", quality=60)
+                            viewer.image(preview, use_container_width=True)
+                        except RenderBusyError:
+                            pass  # the sharp render below reports the problem
+
+                # Citation highlight boxes (resolved once when the answer arrived)
+                highlight = st.session_state.highlight
+                highlights = ()
+                if highlight and highlight['file'] == selected_file and highlight['page'] == page_no:
+                    highlights = tuple(tuple(r) for r in highlight.get('rects') or [])
+
+                with metrics.span("page_render"):
+                    try:
+                        img_bytes = render_viewer_page(pdf_path, pdf_sig, page_no, highlights=highlights, **render_args)
+                        viewer.image(img_bytes, use_container_width=True)
+                    except RenderBusyError as e:
+                        st.warning(str(e))
+
+                # Warm the neighbouring pages; switching files cancels stale jobs
+                neighbours = []
+                for offset in range(1, PREFETCH_RADIUS + 1):
+                    for candidate in (page_no + offset, page_no - offset):
+                        if 1 <= candidate <= total_pages:
+                            neighbours.append((pdf_path, candidate))
+                prefetch_pages("nav", selected_file, neighbours)
 
 # --- RIGHT COLUMN: Gemini Chat ---
 with col2:
@@ -212,6 +441,8 @@ with col2:
                 } catch(e) { console.log(e); }
             </script>
             '''
+            import streamlit.components.v1 as components  # deferred: only needed to scroll
+
             components.html(js, height=0, width=0)
             st.session_state.scroll_to_top = False
 
@@ -221,59 +452,36 @@ with col2:
         if not api_key:
             st.error("GOOGLE_API_KEY not found in environment variables.")
         else:
-            client = genai.Client(api_key=api_key)
+            # One client and one rate limit shared by every session in this process
+            DISPATCHER.use_api_key(api_key)
             
             # Chat Interface
             user_query = st.chat_input("질문을 입력하세요...")
             
-            # Group messages into conversation turns (User -> Assistant)
-            turns = []
-            current_turn = []
-            for msg in st.session_state.chat_history:
-                if msg["role"] == "user":
-                    if current_turn:
-                        turns.append(current_turn)
-                    current_turn = [msg]
-                else:
-                    current_turn.append(msg)
-            if current_turn:
-                turns.append(current_turn)
+            # Only the newest turns are drawn; older ones are paged in on demand
+            turns = st.session_state.chat_turns
+            window = max(1, st.session_state.chat_window)
+            visible_turns = turns[-window:]
+            hidden_turns = len(turns) - len(visible_turns)
 
             # Display turns in reverse order (Newest turn at the top)
             generation_placeholder = None
             
-            for turn_idx, turn in enumerate(reversed(turns)):
+            for turn_idx, turn in enumerate(reversed(visible_turns)):
                 # Within a turn, display messages in chronological order (Question -> Answer)
-
-                
-                # Within a turn, display messages in chronological order (Question -> Answer)
-                for msg_idx, msg in enumerate(turn):
+                for msg in turn:
                     with st.chat_message(msg["role"]):
                         st.write(msg["content"])
                         
-                        # If message has sources, display them (only for assistant usually)
-                        if "sources" in msg and msg["sources"]:
+                        # Source buttons (deduplicated when the message was appended)
+                        if msg.get("source_buttons"):
                             st.write("📌 **관련 출처:**")
-                            
-                            # Deduplicate sources locally for display
-                            unique_sources = []
-                            seen = set()
-                            for s in msg["sources"]:
-                                key = (s['title'], s['page'])
-                                if key not in seen:
-                                    seen.add(key)
-                                    unique_sources.append(s)
-                                    
-                            # Display buttons
-                            for idx, src in enumerate(unique_sources):
-                                label = f"📄 {src['title']} (p.{src['page']})"
-                                # Unique key is crucial (mix turn_idx to avoid collision)
-                                btn_key = f"hist_src_{turn_idx}_{msg_idx}_{idx}"
+                            for btn in msg["source_buttons"]:
                                 st.button(
-                                    label, 
-                                    key=btn_key,
+                                    btn["label"],
+                                    key=btn["key"],
                                     on_click=jump_to_source,
-                                    args=(src['title'], src['page'], pdf_files)
+                                    args=(btn["title"], btn["page"], pdf_files, btn["rects"])
                                 )
                         
                         # Display Bad Button for Assistant
@@ -302,82 +510,77 @@ with col2:
                      generation_placeholder = st.empty()
                 
                 # Turn Divider
-                if turn_idx < len(turns) - 1: # Divider AFTER turn (visually below since reversed)
+                if turn_idx < len(visible_turns) - 1: # Divider AFTER turn (visually below since reversed)
                      # Wait, reversed order: Top is Newest.
                      # Divider should be BELOW this turn.
                      st.divider() 
 
-
-
+            if hidden_turns:
+                st.divider()
+                st.button(
+                    f"이전 대화 더 보기 ({hidden_turns}개)",
+                    key="load_older_turns",
+                    on_click=load_older_turns,
+                    use_container_width=True,
+                )
 
             if user_query:
                 # Add user message to history
-                st.session_state.chat_history.append({"role": "user", "content": user_query})
+                append_message({"role": "user", "content": user_query})
 
-                st.rerun() # Rerun to show the user message immediately via the loop above
+                rerun() # Rerun to show the user message immediately via the loop above
 
             # Check if the last message was from user, if so, generate response
             if generation_placeholder and st.session_state.chat_history and st.session_state.chat_history[-1]["role"] == "user":
                 with generation_placeholder.container():
                     with st.chat_message("assistant"):
+                        stream_area = st.empty()
                         with st.spinner("문서를 검색 중입니다..."):
                             try:
-                                # Call Gemini API
-                                response = client.models.generate_content(
-                                    model="gemini-2.5-flash", 
-                                    contents=st.session_state.chat_history[-1]["content"],
-                                    config=types.GenerateContentConfig(
-                                        temperature=0.0,
-                                        system_instruction="""
-                                        너는 금융 규제 전문가야. 
-                                        반드시 제공된 'File Search' 결과 내의 정보만을 바탕으로 답변해야 해.
-                                        파일에 없는 수치나 내용은 절대 지어내지 말고, 
-                                        만약 파일에서 찾을 수 없다면 '해당 정보는 문서에 포함되어 있지 않습니다'라고 대답해.
-                                        """,
-                                        tools=[
-                                            types.Tool(
-                                                file_search=types.FileSearch(
-                                                    file_search_store_names=["fileSearchStores/jbriskmanual-01q1nf25k1tw"]
-                                                )
-                                            )
-                                        ]
-                                    )
+                                # Call Gemini API (repeated questions are served from the answer cache,
+                                # identical questions in flight from other sessions share one call)
+                                question = st.session_state.chat_history[-1]["content"]
+                                result = DISPATCHER.ask(
+                                    question,
+                                    on_text=(lambda text: stream_area.markdown(text + " ▌")) if STREAM_ANSWERS else None,
+                                    stream=STREAM_ANSWERS,
+                                    resolver=resolve_chunks,
                                 )
-                                
-                                # Process Sources
-                                source_list = []
-                                if response.candidates and response.candidates[0].grounding_metadata:
-                                     metadata = response.candidates[0].grounding_metadata
-                                     if metadata.grounding_chunks:
-                                        for chunk in metadata.grounding_chunks:
-                                            source = chunk.retrieved_context
-                                            if source and source.text:
-                                                title = source.title
-                                                page_match = re.search(r'--- PAGE (\d+) ---', source.text)
-                                                if page_match:
-                                                    page_num = int(page_match.group(1))
-                                                    source_list.append({"title": title, "page": page_num})
-                                
+                                answer_text = result["text"]
+                                source_list = result["sources"]
 
-                                
                                 # Create Log Entry
                                 log_entry = logger.create_log_entry(
-                                    question=st.session_state.chat_history[-1]["content"],
-                                    answer=response.text,
-                                    sources=source_list
+                                    question=question,
+                                    answer=answer_text,
+                                    sources=source_list,
+                                    cached=result["cached"],
+                                    ttft_ms=round(result["timings"]["ttft_ms"], 1),
+                                    total_ms=round(result["timings"]["total_ms"], 1),
                                 )
-                                logger.save_log(log_entry)
+                                # Written by the background log writer; don't block the answer on disk I/O
+                                with metrics.span("log_submit"):
+                                    LOG_WRITER.submit_entry(log_entry)
+                                    LOG_WRITER.submit_cache_link(result["cache_key"], log_entry["id"])
 
                                 # Save to history
-                                st.session_state.chat_history.append({
+                                append_message({
                                     "role": "assistant", 
-                                    "content": response.text,
+                                    "content": answer_text,
                                     "sources": source_list,
                                     "log_id": log_entry["id"],
                                     "bad": False
                                 })
                                 
                                 
+                                # Warm every cited page before the user clicks on it
+                                cited = []
+                                for src in source_list:
+                                    real_source = normalize_source_name(src['title'], pdf_files)
+                                    if real_source in pdf_files:
+                                        cited.append((os.path.join("data", real_source), src['page']))
+                                prefetch_pages("sources", log_entry["id"], cited)
+
                                 # Auto-jump to the first source if available
                                 if source_list:
                                     first_src = source_list[0]
@@ -386,16 +589,16 @@ with col2:
                                         # Set pending jump for next run to avoid StreamlitAPIException
                                         st.session_state.pending_auto_jump = {
                                             'file': real_source,
-                                            'page': first_src['page']
-                                        }
-
-                                        st.session_state.pending_auto_jump = {
-                                            'file': real_source,
-                                            'page': first_src['page']
+                                            'page': first_src['page'],
+                                            'rects': first_src.get('rects', [])
                                         }
 
                                 st.session_state.scroll_to_top = True
-                                st.rerun() 
+                                rerun() 
 
+                            except GeminiBusyError as e:
+                                st.warning(str(e))
                             except Exception as e:
-                                st.error(f"오류가 발생했습니다: {e}")
\ No newline at end of file
+                                st.error(f"오류가 발생했습니다: {e}")
+
+run_span.end()
@@ -0,0 +1,200 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+import uuid
+from contextlib import closing
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CACHE_PATH = os.getenv("ANSWER_CACHE_PATH", os.path.join(BASE_DIR, "cache", "answers.sqlite3"))
+CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL_HOURS", "168")) * 3600
+CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "5000"))
+# Store versions are re-read this often, to pick up re-indexing done by another process
+VERSION_TTL = float(os.getenv("ANSWER_CACHE_VERSION_TTL", "60"))
+# Hit bookkeeping (last_used, hits) is written back at most this often
+TOUCH_INTERVAL = float(os.getenv("ANSWER_CACHE_TOUCH_INTERVAL", "30"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS answers (
+    key TEXT PRIMARY KEY,
+    question TEXT NOT NULL,
+    store TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    sources TEXT NOT NULL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS answers_last_used ON answers (last_used);
+CREATE INDEX IF NOT EXISTS answers_store ON answers (store);
+CREATE TABLE IF NOT EXISTS served (
+    log_id TEXT PRIMARY KEY,
+    key TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS served_key ON served (key);
+CREATE TABLE IF NOT EXISTS store_versions (
+    store TEXT PRIMARY KEY,
+    version TEXT NOT NULL
+);
+"""
+
+
+def normalize_question(question: str) -> str:
+    """Folds width/case/whitespace and trailing punctuation so trivially different questions share a key."""
+    text = unicodedata.normalize("NFKC", question).lower()
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.rstrip(" ?？.!~")
+
+
+class AnswerCache:
+    """
+    Persistent question -> answer cache (SQLite) for File Search calls.
+
+    The key covers the normalised question, model, system instruction, store
+    name and the store's index version, so re-indexing a store (see
+    invalidate_store) orphans every answer produced against the old index.
+    Entries expire after `ttl` seconds and the least recently used ones are
+    dropped beyond `max_entries`. Each log ID an answer was served under is
+    remembered so a bad-feedback mark can evict it.
+
+    Store versions are kept in memory, and cache hits only update last_used
+    and hits in memory until the next put() or TOUCH_INTERVAL, so a hit costs
+    one read and no write.
+    """
+
+    def __init__(self, path: str = CACHE_PATH, ttl: float = CACHE_TTL, max_entries: int = CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._ready = False
+        self._lock = threading.Lock()
+        self._versions = {}   # store -> (version, loaded at)
+        self._touched = {}    # key -> [last_used, hits] not yet written
+        self._touched_since = 0.0
+
+    def _connect(self):
+        if not self._ready:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with closing(sqlite3.connect(self.path, timeout=10)) as conn, conn:
+                conn.executescript(_SCHEMA)
+            self._ready = True
+        return sqlite3.connect(self.path, timeout=10)
+
+    def store_version(self, store: str) -> str:
+        now = time.monotonic()
+        with self._lock:
+            cached = self._versions.get(store)
+        if cached is not None and now - cached[1] < VERSION_TTL:
+            return cached[0]
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT version FROM store_versions WHERE store = ?", (store,)).fetchone()
+        version = row[0] if row else ""
+        with self._lock:
+            self._versions[store] = (version, now)
+        return version
+
+    def make_key(self, question: str, model: str, system_instruction: str, store: str) -> str:
+        payload = json.dumps(
+            [normalize_question(question), model, system_instruction, store, self.store_version(store)],
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        """Returns {"answer", "sources"} for a live entry, or None."""
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            row = conn.execute(
+                "SELECT answer, sources, created FROM answers WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and now - row[2] > self.ttl:
+                self._delete_keys(conn, [key])
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+        self.hits += 1
+        with self._lock:
+            if not self._touched:
+                self._touched_since = now
+            touch = self._touched.setdefault(key, [now, 0])
+            touch[0] = now
+            touch[1] += 1
+            due = now - self._touched_since >= TOUCH_INTERVAL
+        if due:
+            with closing(self._connect()) as conn, conn:
+                self._write_touches(conn)
+        return {"answer": row[0], "sources": json.loads(row[1])}
+
+    def _write_touches(self, conn):
+        """Writes the buffered hit bookkeeping in the caller's transaction."""
+        with self._lock:
+            touched, self._touched = self._touched, {}
+        conn.executemany(
+            "UPDATE answers SET last_used = MAX(last_used, ?), hits = hits + ? WHERE key = ?",
+            [(last_used, hits, key) for key, (last_used, hits) in touched.items()],
+        )
+
+    def put(self, key: str, question: str, store: str, answer: str, sources: list):
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            # LRU eviction below needs up-to-date last_used values
+            self._write_touches(conn)
+            conn.execute(
+                "INSERT OR REPLACE INTO answers (key, question, store, answer, sources, created, last_used, hits) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, 0)",
+                (key, question, store, answer, json.dumps(sources, ensure_ascii=False), now, now),
+            )
+            stale = conn.execute(
+                "SELECT key FROM answers ORDER BY last_used DESC LIMIT -1 OFFSET ?", (self.max_entries,)
+            ).fetchall()
+            self._delete_keys(conn, [k for (k,) in stale])
+
+    def link_log(self, key: str, log_id: str):
+        """Remembers that `log_id` was answered from `key`."""
+        self.link_logs([(key, log_id)])
+
+    def link_logs(self, links):
+        """link_log() for many (key, log_id) pairs in one transaction."""
+        with closing(self._connect()) as conn, conn:
+            conn.executemany("INSERT OR REPLACE INTO served (key, log_id) VALUES (?, ?)", links)
+
+    def evict_log(self, log_id: str) -> bool:
+        """Evicts the answer that was served under `log_id` (e.g. marked bad)."""
+        with closing(self._connect()) as conn, conn:
+            row = conn.execute("SELECT key FROM served WHERE log_id = ?", (log_id,)).fetchone()
+            if row is None:
+                return False
+            self._delete_keys(conn, [row[0]])
+        return True
+
+    def invalidate_store(self, store: str) -> str:
+        """Bumps the store's index version and drops its answers. Returns the new version."""
+        version = uuid.uuid4().hex
+        with closing(self._connect()) as conn, conn:
+            conn.execute("INSERT OR REPLACE INTO store_versions (store, version) VALUES (?, ?)", (store, version))
+            keys = conn.execute("SELECT key FROM answers WHERE store = ?", (store,)).fetchall()
+            self._delete_keys(conn, [k for (k,) in keys])
+        with self._lock:
+            self._versions[store] = (version, time.monotonic())
+        return version
+
+    def stats(self) -> dict:
+        with closing(self._connect()) as conn:
+            (entries,) = conn.execute("SELECT COUNT(*) FROM answers").fetchone()
+        return {"entries": entries, "hits": self.hits, "misses": self.misses}
+
+    @staticmethod
+    def _delete_keys(conn, keys):
+        for key in keys:
+            conn.execute("DELETE FROM answers WHERE key = ?", (key,))
+            conn.execute("DELETE FROM served WHERE key = ?", (key,))
+
+
+ANSWER_CACHE = AnswerCache()
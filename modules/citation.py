@@ -0,0 +1,209 @@
+"""
+Resolves File Search grounding chunks to exact pages and highlight boxes.
+
+Every PDF's word boxes are extracted once per content hash and persisted
+under cache/citations. A chunk is split at its "--- PAGE N ---" markers, and
+each piece is located by substring match against the whitespace-free page
+text (exact matches on any page first, then head/tail probes), so chunks without a marker still resolve and chunks that straddle a
+marker are attributed to both pages.
+"""
+import bisect
+import functools
+import json
+import os
+import re
+import unicodedata
+
+from modules.fileio import atomic_write_json
+from modules.pdf_processor import file_signature, open_document
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(BASE_DIR, "data")
+LAYOUT_DIR = os.path.join(BASE_DIR, "cache", "citations")
+LAYOUT_VERSION = 1
+
+PAGE_MARKER = re.compile(r'--- PAGE (\d+) ---')
+MIN_MATCH_CHARS = 8   # shorter pieces are too ambiguous to locate
+PROBE_CHARS = 24      # head/tail probe length when the full piece does not match
+
+_SPACE = re.compile(r"\s+")
+
+
+def _normalize(text: str) -> str:
+    return _SPACE.sub("", unicodedata.normalize("NFKC", text)).lower()
+
+
+class PageLayout:
+    """Whitespace-free text of a page with the word boxes that produced it."""
+
+    __slots__ = ("norm", "starts", "rects", "lines")
+
+    def __init__(self, words):
+        parts = []
+        self.starts = []
+        self.rects = []
+        self.lines = []
+        pos = 0
+        for x0, y0, x1, y1, word, block, line in words:
+            token = _normalize(word)
+            if not token:
+                continue
+            self.starts.append(pos)
+            self.rects.append((x0, y0, x1, y1))
+            self.lines.append((block, line))
+            parts.append(token)
+            pos += len(token)
+        self.norm = "".join(parts)
+
+    def find(self, piece: str):
+        """Returns the (start, end) span of `piece` in this page, or None."""
+        pos = self.norm.find(piece)
+        if pos >= 0:
+            return pos, pos + len(piece)
+        return None
+
+    def probe(self, piece: str):
+        """
+        Locates a piece that does not match exactly (e.g. a hyphenated or
+        reflowed chunk) by its head and tail. Returns (span, ends matched)
+        or None; two matched ends are a stronger hit than one.
+        """
+        if len(piece) <= PROBE_CHARS:
+            return None
+        head, tail = piece[:PROBE_CHARS], piece[-PROBE_CHARS:]
+        start = self.norm.find(head)
+        end = self.norm.find(tail, max(start, 0))
+        if start >= 0 and end >= 0:
+            return (start, end + len(tail)), 2
+        if start >= 0:
+            return (start, min(len(self.norm), start + len(piece))), 1
+        if end >= 0:
+            return (max(0, end + len(tail) - len(piece)), end + len(tail)), 1
+        return None
+
+    def boxes(self, span) -> list:
+        """Merges the boxes of words overlapping `span` into one rectangle per text line."""
+        first = max(0, bisect.bisect_right(self.starts, span[0]) - 1)
+        last = bisect.bisect_left(self.starts, span[1])
+        merged = {}
+        for i in range(first, last):
+            x0, y0, x1, y1 = self.rects[i]
+            key = self.lines[i]
+            if key in merged:
+                mx0, my0, mx1, my1 = merged[key]
+                merged[key] = (min(mx0, x0), min(my0, y0), max(mx1, x1), max(my1, y1))
+            else:
+                merged[key] = (x0, y0, x1, y1)
+        return [[round(v, 1) for v in rect] for rect in merged.values()]
+
+
+def _extract_words(pdf_path: str) -> list:
+    with open_document(pdf_path) as doc:
+        return [
+            [[round(w[0], 1), round(w[1], 1), round(w[2], 1), round(w[3], 1), w[4], w[5], w[6]]
+             for w in doc.load_page(i).get_text("words")]
+            for i in range(doc.page_count)
+        ]
+
+
+@functools.lru_cache(maxsize=8)
+def load_layout(pdf_path: str, sig: str) -> list:
+    """Per-page layouts for this exact file content, read from (or written to) the layout cache."""
+    path = os.path.join(LAYOUT_DIR, f"{sig}.json")
+    pages = None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            payload = json.load(f)
+        if payload.get("version") == LAYOUT_VERSION:
+            pages = payload["pages"]
+    except (OSError, json.JSONDecodeError):
+        pass
+
+    if pages is None:
+        pages = _extract_words(pdf_path)
+        atomic_write_json(path, {"version": LAYOUT_VERSION, "pages": pages})
+
+    return [PageLayout(words) for words in pages]
+
+
+def split_pieces(text: str) -> list:
+    """Splits chunk text at page markers into [(page hint or None, text)]."""
+    parts = PAGE_MARKER.split(text)
+    pieces = []
+    first_marker = int(parts[1]) if len(parts) > 1 else None
+    # Text before the first marker is the tail of the previous page
+    pieces.append((first_marker - 1 if first_marker and first_marker > 1 else None, parts[0]))
+    for i in range(1, len(parts) - 1, 2):
+        pieces.append((int(parts[i]), parts[i + 1]))
+    return pieces
+
+
+def _locate(layouts: list, order, piece: str):
+    """
+    An exact match on any page beats a probe hit, so a heading repeated on
+    an earlier page cannot steal the piece; among probe hits, head+tail
+    beats one end. Ties go to the earlier page in `order` (hint first).
+    """
+    for i in order:
+        span = layouts[i].find(piece)
+        if span is not None:
+            return {"page": i + 1, "rects": layouts[i].boxes(span)}
+    best = None
+    for i in order:
+        hit = layouts[i].probe(piece)
+        if hit is not None and (best is None or hit[1] > best[2]):
+            best = (i, hit[0], hit[1])
+            if hit[1] == 2:
+                break
+    if best is None:
+        return None
+    i, span, _ = best
+    return {"page": i + 1, "rects": layouts[i].boxes(span)}
+
+
+def resolve_text(pdf_path: str, sig: str, text: str) -> list:
+    """Returns [{"page", "rects"}] for every page the chunk text came from."""
+    layouts = load_layout(pdf_path, sig)
+    results = []
+    for hint, raw in split_pieces(text):
+        piece = _normalize(raw)
+        if len(piece) < MIN_MATCH_CHARS:
+            continue
+        order = range(len(layouts))
+        if hint and 1 <= hint <= len(layouts):
+            order = [hint - 1] + [i for i in range(len(layouts)) if i != hint - 1]
+        found = _locate(layouts, order, piece)
+        if found is None and hint:
+            found = {"page": hint, "rects": []}
+        if found is not None:
+            results.append(found)
+    return results
+
+
+def find_source_file(title: str, data_dir: str = DATA_DIR):
+    """Maps a File Search document title to a PDF path (exact name, then with .pdf)."""
+    for name in (title, f"{title}.pdf"):
+        path = os.path.join(data_dir, name)
+        if name.lower().endswith(".pdf") and os.path.isfile(path):
+            return path
+    return None
+
+
+def resolve_chunks(chunks, data_dir: str = DATA_DIR) -> list:
+    """
+    Turns [{"title", "text"}] grounding chunks into [{"title", "page", "rects"}].
+    Chunks whose document is not available locally fall back to their page marker.
+    """
+    sources = []
+    for chunk in chunks:
+        title, text = chunk["title"], chunk["text"]
+        pdf_path = find_source_file(title, data_dir) if title else None
+        if pdf_path is None:
+            match = PAGE_MARKER.search(text)
+            if match:
+                sources.append({"title": title, "page": int(match.group(1)), "rects": []})
+            continue
+        sig = file_signature(pdf_path)
+        for hit in resolve_text(pdf_path, sig, text):
+            sources.append({"title": title, "page": hit["page"], "rects": hit["rects"]})
+    return sources
@@ -0,0 +1,368 @@
+"""
+Process-wide dispatcher for Gemini File Search calls.
+
+Every Streamlit session asks through DISPATCHER instead of building its own
+client on each rerun:
+  * one client is created per API key and reused;
+  * identical questions in flight at the same time (same answer-cache key)
+    share one call, and every waiter receives the streamed text as it arrives;
+  * API calls take a token from a token bucket and are retried with jittered
+    exponential backoff on quota / transient server errors;
+  * calls run on a bounded worker pool, so a burst of sessions queues instead
+    of fanning out.
+
+Cached answers are served on the caller's thread and never use a worker or a
+token. The client, clock, sleep and random source can all be injected, so the
+dispatcher runs against a fake client in tests and benchmarks.
+"""
+import copy
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from modules import metrics
+from modules.answer_cache import ANSWER_CACHE
+from modules.qa import answer_question, cached_answer, stream_answer
+
+GEMINI_WORKERS = int(os.getenv("GEMINI_WORKERS", "4"))
+GEMINI_RATE_PER_MIN = float(os.getenv("GEMINI_RATE_PER_MIN", "60"))
+GEMINI_BURST = int(os.getenv("GEMINI_BURST", "5"))
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "4"))
+GEMINI_BACKOFF_BASE = float(os.getenv("GEMINI_BACKOFF_BASE", "1.0"))
+GEMINI_BACKOFF_MAX = float(os.getenv("GEMINI_BACKOFF_MAX", "20.0"))
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "180"))
+
+RETRY_CODES = {429, 500, 502, 503, 504}
+
+
+class GeminiBusyError(RuntimeError):
+    """Raised when Gemini stays rate-limited/unavailable after every retry, or the wait times out."""
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """Quota and transient server errors (anything carrying one of RETRY_CODES) plus network errors."""
+    code = getattr(exc, "code", None)
+    if code is None:
+        code = getattr(exc, "status_code", None)
+    if isinstance(code, int) and code in RETRY_CODES:
+        return True
+    return isinstance(exc, (ConnectionError, TimeoutError))
+
+
+class TokenBucket:
+    """Blocking token bucket: `rate` tokens per second, holding at most `capacity`."""
+
+    def __init__(self, rate: float, capacity: int, clock=time.monotonic, sleep=time.sleep):
+        self.rate = max(float(rate), 1e-9)
+        self.capacity = max(1, int(capacity))
+        self._tokens = float(self.capacity)
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, timeout: float = None) -> bool:
+        """Takes one token, waiting as long as needed (or `timeout` seconds). Returns False on timeout."""
+        deadline = None if timeout is None else self._clock() + timeout
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if deadline is not None:
+                remaining = deadline - self._clock()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            self._sleep(wait)
+
+
+class _Flight:
+    """One in-flight question: the latest streamed text, then the result or the error."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self.text = ""
+        self.version = 0
+        self.done = False
+        self.result = None
+        self.error = None
+
+    def publish(self, text: str):
+        with self._cond:
+            self.text = text
+            self.version += 1
+            self._cond.notify_all()
+
+    def finish(self, result=None, error=None):
+        with self._cond:
+            self.result = result
+            self.error = error
+            self.done = True
+            self._cond.notify_all()
+
+    def follow(self, on_text=None, timeout: float = GEMINI_TIMEOUT):
+        """Blocks until the flight is done, calling `on_text` (on this thread) whenever new text arrives."""
+        deadline = time.monotonic() + timeout
+        seen = 0
+        while True:
+            with self._cond:
+                while not self.done and self.version == seen:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise GeminiBusyError("Gemini 응답 대기 시간이 초과되었습니다.")
+                    self._cond.wait(remaining)
+                done, version, text = self.done, self.version, self.text
+            if on_text and version != seen and text:
+                on_text(text)
+            seen = version
+            if done:
+                # Every waiter gets its own copy, so one session mutating its
+                # result (or re-raising its error) cannot affect another.
+                if self.error is not None:
+                    raise _copy_error(self.error)
+                return copy.deepcopy(self.result)
+
+
+def _copy_error(error: BaseException) -> BaseException:
+    """A copy of `error` carrying its traceback and chain; the original if it cannot be copied."""
+    try:
+        clone = copy.copy(error)
+    except Exception:
+        return error
+    if type(clone) is not type(error):
+        return error
+    clone.__cause__ = error.__cause__
+    clone.__context__ = error.__context__
+    clone.__suppress_context__ = error.__suppress_context__
+    return clone.with_traceback(error.__traceback__)
+
+
+class _GuardedModels:
+    """Wraps client.models so every call is rate-limited and retried by the dispatcher."""
+
+    def __init__(self, dispatcher, models):
+        self._dispatcher = dispatcher
+        self._models = models
+
+    def generate_content(self, **kwargs):
+        return self._dispatcher._with_retries(lambda: self._models.generate_content(**kwargs))
+
+    def generate_content_stream(self, **kwargs):
+        # Only the call and its first chunk are retried; once text has been
+        # handed out a retry would duplicate it, so later errors propagate.
+        def start():
+            stream = iter(self._models.generate_content_stream(**kwargs))
+            try:
+                return stream, next(stream)
+            except StopIteration:
+                return stream, None
+
+        stream, first = self._dispatcher._with_retries(start)
+        if first is not None:
+            yield first
+            yield from stream
+
+
+class _GuardedClient:
+    def __init__(self, dispatcher, client):
+        self.models = _GuardedModels(dispatcher, client.models)
+
+
+class GeminiDispatcher:
+    """Shared client, single-flight coalescing, rate limiting and retries for Gemini calls."""
+
+    def __init__(
+        self,
+        client=None,
+        workers: int = GEMINI_WORKERS,
+        rate_per_min: float = GEMINI_RATE_PER_MIN,
+        burst: int = GEMINI_BURST,
+        max_retries: int = GEMINI_MAX_RETRIES,
+        backoff_base: float = GEMINI_BACKOFF_BASE,
+        backoff_max: float = GEMINI_BACKOFF_MAX,
+        timeout: float = GEMINI_TIMEOUT,
+        clock=time.monotonic,
+        sleep=time.sleep,
+        rand=random.random,
+    ):
+        self.workers = max(1, int(workers))
+        self.max_retries = max(0, int(max_retries))
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.bucket = TokenBucket(rate_per_min / 60.0, burst, clock=clock, sleep=sleep)
+        self._sleep = sleep
+        self._rand = rand
+        self._lock = threading.Lock()
+        self._client = None
+        self._api_key = None
+        self._guarded = None
+        self._pool = None
+        self._flights = {}  # answer-cache key -> _Flight
+        self.calls = 0
+        self.retries = 0
+        self.coalesced = 0
+        if client is not None:
+            self.set_client(client)
+
+    # -------------------------------------------------
+    # Client
+    # -------------------------------------------------
+    def set_client(self, client):
+        """Uses `client` (a genai.Client or anything with the same .models methods) for every call."""
+        with self._lock:
+            self._client = client
+            self._guarded = _GuardedClient(self, client)
+
+    def use_api_key(self, api_key: str):
+        """
+        Uses a genai.Client for `api_key`. The client (and the google.genai
+        import) is created on the first question that misses the cache, so
+        calling this on every rerun is free.
+        """
+        with self._lock:
+            if self._api_key != api_key:
+                self._api_key = api_key
+                self._client = None
+                self._guarded = None
+
+    def _ensure_client(self):
+        with self._lock:
+            if self._guarded is not None:
+                return self._guarded
+            api_key = self._api_key
+        if api_key is None:
+            raise RuntimeError("GeminiDispatcher has no client; call use_api_key() or set_client() first.")
+        from google import genai
+
+        client = genai.Client(api_key=api_key)
+        with self._lock:
+            if self._guarded is None and self._api_key == api_key:
+                self._client = client
+                self._guarded = _GuardedClient(self, client)
+            return self._guarded
+
+    @property
+    def client(self):
+        return self._client
+
+    # -------------------------------------------------
+    # Asking
+    # -------------------------------------------------
+    def ask(self, question: str, on_text=None, stream: bool = True, cache=ANSWER_CACHE, resolver=None) -> dict:
+        """
+        Answers `question`; returns the dict of qa.answer_question(). Cached
+        answers return at once; otherwise the caller joins (or starts) the
+        flight for this question and `on_text` receives the accumulated text.
+        Raises GeminiBusyError when the API stays unavailable.
+        """
+        cached, cache_key = cached_answer(question, cache)
+        if cached is not None:
+            if on_text:
+                on_text(cached["text"])
+            return cached
+        guarded = self._ensure_client()
+
+        with self._lock:
+            flight = self._flights.get(cache_key)
+            if flight is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                flight = self._flights[cache_key] = _Flight()
+                leader = True
+        if leader:
+            self._executor().submit(self._run, guarded, flight, cache_key, question, stream, cache, resolver)
+        else:
+            metrics.incr("gemini_coalesced")
+        return flight.follow(on_text, self.timeout)
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._flights)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": len(self._flights),
+                "calls": self.calls,
+                "retries": self.retries,
+                "coalesced": self.coalesced,
+            }
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+    # -------------------------------------------------
+    # Internals
+    # -------------------------------------------------
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="gemini")
+            return self._pool
+
+    def _run(self, client, flight, cache_key, question, stream, cache, resolver):
+        result, error = None, None
+        try:
+            if stream:
+                result = stream_answer(
+                    client, question, on_text=flight.publish,
+                    cache=cache, resolver=resolver, check_cache=False,
+                )
+            else:
+                result = answer_question(client, question, cache=cache, resolver=resolver, check_cache=False)
+        except BaseException as e:  # handed to every waiter
+            error = e
+        finally:
+            # Leave the table before waking waiters so a new ask sees the cache, not this flight
+            with self._lock:
+                self._flights.pop(cache_key, None)
+            flight.finish(result, error)
+
+    def _backoff(self, attempt: int) -> float:
+        """Full jitter: uniform in [0, min(max, base * 2**attempt)]."""
+        return self._rand() * min(self.backoff_max, self.backoff_base * (2 ** attempt))
+
+    def _with_retries(self, call):
+        attempt = 0
+        while True:
+            with metrics.span("gemini.rate_wait"):
+                if not self.bucket.acquire(timeout=self.timeout):
+                    raise GeminiBusyError("Gemini 요청 한도를 초과했습니다. 잠시 후 다시 시도해 주세요.")
+            with self._lock:
+                self.calls += 1
+            try:
+                value = call()
+                metrics.incr("gemini_calls", result="ok")
+                return value
+            except Exception as e:
+                if not is_retryable(e):
+                    metrics.incr("gemini_calls", result="error")
+                    raise
+                if attempt >= self.max_retries:
+                    metrics.incr("gemini_calls", result="exhausted")
+                    raise GeminiBusyError(
+                        "Gemini 요청 한도를 초과했거나 서버가 응답하지 않습니다. 잠시 후 다시 시도해 주세요."
+                    ) from e
+                metrics.incr("gemini_calls", result="retry")
+                with self._lock:
+                    self.retries += 1
+                self._sleep(self._backoff(attempt))
+                attempt += 1
+
+
+DISPATCHER = GeminiDispatcher()
@@ -0,0 +1,79 @@
+"""
+Atomic file writes shared by the caches, indexes and reports.
+
+Every writer goes through a temp file in the target's directory and
+os.replace(), so readers (and other processes) never see a partial file.
+If writing fails, the temp file is removed and the old target is left as is.
+Temp files are named ".tmp-*" so cache eviction can recognise in-flight ones.
+"""
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+
+TMP_PREFIX = ".tmp-"
+
+# Read once: os.umask() can only be queried by setting it, which would race other threads
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _target_mode(path: str) -> int:
+    """Mode of the existing target, or the umask default for a new file."""
+    try:
+        return os.stat(path).st_mode & 0o7777
+    except OSError:
+        return 0o666 & ~_UMASK
+
+
+@contextmanager
+def atomic_path(path: str):
+    """
+    Yields a temp file path next to `path` for the caller to write; on a
+    clean exit it replaces `path`, otherwise it is deleted.
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=TMP_PREFIX)
+    try:
+        try:
+            # mkstemp creates 0600; give the file the mode open() would have
+            os.fchmod(fd, _target_mode(path))
+        finally:
+            os.close(fd)
+        yield tmp_path
+        os.replace(tmp_path, path)
+    except BaseException:
+        remove_quietly(tmp_path)
+        raise
+
+
+@contextmanager
+def atomic_write(path: str, mode: str = "w", encoding: str = "utf-8", newline: str = None):
+    """Like open(path, mode), but the content only appears at `path` once fully written."""
+    with atomic_path(path) as tmp_path:
+        if "b" in mode:
+            with open(tmp_path, mode) as f:
+                yield f
+        else:
+            with open(tmp_path, mode, encoding=encoding, newline=newline) as f:
+                yield f
+
+
+def atomic_write_json(path: str, payload, **dump_args):
+    """Writes `payload` as UTF-8 JSON (ensure_ascii=False unless overridden)."""
+    dump_args.setdefault("ensure_ascii", False)
+    with atomic_write(path) as f:
+        json.dump(payload, f, **dump_args)
+
+
+def atomic_write_bytes(path: str, data: bytes):
+    with atomic_write(path, "wb") as f:
+        f.write(data)
@@ -0,0 +1,237 @@
+"""
+Uploads the PDFs in data/ to the Gemini File Search store.
+
+Each PDF is converted to text with a "--- PAGE N ---" marker before every
+page (the marker the app uses to cite pages), then uploaded. Uploads run
+concurrently with bounded parallelism, all operations are polled together,
+and files whose content hash matches the local manifest are skipped.
+
+    python -m modules.ingest [--store fileSearchStores/...] [--workers 4] [--force]
+
+`ingest()` takes the client as an argument, so it can be driven by any
+object exposing file_search_stores.upload_to_file_search_store,
+file_search_stores.documents.delete and operations.get.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from modules.fileio import atomic_write_json
+from modules.pdf_processor import file_signature, open_document
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(BASE_DIR, "data")
+TEXT_DIR = os.path.join(BASE_DIR, "cache", "ingest")
+MANIFEST_PATH = os.path.join(BASE_DIR, "cache", "ingest_manifest.json")
+
+UPLOAD_WORKERS = 4
+POLL_INTERVAL = 5.0
+INDEX_TIMEOUT = 1800.0  # seconds to wait for every upload to finish indexing
+CHUNKING_CONFIG = {
+    'white_space_config': {
+        'max_tokens_per_chunk': 200,
+        'max_overlap_tokens': 20
+    }
+}
+
+
+def load_manifest(path: str = MANIFEST_PATH) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def save_manifest(manifest: dict, path: str = MANIFEST_PATH):
+    atomic_write_json(path, manifest, indent=4)
+
+
+def write_marked_text(pdf_path: str, out_dir: str = TEXT_DIR) -> str:
+    """Writes the PDF's text with a page marker before every page; returns the text file path."""
+    os.makedirs(out_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(pdf_path))[0]
+    out_path = os.path.join(out_dir, f"{stem}.txt")
+    with open_document(pdf_path) as doc:
+        pages = [doc.load_page(i).get_text() for i in range(doc.page_count)]
+    with open(out_path, "w", encoding="utf-8") as f:
+        for page_no, text in enumerate(pages, start=1):
+            f.write(f"--- PAGE {page_no} ---\n{text}\n")
+    return out_path
+
+
+def plan(pdf_paths, store_entries: dict, force: bool = False):
+    """Returns [(pdf_path, sig)] that need uploading, skipping unchanged files."""
+    todo = []
+    for pdf_path in pdf_paths:
+        sig = file_signature(pdf_path)
+        previous = store_entries.get(os.path.basename(pdf_path))
+        if force or not previous or previous.get("sha256") != sig:
+            todo.append((pdf_path, sig))
+    return todo
+
+
+def _upload(client, store_name: str, pdf_path: str):
+    text_path = write_marked_text(pdf_path, TEXT_DIR)
+    display_name = os.path.splitext(os.path.basename(pdf_path))[0]
+    return client.file_search_stores.upload_to_file_search_store(
+        file=text_path,
+        file_search_store_name=store_name,
+        config={
+            'display_name': display_name,
+            'mime_type': 'text/plain',
+            'chunking_config': CHUNKING_CONFIG,
+        }
+    )
+
+
+def wait_all(
+    client,
+    operations: dict,
+    poll_interval: float = POLL_INTERVAL,
+    log=print,
+    timeout: float = INDEX_TIMEOUT,
+) -> dict:
+    """
+    Polls every pending operation each round until all are done or `timeout`
+    seconds have passed. `operations` maps key -> operation; returns the
+    finished ones (keys still pending at the deadline are left out).
+    """
+    pending = {key: op for key, op in operations.items() if not op.done}
+    done = {key: op for key, op in operations.items() if op.done}
+    deadline = time.monotonic() + timeout
+    while pending:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            for key in pending:
+                log(f"{key} 인덱싱 시간 초과.")
+            break
+        time.sleep(min(poll_interval, remaining))
+        for key, op in list(pending.items()):
+            op = client.operations.get(op)
+            if op.done:
+                done[key] = op
+                del pending[key]
+                log(f"{key} 인덱싱 완료.")
+            else:
+                pending[key] = op
+    return done
+
+
+def ingest(
+    client,
+    store_name: str,
+    data_dir: str = DATA_DIR,
+    manifest_path: str = MANIFEST_PATH,
+    workers: int = UPLOAD_WORKERS,
+    poll_interval: float = POLL_INTERVAL,
+    force: bool = False,
+    log=print,
+    timeout: float = INDEX_TIMEOUT,
+) -> dict:
+    """
+    Uploads new or changed PDFs from `data_dir` to `store_name` and records
+    them in the manifest. Returns {"uploaded": [...], "skipped": [...], "failed": {...}}.
+    """
+    pdf_paths = sorted(
+        os.path.join(data_dir, f) for f in os.listdir(data_dir) if f.lower().endswith(".pdf")
+    )
+    manifest = load_manifest(manifest_path)
+    store_entries = manifest.setdefault(store_name, {})
+    todo = plan(pdf_paths, store_entries, force)
+    skipped = [os.path.basename(p) for p in pdf_paths if p not in {t[0] for t in todo}]
+    for name in skipped:
+        log(f"{name} 변경 없음, 건너뜀.")
+
+    operations, failed = {}, {}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {
+            os.path.basename(pdf_path): pool.submit(_upload, client, store_name, pdf_path)
+            for pdf_path, _ in todo
+        }
+        for name, future in futures.items():
+            try:
+                operations[name] = future.result()
+                log(f"{name} 업로드 시작...")
+            except Exception as e:
+                failed[name] = str(e)
+                log(f"{name} 업로드 실패: {e}")
+
+    finished = wait_all(client, operations, poll_interval, log, timeout)
+    for name in operations:
+        if name not in finished:
+            failed[name] = "indexing timed out"
+
+    uploaded, indexed = [], False
+    sigs = dict((os.path.basename(p), sig) for p, sig in todo)
+    for name, op in finished.items():
+        if op.error:
+            failed[name] = str(op.error)
+            continue
+        indexed = True
+        previous = store_entries.get(name, {}).get("document")
+        document = getattr(op.response, "document_name", None) if op.response else None
+        if document is None:
+            # Without the new document's name the old one is the only one we can
+            # still cite and delete later, so keep it and its manifest entry.
+            failed[name] = "upload response has no document name"
+            log(f"{name} 새 문서 이름을 확인할 수 없어 이전 문서를 유지합니다.")
+            continue
+        if previous and previous != document:
+            # Replace rather than duplicate the old version of this file
+            try:
+                client.file_search_stores.documents.delete(name=previous, config={'force': True})
+            except Exception as e:
+                log(f"{name} 이전 문서 삭제 실패: {e}")
+        store_entries[name] = {
+            "sha256": sigs[name],
+            "document": document,
+            "uploaded_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        uploaded.append(name)
+    save_manifest(manifest, manifest_path)
+
+    if indexed:
+        # Answers produced against the old index must not be served again
+        from modules.answer_cache import ANSWER_CACHE
+        ANSWER_CACHE.invalidate_store(store_name)
+
+    return {"uploaded": uploaded, "skipped": skipped, "failed": failed}
+
+
+def main(argv=None):
+    from modules.qa import FILE_SEARCH_STORE
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--store", default=FILE_SEARCH_STORE)
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--workers", type=int, default=UPLOAD_WORKERS)
+    parser.add_argument("--poll-interval", type=float, default=POLL_INTERVAL)
+    parser.add_argument("--timeout", type=float, default=INDEX_TIMEOUT, help="seconds to wait for indexing")
+    parser.add_argument("--force", action="store_true", help="re-upload even unchanged files")
+    args = parser.parse_args(argv)
+
+    from dotenv import load_dotenv
+    from google import genai
+
+    load_dotenv('../../etc/.env')
+    client = genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
+    result = ingest(
+        client,
+        args.store,
+        data_dir=args.data_dir,
+        workers=args.workers,
+        poll_interval=args.poll_interval,
+        force=args.force,
+        timeout=args.timeout,
+    )
+    print(json.dumps(result, ensure_ascii=False, indent=4))
+    return 1 if result["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
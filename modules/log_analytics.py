@@ -0,0 +1,532 @@
+"""
+Streaming analytics over the chat log.
+
+    python -m modules.log_analytics                    # only records appended since the last run
+    python -m modules.log_analytics --full             # start over from the first record
+    python -m modules.log_analytics --format parquet --top 50
+
+Records are read one line at a time through logger.iter_records() and only
+aggregates are kept:
+  * answers and bad answers per source document and per (document, page);
+  * the most frequent questions, counted with the Space-Saving algorithm so
+    the table never holds more than TOP_CAPACITY questions;
+  * answers that cited no source, appended to no_source_answers as found
+    (its "bad" column is the flag when the row was written; later feedback
+    only moves the no_source_bad count in the summary);
+  * ttft_ms / total_ms histograms, split by cached vs live answers.
+
+The aggregates, the log position and the committed length of
+no_source_answers are checkpointed in state.json next to the reports, so a
+rerun reads only what was appended since; rows appended by a run that died
+before its checkpoint are cut off again first. A feedback record
+that flips the "bad" flag of an entry counted by an earlier run is applied by
+one extra pass over the older records that looks up just those entries.
+Parquet output needs pyarrow.
+"""
+import argparse
+import csv
+import heapq
+import json
+import os
+import shutil
+import sys
+import time
+import uuid
+
+import modules.logger as logger
+from modules.fileio import atomic_path, atomic_write, atomic_write_json
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ANALYTICS_DIR = os.getenv("LOG_ANALYTICS_DIR", os.path.join(BASE_DIR, "log", "analytics"))
+STATE_NAME = "state.json"
+STATE_VERSION = 1
+TOP_CAPACITY = int(os.getenv("LOG_ANALYTICS_TOP_CAPACITY", "2000"))
+OUTPUT_FORMATS = ("csv", "parquet")
+
+LATENCY_FIELDS = ("ttft_ms", "total_ms")
+# Histogram upper bounds in milliseconds; the last slot counts everything slower
+LATENCY_BUCKETS_MS = (100, 250, 500, 1000, 2000, 3000, 5000, 8000, 13000, 20000, 30000, 60000)
+
+# "bad" is the flag at the time the row is appended; rows are never rewritten
+NO_SOURCE_COLUMNS = ("id", "timestamp", "question", "bad", "cached", "total_ms")
+
+
+def normalize_question(question) -> str:
+    """Folds whitespace and case so trivially different phrasings count as one question."""
+    return " ".join(str(question or "").split()).lower()
+
+
+def _rate(bad: int, total: int):
+    return round(bad / total, 4) if total else None
+
+
+class LogAnalytics:
+    """Aggregates over log entries that fit in memory however long the log grows."""
+
+    def __init__(self, top_capacity: int = TOP_CAPACITY):
+        self.top_capacity = max(1, int(top_capacity))
+        self.position = None   # (segment, offset) of the last record processed
+        self.entries = 0
+        self.bad = 0
+        self.no_source = 0
+        self.no_source_bad = 0
+        self.pages = {}        # (title, page) -> [answers, bad]
+        self.documents = {}    # title -> [answers, bad]
+        self.questions = {}    # normalized question -> [count, error, bad, text]
+        self.latency = {}      # (field, "cached" | "live") -> bucket counts + [overflow, sum]
+        self.sink = None       # committed no_source_answers per format, see NoSourceSink
+        self._heap = []        # (count, question) with stale entries, see _evict()
+
+    # -------------------------------------------------
+    # Checkpoint
+    # -------------------------------------------------
+    @classmethod
+    def load(cls, path: str, top_capacity: int = TOP_CAPACITY):
+        """Restores a checkpoint written by save(), or starts empty if there is none."""
+        analytics = cls(top_capacity)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return analytics
+        if state.get("version") != STATE_VERSION:
+            return analytics
+        analytics.position = tuple(state["position"]) if state.get("position") else None
+        analytics.entries = state["entries"]
+        analytics.bad = state["bad"]
+        analytics.no_source = state["no_source"]
+        analytics.no_source_bad = state["no_source_bad"]
+        analytics.pages = {(title, page): [n, bad] for title, page, n, bad in state["pages"]}
+        analytics.documents = {title: [n, bad] for title, n, bad in state["documents"]}
+        analytics.questions = {key: slot for key, slot in state["questions"]}
+        analytics.latency = {(field, label): counts for field, label, counts in state["latency"]}
+        analytics.sink = state.get("sink")  # None in checkpoints from before it was recorded
+        analytics._rebuild_heap()
+        return analytics
+
+    def save(self, path: str):
+        """Writes the checkpoint atomically."""
+        state = {
+            "version": STATE_VERSION,
+            "position": list(self.position) if self.position else None,
+            "entries": self.entries,
+            "bad": self.bad,
+            "no_source": self.no_source,
+            "no_source_bad": self.no_source_bad,
+            "pages": [[title, page, n, bad] for (title, page), (n, bad) in self.pages.items()],
+            "documents": [[title, n, bad] for title, (n, bad) in self.documents.items()],
+            "questions": [[key, slot] for key, slot in self.questions.items()],
+            "latency": [[field, label, counts] for (field, label), counts in self.latency.items()],
+            "sink": self.sink,
+        }
+        atomic_write_json(path, state)
+
+    # -------------------------------------------------
+    # Reading the log
+    # -------------------------------------------------
+    def update(self, on_no_source=None) -> int:
+        """
+        Folds in every record appended since the checkpoint position and
+        advances it. `on_no_source(entry)` is called for each new entry that
+        cited no source. Returns the number of new entries.
+        """
+        start = self.position
+        # Pass 1: the feedback in the new range, and where the range ends
+        feedback = {}
+        end = None
+        for segment, offset, record in self._records(start):
+            end = (segment, offset)
+            if record.get("op") == "feedback":
+                feedback[record.get("id")] = bool(record.get("bad"))
+        if end is None:
+            return 0
+
+        # Pass 2: the new entries, counted with their final "bad" flag
+        added = 0
+        for _, _, record in self._records(start, end):
+            if record.get("op") == "feedback" or "id" not in record:
+                continue
+            if record["id"] in feedback:
+                record["bad"] = feedback.pop(record["id"])
+            if self.add_entry(record) and on_no_source:
+                on_no_source(record)
+            added += 1
+
+        # What is left is feedback on entries counted by an earlier run
+        if feedback and start is not None:
+            self._apply_late_feedback(feedback, start)
+        self.position = end
+        return added
+
+    @staticmethod
+    def _records(start=None, end=None):
+        """logger.iter_records() strictly after `start` and up to `end` (both (segment, offset))."""
+        for segment, offset, record in logger.iter_records(start):
+            position = (segment, offset)
+            if start is not None and position <= start:
+                continue  # the checkpointed record itself
+            if end is not None and position > end:
+                return
+            yield segment, offset, record
+
+    def _apply_late_feedback(self, feedback: dict, start: tuple):
+        # Find the flag each entry was counted with: its own, or the latest
+        # feedback before the checkpoint. Memory grows with `feedback` only.
+        counted = {}  # log id -> [question, sources, bad]
+        for segment, offset, record in logger.iter_records():
+            if (segment, offset) > start:
+                break
+            log_id = record.get("id")
+            if log_id not in feedback:
+                continue
+            if record.get("op") == "feedback":
+                if log_id in counted:
+                    counted[log_id][2] = bool(record.get("bad"))
+            else:
+                counted[log_id] = [record.get("question"), record.get("sources"), bool(record.get("bad"))]
+        for log_id, (question, sources, was_bad) in counted.items():
+            if feedback[log_id] != was_bad:
+                self.adjust_bad({"question": question, "sources": sources}, 1 if feedback[log_id] else -1)
+
+    # -------------------------------------------------
+    # Aggregation
+    # -------------------------------------------------
+    @staticmethod
+    def _source_pages(entry) -> set:
+        return {
+            (s.get("title"), s.get("page"))
+            for s in entry.get("sources") or []
+            if isinstance(s, dict) and s.get("title")
+        }
+
+    def add_entry(self, entry: dict) -> bool:
+        """Counts one log entry. Returns True if it cited no source."""
+        bad = int(bool(entry.get("bad")))
+        self.entries += 1
+        self.bad += bad
+        pages = self._source_pages(entry)
+        for key in pages:
+            counts = self.pages.setdefault(key, [0, 0])
+            counts[0] += 1
+            counts[1] += bad
+        for title in {title for title, _ in pages}:
+            counts = self.documents.setdefault(title, [0, 0])
+            counts[0] += 1
+            counts[1] += bad
+        if not pages:
+            self.no_source += 1
+            self.no_source_bad += bad
+
+        self._count_question(entry.get("question"), bad)
+        label = "cached" if entry.get("cached") else "live"
+        for field in LATENCY_FIELDS:
+            value = entry.get(field)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                self._observe(field, label, float(value))
+        return not pages
+
+    def adjust_bad(self, entry: dict, delta: int):
+        """Moves an already counted entry between good and bad (delta is +1 or -1)."""
+        self.bad += delta
+        pages = self._source_pages(entry)
+        for key in pages:
+            if key in self.pages:
+                self.pages[key][1] += delta
+        for title in {title for title, _ in pages}:
+            if title in self.documents:
+                self.documents[title][1] += delta
+        if not pages:
+            self.no_source_bad += delta
+        slot = self.questions.get(normalize_question(entry.get("question")))
+        if slot is not None:
+            slot[2] = max(0, slot[2] + delta)
+
+    def _count_question(self, question, bad: int):
+        key = normalize_question(question)
+        if not key:
+            return
+        slot = self.questions.get(key)
+        if slot is None:
+            # Space-Saving: a new question replaces the least counted one and
+            # inherits its count as the upper bound of its own error.
+            floor = self._evict()[0] if len(self.questions) >= self.top_capacity else 0
+            slot = self.questions[key] = [floor, floor, 0, str(question).strip()]
+        slot[0] += 1
+        slot[2] += bad
+        heapq.heappush(self._heap, (slot[0], key))
+        if len(self._heap) > 4 * self.top_capacity:
+            self._rebuild_heap()
+
+    def _evict(self) -> list:
+        # The heap holds stale (count, key) pairs; skip those that no longer match
+        while True:
+            count, key = heapq.heappop(self._heap)
+            slot = self.questions.get(key)
+            if slot is not None and slot[0] == count:
+                return self.questions.pop(key)
+
+    def _rebuild_heap(self):
+        self._heap = [(slot[0], key) for key, slot in self.questions.items()]
+        heapq.heapify(self._heap)
+
+    def _observe(self, field: str, label: str, value: float):
+        counts = self.latency.get((field, label))
+        if counts is None:
+            counts = self.latency[(field, label)] = [0] * (len(LATENCY_BUCKETS_MS) + 2)
+        slot = len(LATENCY_BUCKETS_MS)
+        for i, bound in enumerate(LATENCY_BUCKETS_MS):
+            if value <= bound:
+                slot = i
+                break
+        counts[slot] += 1
+        counts[-1] += value
+
+    # -------------------------------------------------
+    # Reports
+    # -------------------------------------------------
+    def page_rows(self) -> list:
+        rows = [
+            (title, page, n, bad, _rate(bad, n))
+            for (title, page), (n, bad) in self.pages.items()
+        ]
+        return sorted(rows, key=lambda r: (-r[3], -r[2], str(r[0]), str(r[1])))
+
+    def document_rows(self) -> list:
+        rows = [(title, n, bad, _rate(bad, n)) for title, (n, bad) in self.documents.items()]
+        return sorted(rows, key=lambda r: (-r[2], -r[1], str(r[0])))
+
+    def question_rows(self, top: int) -> list:
+        """(question, count, count_error, bad, bad_rate), most frequent first; count - count_error is a lower bound."""
+        slots = heapq.nlargest(top, self.questions.values(), key=lambda s: (s[0], -s[1]))
+        return [(text, count, error, bad, _rate(bad, count - error)) for count, error, bad, text in slots]
+
+    def latency_rows(self) -> list:
+        rows = []
+        for (field, label), counts in sorted(self.latency.items()):
+            bounds = [str(b) for b in LATENCY_BUCKETS_MS] + ["+Inf"]
+            rows.extend((field, label, bound, count) for bound, count in zip(bounds, counts))
+        return rows
+
+    def percentile(self, field: str, label: str, q: float):
+        """Upper bound (ms) of the histogram bucket holding the q-quantile, or None."""
+        counts = self.latency.get((field, label))
+        if not counts:
+            return None
+        total = sum(counts[:-1])
+        if not total:
+            return None
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS_MS + (float("inf"),), counts):
+            cumulative += count
+            if cumulative >= q * total:
+                return bound
+        return float("inf")
+
+    def summary_rows(self) -> list:
+        rows = [
+            ("entries", self.entries),
+            ("bad", self.bad),
+            ("bad_rate", _rate(self.bad, self.entries)),
+            ("no_source_answers", self.no_source),
+            ("no_source_bad", self.no_source_bad),
+            ("no_source_bad_rate", _rate(self.no_source_bad, self.no_source)),
+            ("questions_tracked", len(self.questions)),
+        ]
+        for field, label in sorted(self.latency):
+            counts = self.latency[(field, label)]
+            n = sum(counts[:-1])
+            rows.append((f"{field}.{label}.count", n))
+            rows.append((f"{field}.{label}.mean", round(counts[-1] / n, 1) if n else None))
+            for q in (0.5, 0.9, 0.99):
+                rows.append((f"{field}.{label}.p{int(q * 100)}_le", self.percentile(field, label, q)))
+        return rows
+
+
+# =====================================================
+# 출력 (CSV / Parquet)
+# =====================================================
+def _write_table(out_dir: str, name: str, columns, rows, fmt: str):
+    """Writes one report table atomically as <name>.csv or <name>.parquet."""
+    path = os.path.join(out_dir, f"{name}.{fmt}")
+    if fmt == "parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        data = {col: [row[i] for row in rows] for i, col in enumerate(columns)}
+        with atomic_path(path) as tmp_path:
+            pq.write_table(pa.table(data), tmp_path)
+    else:
+        with atomic_write(path, encoding="utf-8-sig", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            writer.writerows(rows)
+    return path
+
+
+class NoSourceSink:
+    """
+    Appends no-source answers as they are found: to no_source_answers.csv,
+    or as one part file per run under no_source_answers/ for Parquet (a
+    directory that Parquet readers load as one table).
+
+    `committed` is what the last checkpoint recorded (see committed_state());
+    anything appended after it, by a run that failed before saving its
+    checkpoint, is removed first so those rows are not written twice.
+    None means unknown (an older checkpoint) and leaves the files as they are.
+    """
+
+    BATCH_ROWS = 5000
+
+    def __init__(self, out_dir: str, fmt: str, committed=None):
+        self.fmt = fmt
+        self.rows = 0
+        self._batch = []
+        self._writer = None
+        self._committed = committed
+        if fmt == "parquet":
+            self.path = os.path.join(out_dir, "no_source_answers")
+            os.makedirs(self.path, exist_ok=True)
+            if committed is not None:
+                for name in os.listdir(self.path):
+                    if name.startswith("part-") and name not in committed:
+                        os.remove(os.path.join(self.path, name))
+            self._part = os.path.join(self.path, f"part-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.parquet")
+        else:
+            self.path = os.path.join(out_dir, "no_source_answers.csv")
+            if committed is not None and os.path.exists(self.path) and os.path.getsize(self.path) > committed:
+                os.truncate(self.path, committed)
+            new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+            self._file = open(self.path, "a", encoding="utf-8-sig" if new else "utf-8", newline="")
+            self._csv = csv.writer(self._file)
+            if new:
+                self._csv.writerow(NO_SOURCE_COLUMNS)
+
+    def __call__(self, entry: dict):
+        row = tuple(entry.get(col) for col in NO_SOURCE_COLUMNS)
+        self.rows += 1
+        if self.fmt == "parquet":
+            self._batch.append(row)
+            if len(self._batch) >= self.BATCH_ROWS:
+                self._flush()
+        else:
+            self._csv.writerow(row)
+
+    def _flush(self):
+        if not self._batch:
+            return
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.table({
+            "id": pa.array([r[0] for r in self._batch], pa.string()),
+            "timestamp": pa.array([r[1] for r in self._batch], pa.string()),
+            "question": pa.array([r[2] for r in self._batch], pa.string()),
+            "bad": pa.array([bool(r[3]) for r in self._batch], pa.bool_()),
+            "cached": pa.array([r[4] for r in self._batch], pa.bool_()),
+            "total_ms": pa.array([r[5] for r in self._batch], pa.float64()),
+        })
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self._part, table.schema)
+        self._writer.write_table(table)
+        self._batch = []
+
+    def close(self):
+        if self.fmt == "parquet":
+            self._flush()
+            if self._writer is not None:
+                self._writer.close()
+        else:
+            self._file.close()
+
+    def committed_state(self):
+        """What the checkpoint records once this run's rows are final: the CSV size, or the part files."""
+        if self.fmt == "parquet":
+            parts = list(self._committed or [])
+            if self._writer is not None:
+                parts.append(os.path.basename(self._part))
+            return parts
+        return os.path.getsize(self.path)
+
+
+def write_reports(analytics: LogAnalytics, out_dir: str, fmt: str = "csv", top: int = 20) -> list:
+    """Writes every aggregate table to `out_dir`. Returns the written paths."""
+    tables = [
+        ("summary", ("metric", "value"), analytics.summary_rows()),
+        ("bad_rate_by_document", ("title", "answers", "bad", "bad_rate"), analytics.document_rows()),
+        ("bad_rate_by_page", ("title", "page", "answers", "bad", "bad_rate"), analytics.page_rows()),
+        ("top_questions", ("question", "count", "count_error", "bad", "bad_rate"), analytics.question_rows(top)),
+        ("latency_histogram", ("field", "cached", "le_ms", "count"), analytics.latency_rows()),
+    ]
+    return [_write_table(out_dir, name, columns, rows, fmt) for name, columns, rows in tables]
+
+
+def run(out_dir: str = ANALYTICS_DIR, fmt: str = "csv", full: bool = False, top: int = 20,
+        top_capacity: int = TOP_CAPACITY) -> dict:
+    """
+    Updates the checkpointed aggregates with the records appended since the
+    last run (all records with full=True) and rewrites the reports.
+    """
+    if fmt not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output format: {fmt}")
+    if fmt == "parquet":
+        import pyarrow  # noqa: F401  (fail before reading the log)
+
+    state_path = os.path.join(out_dir, STATE_NAME)
+    os.makedirs(out_dir, exist_ok=True)
+    if full:
+        for name in os.listdir(out_dir):
+            path = os.path.join(out_dir, name)
+            if name == "no_source_answers":
+                shutil.rmtree(path, ignore_errors=True)
+            elif name == STATE_NAME or name.startswith("no_source_answers."):
+                os.remove(path)
+    analytics = LogAnalytics.load(state_path, top_capacity)
+    sinks = dict(analytics.sink or {})
+    if analytics.position is None:
+        committed = [] if fmt == "parquet" else 0  # nothing checkpointed yet
+    else:
+        committed = sinks.get(fmt) if analytics.sink is not None else None
+
+    t0 = time.perf_counter()
+    sink = NoSourceSink(out_dir, fmt, committed)
+    try:
+        added = analytics.update(on_no_source=sink)
+    finally:
+        sink.close()
+    paths = write_reports(analytics, out_dir, fmt, top)
+    # The sink's new rows only count once this checkpoint is saved
+    sinks[fmt] = sink.committed_state()
+    analytics.sink = sinks
+    analytics.save(state_path)
+    return {
+        "added": added,
+        "entries": analytics.entries,
+        "position": analytics.position,
+        "elapsed_ms": (time.perf_counter() - t0) * 1000,
+        "paths": paths,
+        "analytics": analytics,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", default=ANALYTICS_DIR, help="report and checkpoint directory")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default="csv")
+    parser.add_argument("--full", action="store_true", help="ignore the checkpoint and start from the first record")
+    parser.add_argument("--top", type=int, default=20, help="questions in top_questions")
+    args = parser.parse_args(argv)
+
+    result = run(args.out, args.format, args.full, args.top)
+    analytics = result["analytics"]
+    print(f"{result['added']} new entries ({analytics.entries} total) in {result['elapsed_ms']:.0f} ms")
+    print(f"bad: {analytics.bad} ({_rate(analytics.bad, analytics.entries) or 0:.1%}), "
+          f"no source: {analytics.no_source}")
+    for title, page, n, bad, rate in analytics.page_rows()[:5]:
+        if bad:
+            print(f"  {title} p.{page}: {bad}/{n} bad")
+    print(f"reports: {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
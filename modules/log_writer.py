@@ -0,0 +1,190 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+import modules.logger as logger
+from modules import metrics
+from modules.answer_cache import ANSWER_CACHE
+
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "1000"))
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "50"))
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "0.5"))  # seconds
+LOG_WRITE_RETRIES = int(os.getenv("LOG_WRITE_RETRIES", "3"))
+LOG_RETRY_DELAY = float(os.getenv("LOG_RETRY_DELAY", "0.5"))  # seconds, doubled per retry
+
+_log = logging.getLogger(__name__)
+
+
+class AsyncLogWriter:
+    """
+    Moves log writes off the request path.
+
+    Entries and feedback updates are queued and written by a background
+    thread, which group-commits them with logger.commit_batch() once
+    `batch_size` items are waiting or `flush_interval` seconds have passed.
+    A failed batch is logged and retried `retries` times with backoff before
+    it is given up. If the queue is full, the writer is drained first and the
+    item is then written synchronously rather than dropped, so feedback never
+    overtakes the entry it refers to.
+
+    Answer cache bookkeeping (which log entry was served from which cached
+    answer, and evictions of answers marked bad) rides the same queue, so an
+    eviction is never applied before the link it depends on.
+    """
+
+    _STOP = object()
+
+    def __init__(
+        self,
+        max_queue: int = LOG_QUEUE_SIZE,
+        batch_size: int = LOG_BATCH_SIZE,
+        flush_interval: float = LOG_FLUSH_INTERVAL,
+        retries: int = LOG_WRITE_RETRIES,
+        retry_delay: float = LOG_RETRY_DELAY,
+        cache=ANSWER_CACHE,
+    ):
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = flush_interval
+        self.retries = max(0, int(retries))
+        self.retry_delay = retry_delay
+        self.cache = cache
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.batches = 0
+        self.errors = 0    # failed write attempts
+        self.dropped = 0   # items given up after every retry failed
+
+    def submit_entry(self, entry):
+        """Queues a log entry created by logger.create_log_entry()."""
+        self._submit(("entry", entry))
+
+    def submit_feedback(self, log_id, is_bad):
+        """Queues a 'bad' flag update for a log entry."""
+        self._submit(("feedback", (log_id, is_bad)))
+
+    def submit_cache_link(self, key, log_id):
+        """Queues AnswerCache.link_log(key, log_id)."""
+        self._submit(("link", (key, log_id)))
+
+    def submit_cache_eviction(self, log_id):
+        """Queues AnswerCache.evict_log(log_id), applied after every link queued before it."""
+        self._submit(("evict", log_id))
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Blocks until everything queued so far is written. Returns False on timeout."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def close(self, timeout: float = 5.0):
+        """Writes out pending items and stops the writer thread."""
+        if self._thread is None:
+            return
+        self._queue.put(self._STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _submit(self, item):
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            # Earlier items (e.g. the entry this feedback refers to) go first
+            self.flush()
+            self._write([item])
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while item is not self._STOP and len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(item)
+
+            stop = batch[-1] is self._STOP
+            items = batch[:-1] if stop else batch
+            try:
+                self._write(items)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if stop:
+                return
+
+    def _write(self, items):
+        if not items:
+            return True
+        entries = [payload for kind, payload in items if kind == "entry"]
+        feedback = [payload for kind, payload in items if kind == "feedback"]
+        links = [payload for kind, payload in items if kind == "link"]
+        evictions = [payload for kind, payload in items if kind == "evict"]
+        ok = True
+        if links or evictions:
+            ok = self._with_retries(
+                lambda: self._update_cache(links, evictions),
+                "answer cache update (%d links, %d evictions)" % (len(links), len(evictions)),
+                len(links) + len(evictions),
+            )
+        if entries or feedback:
+            if self._with_retries(
+                lambda: logger.commit_batch(entries, feedback),
+                "chat log write (%d entries, %d feedback)" % (len(entries), len(feedback)),
+                len(entries) + len(feedback),
+            ):
+                self.batches += 1
+            else:
+                ok = False
+        return ok
+
+    def _update_cache(self, links, evictions):
+        # Links first: an eviction may refer to an answer linked in this same batch
+        if links:
+            self.cache.link_logs(links)
+        for log_id in evictions:
+            self.cache.evict_log(log_id)
+
+    def _with_retries(self, write, what: str, count: int) -> bool:
+        delay = self.retry_delay
+        for attempt in range(self.retries + 1):
+            try:
+                write()
+                return True
+            except Exception:
+                self.errors += 1
+                metrics.incr("log_write_errors")
+                _log.exception("%s failed (attempt %d/%d)", what, attempt + 1, self.retries + 1)
+            if attempt < self.retries:
+                time.sleep(delay)
+                delay *= 2
+        self.dropped += count
+        metrics.incr("log_items_dropped", count)
+        _log.error("giving up on %s after %d attempts", what, self.retries + 1)
+        return False
+
+LOG_WRITER = AsyncLogWriter()
+atexit.register(LOG_WRITER.close)
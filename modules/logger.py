@@ -1,53 +1,273 @@
 import json
 import os
+import threading
 import uuid
+from contextlib import contextmanager
 from datetime import datetime
 
+from modules import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-LOG_FILE = os.path.join(BASE_DIR, "log", "chat_logs.json")
+LOG_DIR = os.path.join(BASE_DIR, "log")
+LOG_FILE = os.path.join(LOG_DIR, "chat_logs.json")  # legacy JSON array, migrated once
+SEGMENT_DIR = os.path.join(LOG_DIR, "chat_logs")
+LOCK_FILE = os.path.join(SEGMENT_DIR, ".lock")
+SEGMENT_MAX_BYTES = int(os.getenv("LOG_SEGMENT_MB", "64")) * 1024 * 1024
 
-def ensure_log_file():
-    """Ensures the log file exists and initializes it if necessary."""
-    log_dir = os.path.dirname(LOG_FILE)
-    if log_dir and not os.path.exists(log_dir):
-        os.makedirs(log_dir)
-    if not os.path.exists(LOG_FILE):
-        with open(LOG_FILE, "w", encoding="utf-8") as f:
-            json.dump([], f, ensure_ascii=False, indent=4)
+# Log layout: append-only JSONL segments (segment-000001.jsonl, ...).
+# Each line is either a log entry as created by create_log_entry(), or a
+# feedback record {"op": "feedback", "id": ..., "bad": ...} that overrides
+# the entry's "bad" flag. Nothing already written is ever rewritten.
 
-def load_logs():
-    """Loads existing logs from the JSON file."""
-    ensure_log_file()
+_thread_lock = threading.Lock()
+_index = {}       # log id -> (segment name, byte offset)
+_feedback = {}    # log id -> latest "bad" value from feedback records
+_scanned = {}     # segment name -> bytes already indexed
+
+
+@contextmanager
+def _locked():
+    """Serialises writers across threads and processes sharing the log directory."""
+    with _thread_lock:
+        os.makedirs(SEGMENT_DIR, exist_ok=True)
+        with open(LOCK_FILE, "a+b") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            else:
+                lock.seek(0)
+                msvcrt.locking(lock.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+                else:
+                    lock.seek(0)
+                    msvcrt.locking(lock.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _segments():
+    """Returns segment file names in write order."""
+    if not os.path.isdir(SEGMENT_DIR):
+        return []
+    return sorted(f for f in os.listdir(SEGMENT_DIR) if f.startswith("segment-") and f.endswith(".jsonl"))
+
+
+def _segment_name(number):
+    return f"segment-{number:06d}.jsonl"
+
+
+def _active_segment():
+    """Returns the segment to append to, rotating once it exceeds SEGMENT_MAX_BYTES."""
+    segments = _segments()
+    if not segments:
+        return _segment_name(1)
+    last = segments[-1]
+    if os.path.getsize(os.path.join(SEGMENT_DIR, last)) < SEGMENT_MAX_BYTES:
+        return last
+    return _segment_name(int(last[len("segment-"):-len(".jsonl")]) + 1)
+
+
+def _encode(record):
+    return (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def _append_records(records):
+    # Caller holds _locked()
+    segment = _active_segment()
+    lines = [_encode(r) for r in records]
+    with open(os.path.join(SEGMENT_DIR, segment), "ab") as f:
+        start = f.tell()
+        f.write(b"".join(lines))
+        f.flush()
+        os.fsync(f.fileno())
+
+    # If the index was caught up with this segment, extend it directly instead
+    # of re-reading what we just wrote on the next _refresh_index().
+    if _scanned.get(segment, 0) == start:
+        offset = start
+        for record, line in zip(records, lines):
+            _index_parsed(segment, offset, record)
+            offset += len(line)
+        _scanned[segment] = offset
+
+
+def _migrate_legacy_log():
+    # Caller holds _locked()
+    if not os.path.exists(LOG_FILE):
+        return
     try:
         with open(LOG_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
+            legacy = json.load(f)
     except (json.JSONDecodeError, FileNotFoundError):
-        return []
+        legacy = []
+    if legacy:
+        _append_records(legacy)
+    os.replace(LOG_FILE, LOG_FILE + ".migrated")
+
+
+def ensure_log_file():
+    """Ensures the log directory exists and migrates the legacy JSON array once."""
+    if os.path.isdir(SEGMENT_DIR) and not os.path.exists(LOG_FILE):
+        return
+    with _locked():
+        _migrate_legacy_log()
+
+
+def _refresh_index():
+    """Indexes records appended since the last call (by any process)."""
+    for segment in _segments():
+        path = os.path.join(SEGMENT_DIR, segment)
+        start = _scanned.get(segment, 0)
+        if os.path.getsize(path) <= start:
+            continue
+        with open(path, "rb") as f:
+            f.seek(start)
+            offset = start
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # partially written tail; pick it up next time
+                _index_record(segment, offset, line)
+                offset += len(line)
+        _scanned[segment] = offset
+
+
+def _index_record(segment, offset, line):
+    try:
+        record = json.loads(line)
+    except json.JSONDecodeError:
+        return
+    _index_parsed(segment, offset, record)
+
+
+def _index_parsed(segment, offset, record):
+    if record.get("op") == "feedback":
+        _feedback[record.get("id")] = record.get("bad", False)
+    elif "id" in record:
+        _index[record["id"]] = (segment, offset)
+
+
+def iter_records(start=None):
+    """
+    Streams raw records as (segment, offset, record) in write order, starting
+    after the (segment, offset) position `start` if given. Uses constant memory.
+    """
+    ensure_log_file()
+    for segment in _segments():
+        if start and segment < start[0]:
+            continue
+        with open(os.path.join(SEGMENT_DIR, segment), "rb") as f:
+            offset = start[1] if start and segment == start[0] else 0
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    record = None
+                if record is not None:
+                    yield segment, offset, record
+                offset += len(line)
+
+
+def iter_logs():
+    """Streams log entries in write order with feedback records applied."""
+    feedback = {}
+    for _, _, record in iter_records():
+        if record.get("op") == "feedback":
+            feedback[record.get("id")] = record.get("bad", False)
+    for _, _, record in iter_records():
+        if record.get("op") == "feedback":
+            continue
+        if record.get("id") in feedback:
+            record["bad"] = feedback[record["id"]]
+        yield record
+
+
+def load_logs():
+    """Loads all log entries into a list."""
+    return list(iter_logs())
+
+
+def read_entry(log_id):
+    """Returns a single log entry by ID via the offset index, or None."""
+    ensure_log_file()
+    with _thread_lock:
+        _refresh_index()
+        location = _index.get(log_id)
+        bad = _feedback.get(log_id)
+    if location is None:
+        return None
+    segment, offset = location
+    with open(os.path.join(SEGMENT_DIR, segment), "rb") as f:
+        f.seek(offset)
+        entry = json.loads(f.readline())
+    if bad is not None:
+        entry["bad"] = bad
+    return entry
+
+
+def _feedback_record(log_id, is_bad):
+    return {
+        "op": "feedback",
+        "id": log_id,
+        "bad": is_bad,
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+
+def commit_batch(entries, feedback=()):
+    """
+    Appends entries, then (log_id, is_bad) feedback updates, in a single locked
+    write. Feedback for IDs that are neither logged nor in `entries` is skipped.
+    Returns the number of feedback updates applied.
+    """
+    if not entries and not feedback:
+        return 0
+    ensure_log_file()
+    with metrics.span("log_write"), _locked():
+        records = list(entries)
+        applied = 0
+        if feedback:
+            _refresh_index()
+            batch_ids = {e.get("id") for e in entries}
+            for log_id, is_bad in feedback:
+                if log_id in _index or log_id in batch_ids:
+                    records.append(_feedback_record(log_id, is_bad))
+                    _feedback[log_id] = is_bad
+                    applied += 1
+        if records:
+            _append_records(records)
+    metrics.incr("log_records_written", len(entries), kind="entry")
+    metrics.incr("log_records_written", applied, kind="feedback")
+    return applied
+
+
+def save_logs(entries):
+    """Appends several log entries in one write."""
+    commit_batch(entries)
+
 
 def save_log(entry):
-    """Appends a new log entry to the JSON file."""
-    logs = load_logs()
-    logs.append(entry)
-    with open(LOG_FILE, "w", encoding="utf-8") as f:
-        json.dump(logs, f, ensure_ascii=False, indent=4)
+    """Appends a new log entry."""
+    commit_batch([entry])
+
 
 def update_log_feedback(log_id, is_bad):
-    """Updates the 'bad' status of a specific log entry by ID."""
-    logs = load_logs()
-    updated = False
-    for entry in logs:
-        if entry.get("id") == log_id:
-            entry["bad"] = is_bad
-            updated = True
-            break
-    
-    if updated:
-        with open(LOG_FILE, "w", encoding="utf-8") as f:
-            json.dump(logs, f, ensure_ascii=False, indent=4)
-
-def create_log_entry(question, answer, sources):
-    """Creates a dictionary for a new log entry."""
-    return {
+    """Records the 'bad' status of a log entry by ID. Returns False if the ID is unknown."""
+    return commit_batch([], [(log_id, is_bad)]) == 1
+
+
+def create_log_entry(question, answer, sources, **fields):
+    """Creates a dictionary for a new log entry. Extra keyword fields are stored as-is."""
+    entry = {
         "id": str(uuid.uuid4()),
         "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
         "question": question,
@@ -55,3 +275,5 @@ def create_log_entry(question, answer, sources):
         "sources": sources,
         "bad": False
     }
+    entry.update(fields)
+    return entry
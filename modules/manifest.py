@@ -0,0 +1,151 @@
+"""
+Cached manifest of the PDFs in data/.
+
+For every manual the manifest keeps its name, size, mtime, content hash,
+page count and page widths, persisted in cache/manifest.json. A rerun only
+compares the directory's mtime (plus a periodic re-stat of the files, for
+in-place overwrites), so listing files, hashing them and opening them with
+PyMuPDF happen once per change rather than on every rerun or restart.
+
+    python -m modules.manifest
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+from modules.fileio import atomic_write_json
+from modules.pdf_processor import file_signature, open_document, remember_signature
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(BASE_DIR, "data")
+MANIFEST_PATH = os.getenv("DOCUMENT_MANIFEST_PATH", os.path.join(BASE_DIR, "cache", "manifest.json"))
+MANIFEST_VERSION = 1
+RECHECK_SECONDS = float(os.getenv("MANIFEST_RECHECK_SECONDS", "10"))
+
+
+class DocumentManifest:
+    """Thread-safe view of the PDFs in `data_dir`, refreshed only when the directory changes."""
+
+    def __init__(self, data_dir: str = DATA_DIR, path: str = MANIFEST_PATH, recheck: float = RECHECK_SECONDS):
+        self.data_dir = data_dir
+        self.path = path
+        self.recheck = recheck
+        self._lock = threading.Lock()
+        self._docs = None       # name -> entry
+        self._dir_mtime = None
+        self._checked = 0.0
+        self.refreshes = 0
+
+    def documents(self) -> list:
+        """Entries {"name", "size", "mtime_ns", "sha256", "pages", "widths"} sorted by name."""
+        with self._lock:
+            self._refresh()
+            return [self._docs[name] for name in sorted(self._docs)]
+
+    def names(self) -> list:
+        return [doc["name"] for doc in self.documents()]
+
+    def get(self, name: str):
+        with self._lock:
+            self._refresh()
+            return self._docs.get(name)
+
+    def page_width(self, name: str, page: int):
+        """Width of a 1-based page in PDF points, or None if unknown."""
+        doc = self.get(name)
+        if doc is None or not 1 <= page <= len(doc["widths"]):
+            return None
+        return doc["widths"][page - 1]
+
+    def signatures(self) -> tuple:
+        """((name, sha256), ...) — a hashable key for caches built over every manual."""
+        return tuple((doc["name"], doc["sha256"]) for doc in self.documents())
+
+    # Caller holds self._lock
+    def _refresh(self):
+        try:
+            dir_mtime = os.stat(self.data_dir).st_mtime_ns
+        except OSError:
+            self._docs, self._dir_mtime = {}, None
+            return
+        now = time.monotonic()
+        if self._docs is not None and dir_mtime == self._dir_mtime and now - self._checked < self.recheck:
+            return
+        if self._docs is None:
+            self._docs = self._load()
+
+        docs = {}
+        changed = False
+        for name in os.listdir(self.data_dir):
+            if not name.lower().endswith(".pdf"):
+                continue
+            path = os.path.join(self.data_dir, name)
+            try:
+                stat = os.stat(path)
+                entry = self._docs.get(name)
+                if entry is None or entry["size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns:
+                    entry = self._describe(name, path, stat)
+                    changed = True
+                else:
+                    remember_signature(path, stat.st_size, stat.st_mtime_ns, entry["sha256"])
+            except FileNotFoundError:
+                continue  # removed (or renamed) since listdir()
+            docs[name] = entry
+        changed = changed or set(docs) != set(self._docs)
+
+        self._docs = docs
+        self._dir_mtime = dir_mtime
+        self._checked = now
+        if changed:
+            self.refreshes += 1
+            self._save()
+
+    @staticmethod
+    def _describe(name: str, path: str, stat) -> dict:
+        with open_document(path) as doc:
+            widths = [round(doc.load_page(i).rect.width, 2) for i in range(doc.page_count)]
+        return {
+            "name": name,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": file_signature(path),
+            "pages": len(widths),
+            "widths": widths,
+        }
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                payload = json.load(f)
+            if payload.get("version") == MANIFEST_VERSION:
+                return {doc["name"]: doc for doc in payload["documents"]}
+        except (OSError, json.JSONDecodeError, KeyError, TypeError):
+            pass
+        return {}
+
+    def _save(self):
+        try:
+            payload = {"version": MANIFEST_VERSION, "documents": [self._docs[n] for n in sorted(self._docs)]}
+            atomic_write_json(self.path, payload)
+        except OSError:
+            pass  # the in-memory manifest still works; it is rebuilt on the next start
+
+
+MANIFEST = DocumentManifest()
+
+
+def main(argv=None):
+    argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter).parse_args(argv)
+    t0 = time.perf_counter()
+    docs = MANIFEST.documents()
+    print(f"{len(docs)} documents in {(time.perf_counter() - t0) * 1000:.0f} ms")
+    for doc in docs:
+        print(f"{doc['name']}  {doc['pages']} pages  {doc['size']:,} bytes  {doc['sha256'][:12]}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
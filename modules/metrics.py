@@ -0,0 +1,289 @@
+"""
+Per-stage timing spans and counters, exported locally.
+
+Disabled unless METRICS_ENABLED=1. While disabled, span() hands back one
+shared no-op context manager and incr()/observe() return immediately, so the
+instrumentation left in the hot paths costs a function call.
+
+When enabled:
+  * every finished span is appended as a JSON line to log/metrics/spans.jsonl,
+    rotated by size (METRICS_FILE_MB, METRICS_FILE_BACKUPS);
+  * durations are aggregated into histograms and, with the counters, written
+    in Prometheus text format to log/metrics/metrics.prom at most every
+    METRICS_EXPORT_INTERVAL seconds (and at exit);
+  * with METRICS_PORT set, the same text is served at
+    http://<METRICS_HOST>:<port>/metrics (loopback only by default).
+"""
+import atexit
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+
+from modules.fileio import atomic_write
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+METRICS_DIR = os.getenv("METRICS_DIR", os.path.join(BASE_DIR, "log", "metrics"))
+SPANS_NAME = "spans.jsonl"
+PROM_NAME = "metrics.prom"
+
+ENABLED = os.getenv("METRICS_ENABLED", "0") == "1"
+FILE_MAX_BYTES = int(os.getenv("METRICS_FILE_MB", "16")) * 1024 * 1024
+FILE_BACKUPS = int(os.getenv("METRICS_FILE_BACKUPS", "3"))
+EXPORT_INTERVAL = float(os.getenv("METRICS_EXPORT_INTERVAL", "10"))
+PORT = int(os.getenv("METRICS_PORT", "0"))
+HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+PREFIX = "daemini"
+# Histogram upper bounds in seconds (Prometheus convention)
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def end(self):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key: tuple, extra: tuple = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class Registry:
+    """Thread-safe counters and per-stage duration histograms."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}    # (name, label key) -> value
+        self._histograms = {}  # label key -> [bucket counts..., +Inf count, sum]
+
+    def incr(self, name: str, value: float = 1, labels: dict = None):
+        key = (name, _label_key(labels or {}))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, stage: str, seconds: float, labels: dict = None):
+        key = _label_key(dict(labels or {}, stage=stage))
+        slot = bisect.bisect_left(BUCKETS, seconds)
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = [0] * (len(BUCKETS) + 2)
+            hist[slot] += 1
+            hist[-1] += seconds
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "histograms": {k: list(v) for k, v in self._histograms.items()},
+            }
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render_prometheus(self) -> str:
+        """Returns every metric in the Prometheus text exposition format."""
+        snap = self.snapshot()
+        lines = []
+
+        by_name = {}
+        for (name, key), value in sorted(snap["counters"].items()):
+            by_name.setdefault(name, []).append((key, value))
+        for name, series in by_name.items():
+            metric = f"{PREFIX}_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.extend(f"{metric}{_format_labels(key)} {value:g}" for key, value in series)
+
+        if snap["histograms"]:
+            metric = f"{PREFIX}_stage_duration_seconds"
+            lines.append(f"# TYPE {metric} histogram")
+            for key, hist in sorted(snap["histograms"].items()):
+                cumulative = 0
+                for bound, count in zip(BUCKETS, hist):
+                    cumulative += count
+                    lines.append(f"{metric}_bucket{_format_labels(key, (('le', f'{bound:g}'),))} {cumulative}")
+                cumulative += hist[len(BUCKETS)]
+                lines.append(f"{metric}_bucket{_format_labels(key, (('le', '+Inf'),))} {cumulative}")
+                lines.append(f"{metric}_sum{_format_labels(key)} {hist[-1]:.6f}")
+                lines.append(f"{metric}_count{_format_labels(key)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+_span_log = None
+_span_log_lock = threading.Lock()
+_last_export = 0.0
+_server = None
+_serve_failed = False
+
+
+def _span_logger():
+    global _span_log
+    with _span_log_lock:
+        if _span_log is None:
+            os.makedirs(METRICS_DIR, exist_ok=True)
+            handler = RotatingFileHandler(
+                os.path.join(METRICS_DIR, SPANS_NAME), maxBytes=FILE_MAX_BYTES, backupCount=FILE_BACKUPS, encoding="utf-8"
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            log = logging.getLogger("daemini.metrics.spans")
+            log.setLevel(logging.INFO)
+            log.propagate = False
+            log.addHandler(handler)
+            _span_log = log
+        return _span_log
+
+
+class Span:
+    """Times one stage; records on exit (or on end(), whichever comes first)."""
+
+    __slots__ = ("stage", "labels", "started", "done")
+
+    def __init__(self, stage: str, labels: dict):
+        self.stage = stage
+        self.labels = labels
+        self.started = time.perf_counter()
+        self.done = False
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and not self.labels.get("status"):
+            self.labels["status"] = "error"
+        self.end()
+        return False
+
+    def end(self):
+        if self.done:
+            return
+        self.done = True
+        _record(self.stage, time.perf_counter() - self.started, self.labels)
+
+
+def _record(stage: str, seconds: float, labels: dict):
+    REGISTRY.observe(stage, seconds, labels)
+    record = {"ts": round(time.time(), 3), "stage": stage, "ms": round(seconds * 1000, 3)}
+    record.update(labels)
+    _span_logger().info(json.dumps(record, ensure_ascii=False))
+    maybe_export()
+
+
+def span(stage: str, **labels):
+    """
+    Times `stage` as a context manager, or from now until .end() for stages
+    that do not fit a with-block. A shared no-op when metrics are disabled.
+    """
+    if not ENABLED:
+        return _NULL_SPAN
+    return Span(stage, labels)
+
+
+def observe(stage: str, seconds: float, **labels):
+    """Records a duration measured elsewhere (e.g. time to first token) as if it were a span."""
+    if not ENABLED:
+        return
+    _record(stage, seconds, labels)
+
+
+def incr(name: str, value: float = 1, **labels):
+    """Adds `value` to the counter `name` (exported as <prefix>_<name>_total)."""
+    if not ENABLED:
+        return
+    REGISTRY.incr(name, value, labels)
+
+
+def export(path: str = None):
+    """Writes the Prometheus text to `path` (default: metrics.prom in METRICS_DIR) atomically."""
+    global _last_export
+    _last_export = time.monotonic()
+    if path is None:
+        path = os.path.join(METRICS_DIR, PROM_NAME)
+    with atomic_write(path) as f:
+        f.write(REGISTRY.render_prometheus())
+
+
+def maybe_export():
+    if ENABLED and time.monotonic() - _last_export >= EXPORT_INTERVAL:
+        try:
+            export()
+        except OSError:
+            pass
+
+
+def serve(port: int = None, host: str = None):
+    """
+    Starts the /metrics HTTP endpoint once per process (no-op when disabled or
+    port is 0). A failed bind is not retried on later calls (script reruns).
+    """
+    global _server, _serve_failed
+    port = PORT if port is None else port
+    if not ENABLED or not port:
+        return None
+    with _span_log_lock:
+        if _server is not None or _serve_failed:
+            return _server
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = REGISTRY.render_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            _server = ThreadingHTTPServer((HOST if host is None else host, port), Handler)
+        except OSError:
+            # Another process (e.g. a second Streamlit worker) already serves this port
+            _serve_failed = True
+            return None
+        threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+        return _server
+
+
+def _export_at_exit():
+    snap = REGISTRY.snapshot()
+    if snap["counters"] or snap["histograms"]:
+        export()
+
+
+if ENABLED:
+    atexit.register(_export_at_exit)
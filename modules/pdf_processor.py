@@ -1,8 +1,248 @@
+import functools
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
 
-import fitz
 import streamlit as st
 from typing import Tuple
 
+from modules import metrics
+from modules.raster import encode_pixmap, fit_dpi, overlay_highlights, rasterize
+from modules.render_cache import DiskRenderCache
+
+
+MAX_OPEN_DOCUMENTS = int(os.getenv("PDF_POOL_SIZE", "4"))
+RENDER_CACHE_BYTES = int(os.getenv("RENDER_CACHE_MB", "256")) * 1024 * 1024
+
+
+
+# =====================================================
+# 파일 시그니처 (내용 해시, size/mtime 변경 시에만 재계산)
+# =====================================================
+_SIG_CACHE = {}
+_SIG_LOCK = threading.Lock()
+
+
+def file_signature(pdf_path: str) -> str:
+    """Returns a SHA-256 of the file contents, re-hashing only when size/mtime change."""
+    path = os.path.abspath(pdf_path)
+    stat = os.stat(path)
+    stat_key = (stat.st_size, stat.st_mtime_ns)
+    with _SIG_LOCK:
+        cached = _SIG_CACHE.get(path)
+        if cached and cached[0] == stat_key:
+            return cached[1]
+
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    sig = h.hexdigest()
+
+    with _SIG_LOCK:
+        _SIG_CACHE[path] = (stat_key, sig)
+    return sig
+
+
+def remember_signature(pdf_path: str, size: int, mtime_ns: int, sig: str):
+    """Seeds file_signature() with a hash known from elsewhere (e.g. the document manifest)."""
+    with _SIG_LOCK:
+        _SIG_CACHE[os.path.abspath(pdf_path)] = ((size, mtime_ns), sig)
+
+
+# =====================================================
+# 문서 핸들 풀 (프로세스 공유, LRU)
+# =====================================================
+class _PooledDocument:
+    __slots__ = ("doc", "sig", "lock", "refs", "retired")
+
+    def __init__(self, doc, sig: str):
+        self.doc = doc
+        self.sig = sig
+        self.lock = threading.Lock()  # fitz.Document is not safe for concurrent use
+        self.refs = 0
+        self.retired = False
+
+
+class DocumentPool:
+    """
+    Keeps a bounded number of fitz.Document handles open, keyed by path.
+    Entries are evicted least-recently-used and reopened when the file's
+    content signature changes. A handle is only closed once no caller holds it.
+    """
+
+    def __init__(self, max_open: int = MAX_OPEN_DOCUMENTS):
+        self.max_open = max(1, int(max_open))
+        self._entries = OrderedDict()  # abs path -> _PooledDocument
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @contextmanager
+    def acquire(self, pdf_path: str):
+        """Yields an open document for `pdf_path`, exclusively for the caller."""
+        path = os.path.abspath(pdf_path)
+        entry = self._checkout(path, file_signature(path))
+        try:
+            with entry.lock:
+                yield entry.doc
+        finally:
+            self._release(entry)
+
+    def invalidate(self, pdf_path: str = None):
+        """Drops one path (or every path) from the pool."""
+        with self._lock:
+            if pdf_path is None:
+                paths = list(self._entries)
+            else:
+                paths = [os.path.abspath(pdf_path)]
+            for path in paths:
+                entry = self._entries.pop(path, None)
+                if entry is not None:
+                    self._retire(entry)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "open": len(self._entries),
+                "max_open": self.max_open,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def _checkout(self, path: str, sig: str) -> _PooledDocument:
+        entry = self._checkout_cached(path, sig)
+        if entry is not None:
+            return entry
+
+        # Open outside the pool lock: a cold open of a large manual must not
+        # block other sessions checking out documents that are already open.
+        import fitz  # deferred: not needed when every page comes from the render cache
+
+        doc = fitz.open(path)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry.sig == sig:
+                # Another caller opened it meanwhile; use theirs
+                doc.close()
+                self.hits += 1
+                self._entries.move_to_end(path)
+            else:
+                if entry is not None:
+                    self._retire(self._entries.pop(path))
+                self.misses += 1
+                entry = _PooledDocument(doc, sig)
+                self._entries[path] = entry
+                while len(self._entries) > self.max_open:
+                    _, oldest = self._entries.popitem(last=False)
+                    self._retire(oldest)
+            entry.refs += 1
+            return entry
+
+    def _checkout_cached(self, path: str, sig: str):
+        """Checks out an open entry with this signature, or returns None (dropping a stale one)."""
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry.sig != sig:
+                self._retire(self._entries.pop(path))
+                entry = None
+            if entry is None:
+                return None
+            self.hits += 1
+            self._entries.move_to_end(path)
+            entry.refs += 1
+            return entry
+
+    def _release(self, entry: _PooledDocument):
+        with self._lock:
+            entry.refs -= 1
+            if entry.retired and entry.refs == 0:
+                entry.doc.close()
+
+    def _retire(self, entry: _PooledDocument):
+        # Caller holds self._lock
+        entry.retired = True
+        if entry.refs == 0:
+            entry.doc.close()
+
+
+DOCUMENT_POOL = DocumentPool()
+
+
+def open_document(pdf_path: str):
+    """Context manager yielding a pooled, warm fitz.Document."""
+    return DOCUMENT_POOL.acquire(pdf_path)
+
+
+# =====================================================
+# 렌더 결과 캐시 (프로세스 공유, 바이트 상한 LRU)
+# =====================================================
+class RenderCache:
+    """Thread-safe LRU of encoded page images bounded by total bytes."""
+
+    def __init__(self, max_bytes: int = RENDER_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()  # key -> bytes
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            data = self._items.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._items.move_to_end(key)
+            return data
+
+    def put(self, key, data: bytes):
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            if len(data) > self.max_bytes:
+                return
+            self._items[key] = data
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._size -= len(evicted)
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            return key in self._items
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._size = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._items),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+RENDER_CACHE = RenderCache()
+DISK_CACHE = DiskRenderCache()
+
+_RENDERS_IN_FLIGHT = {}  # render key -> Future of the render_page() call producing it
+_RENDERS_LOCK = threading.Lock()
+
+
+def render_key(sig: str, page: int, dpi: int, fmt: str = "png", quality: int = 85) -> tuple:
+    return (sig, int(page), int(dpi), fmt.lower(), int(quality))
 
 
 # =====================================================
@@ -10,27 +250,121 @@ from typing import Tuple
 # =====================================================
 @st.cache_data(show_spinner=False)
 def get_total_pages(pdf_path: str, sig: str) -> int:
-    doc = fitz.open(pdf_path)
-    try:
+    with open_document(pdf_path) as doc:
         return doc.page_count
-    finally:
-        doc.close()
 
 
-@st.cache_data(show_spinner=False)
+@functools.lru_cache(maxsize=4096)
+def get_page_width(pdf_path: str, sig: str, page: int) -> float:
+    """Width of a 1-based page in PDF points."""
+    with open_document(pdf_path) as doc:
+        page = max(1, min(int(page), doc.page_count))
+        return doc.load_page(page - 1).rect.width
+
+
+def fit_page_dpi(pdf_path: str, sig: str, page: int, target_width_px: int) -> int:
+    """DPI at which the given page fills `target_width_px` pixels."""
+    return fit_dpi(get_page_width(pdf_path, sig, page), target_width_px)
+
+
+def is_rendered(sig: str, page: int, dpi: int, fmt: str = "png", quality: int = 85) -> bool:
+    """True if the page is already in the memory or disk render cache."""
+    key = render_key(sig, page, dpi, fmt, quality)
+    return key in RENDER_CACHE or key in DISK_CACHE
+
+
+def cached_render(sig: str, page: int, dpi: int, fmt: str = "png", quality: int = 85):
+    """
+    Looks a plain render up in the memory cache, then the disk cache.
+    Returns (key, bytes or None); pass the key to store_render() once the
+    page has been rendered.
+    """
+    key = render_key(sig, page, dpi, fmt, quality)
+    data = RENDER_CACHE.get(key)
+    metrics.incr("render_cache_requests", cache="memory", result="miss" if data is None else "hit")
+    if data is not None:
+        return key, data
+
+    data = DISK_CACHE.get(key)
+    metrics.incr("render_cache_requests", cache="disk", result="miss" if data is None else "hit")
+    if data is not None:
+        RENDER_CACHE.put(key, data)
+    return key, data
+
+
+def store_render(key: tuple, data: bytes):
+    """Caches a fresh plain render under a key from cached_render()."""
+    DISK_CACHE.put(key, data)
+    RENDER_CACHE.put(key, data)
+
+
+def highlight_render(sig: str, page: int, dpi: int, fmt: str, quality: int, highlights: Tuple, base: bytes) -> bytes:
+    """
+    Returns the plain render `base` with `highlights` drawn over it. Only the
+    plain page is rasterised and cached on disk (and prefetched), so a jump to
+    a cited page costs one overlay; the overlaid image is kept in memory.
+    """
+    key = render_key(sig, page, dpi, fmt, quality) + (tuple(tuple(r) for r in highlights),)
+    data = RENDER_CACHE.get(key)
+    if data is None:
+        with metrics.span("render.highlight", fmt=fmt):
+            data = overlay_highlights(base, fmt, quality, highlights, scale=int(dpi) / 72.0)
+        RENDER_CACHE.put(key, data)
+    return data
+
+
+def render_uncached(pdf_path: str, page: int, dpi: int, fmt: str = "png", quality: int = 85) -> bytes:
+    """Rasterises and encodes a plain page on this thread, bypassing the caches."""
+    with metrics.span("render.rasterize"):
+        with open_document(pdf_path) as doc:
+            pix = rasterize(doc, page, dpi)
+    with metrics.span("render.encode", fmt=fmt):
+        return encode_pixmap(pix, fmt, quality)
+
+
 def render_page(
     pdf_path: str,
     sig: str,
     page: int,
     dpi: int,
+    fmt: str = "png",
+    quality: int = 85,
+    highlights: Tuple = (),
 ) -> bytes:
-    doc = fitz.open(pdf_path)
-    try:
-        total = doc.page_count
-        page = max(1, min(int(page), total))
-        p = doc.load_page(page - 1)
+    """
+    Returns the encoded image of a 1-based page. Results are cached in memory
+    and on disk by content signature, so this is safe to call from background
+    threads and survives restarts.
+
+    `highlights` is a tuple of (x0, y0, x1, y1) rectangles in PDF points (as
+    produced by modules.citation), drawn over the cached plain render.
+    """
+    if highlights:
+        base = render_page(pdf_path, sig, page, dpi, fmt, quality)
+        return highlight_render(sig, page, dpi, fmt, quality, highlights, base)
 
-        pix = p.get_pixmap(dpi=int(dpi), annots=False)
-        return pix.tobytes("png")
+    key, data = cached_render(sig, page, dpi, fmt, quality)
+    if data is not None:
+        return data
+
+    # Single flight: a foreground render of a page a prefetch thread is
+    # already rendering waits for that result instead of rendering it again.
+    with _RENDERS_LOCK:
+        future = _RENDERS_IN_FLIGHT.get(key)
+        leader = future is None
+        if leader:
+            future = _RENDERS_IN_FLIGHT[key] = Future()
+    if not leader:
+        metrics.incr("render_joined")
+        return future.result()
+    try:
+        data = render_uncached(pdf_path, page, dpi, fmt, quality)
+        store_render(key, data)
+        future.set_result(data)
+        return data
+    except BaseException as e:
+        future.set_exception(e)
+        raise
     finally:
-        doc.close()
\ No newline at end of file
+        with _RENDERS_LOCK:
+            _RENDERS_IN_FLIGHT.pop(key, None)
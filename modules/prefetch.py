@@ -0,0 +1,160 @@
+import os
+import queue
+import threading
+import time
+
+from modules.pdf_processor import is_rendered, render_key, render_page
+
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", "2"))
+PREFETCH_QUEUE_SIZE = int(os.getenv("PREFETCH_QUEUE_SIZE", "32"))
+# Streamlit has no session-end hook, so a session that schedules nothing for
+# this long is treated as gone and its scopes are pruned.
+PREFETCH_SCOPE_TTL = float(os.getenv("PREFETCH_SCOPE_TTL", "1800"))
+
+
+class Prefetcher:
+    """
+    Warms the render cache from a small pool of daemon threads.
+
+    Jobs are scheduled per (session, group). When a group's scope changes
+    (e.g. the session switched to another file) its generation is bumped and
+    jobs queued under the old generation are dropped instead of rendered.
+    Renders already cached or in flight are never queued twice (a request
+    for a page still queued under a stale generation takes that job over
+    instead of being dropped with it), and a
+    foreground render_page() of a page being prefetched joins that render.
+
+    `render` is called as render(pdf_path, sig, page, dpi, fmt, quality);
+    main.py swaps in the process-pool render service.
+    """
+
+    def __init__(
+        self,
+        workers: int = PREFETCH_WORKERS,
+        max_pending: int = PREFETCH_QUEUE_SIZE,
+        render=render_page,
+        scope_ttl: float = PREFETCH_SCOPE_TTL,
+    ):
+        self.workers = max(1, int(workers))
+        self.render = render
+        self.scope_ttl = scope_ttl
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        self._inflight = {}        # render key queued or rendering -> (gen_key, generation) it runs for
+        self._scopes = {}          # (session_id, group) -> (scope, generation)
+        self._last_seen = {}       # session_id -> monotonic time of its last schedule()
+        self._pruned = time.monotonic()
+        self._threads = []
+        self.rendered = 0
+        self.dropped = 0
+
+    def schedule(self, session_id: str, group: str, scope, requests) -> int:
+        """
+        Queues render_page requests `(pdf_path, sig, page, dpi, fmt, quality)`.
+        Returns how many were queued; the rest were cached, duplicate or over capacity.
+        """
+        self._ensure_started()
+        with self._lock:
+            now = time.monotonic()
+            self._last_seen[session_id] = now
+            if now - self._pruned >= min(self.scope_ttl, 60.0):
+                self._prune(now)
+            gen_key = (session_id, group)
+            current = self._scopes.get(gen_key)
+            if current is None or current[0] != scope:
+                generation = (current[1] + 1) if current else 0
+                self._scopes[gen_key] = (scope, generation)
+            else:
+                generation = current[1]
+
+        queued = 0
+        for pdf_path, sig, page, dpi, fmt, quality in requests:
+            key = render_key(sig, page, dpi, fmt, quality)
+            if is_rendered(sig, page, dpi, fmt, quality):
+                continue
+            with self._lock:
+                owner = self._inflight.get(key)
+                if owner is not None and self._is_current(*owner):
+                    continue
+                self._inflight[key] = (gen_key, generation)
+                if owner is not None:
+                    # Still queued under a stale generation: that job now renders for this one
+                    queued += 1
+                    continue
+            job = (key, (pdf_path, sig, page, dpi, fmt, quality))
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                with self._lock:
+                    self._inflight.pop(key, None)
+                    self.dropped += 1
+                break
+            queued += 1
+        return queued
+
+    def cancel(self, session_id: str, group: str = None):
+        """Invalidates queued jobs of a session (one group or all of them)."""
+        with self._lock:
+            for gen_key, (scope, generation) in list(self._scopes.items()):
+                if gen_key[0] == session_id and (group is None or gen_key[1] == group):
+                    self._scopes[gen_key] = (None, generation + 1)
+
+    def forget(self, session_id: str):
+        """Drops every scope of a session; its queued jobs are discarded."""
+        with self._lock:
+            self._forget(session_id)
+
+    def _forget(self, session_id: str):
+        # Caller holds self._lock
+        for gen_key in [k for k in self._scopes if k[0] == session_id]:
+            del self._scopes[gen_key]
+        self._last_seen.pop(session_id, None)
+
+    def _prune(self, now: float):
+        # Caller holds self._lock
+        self._pruned = now
+        for session_id, seen in list(self._last_seen.items()):
+            if now - seen > self.scope_ttl:
+                self._forget(session_id)
+
+    def _is_current(self, gen_key, generation) -> bool:
+        # Caller holds self._lock
+        return self._scopes.get(gen_key, (None, -1))[1] == generation
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def _ensure_started(self):
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._run, name=f"render-prefetch-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def _run(self):
+        while True:
+            key, args = self._queue.get()
+            try:
+                with self._lock:
+                    stale = not self._is_current(*self._inflight[key])
+                    if stale:
+                        self.dropped += 1
+                if stale:
+                    continue
+                self.render(*args)
+                with self._lock:
+                    self.rendered += 1
+            except Exception:
+                # Prefetch is best effort; the foreground render reports real errors
+                pass
+            finally:
+                with self._lock:
+                    self._inflight.pop(key, None)
+                self._queue.task_done()
+
+
+PREFETCHER = Prefetcher()
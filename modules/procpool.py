@@ -0,0 +1,44 @@
+"""
+Process pools that are safe to start from inside the Streamlit script.
+
+Streamlit executes the app as sys.modules["__main__"] with __file__ set to
+main.py, and the "spawn" start method re-imports __main__ in every child, so
+each worker would run the whole app again (and try to start its own pool).
+A child imports __main__ by module name when the parent's __main__ has a
+__spec__, so the script sets
+
+    __spec__ = worker_main_spec()
+
+and workers import the side-effect-free modules.worker_main instead. Nothing
+process-global is swapped while other sessions' threads are running.
+"""
+import importlib.util
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, wait
+
+WORKER_MAIN = "modules.worker_main"
+
+
+def worker_main_spec():
+    """The module spec a Streamlit script should use as its __spec__ (see above)."""
+    return importlib.util.find_spec(WORKER_MAIN)
+
+
+def _ready():
+    return os.getpid()
+
+
+def spawn_pool(workers: int, initializer=None) -> ProcessPoolExecutor:
+    """Returns a spawn-context ProcessPoolExecutor once its `workers` processes are up."""
+    workers = max(1, int(workers))
+    # spawn: the parent (Streamlit) is multi-threaded, so forking it is unsafe
+    pool = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=initializer,
+    )
+    # One task per worker while none is idle launches all of them now
+    warmups = [pool.submit(_ready) for _ in range(workers)]
+    wait(warmups)  # workers have booted (and run `initializer`)
+    return pool
@@ -0,0 +1,206 @@
+import os
+import re
+import time
+
+from modules import metrics
+from modules.answer_cache import ANSWER_CACHE
+
+MODEL_NAME = "gemini-2.5-flash"
+FILE_SEARCH_STORE = os.getenv("FILE_SEARCH_STORE", "fileSearchStores/jbriskmanual-01q1nf25k1tw")
+SYSTEM_INSTRUCTION = """
+                                        너는 금융 규제 전문가야. 
+                                        반드시 제공된 'File Search' 결과 내의 정보만을 바탕으로 답변해야 해.
+                                        파일에 없는 수치나 내용은 절대 지어내지 말고, 
+                                        만약 파일에서 찾을 수 없다면 '해당 정보는 문서에 포함되어 있지 않습니다'라고 대답해.
+                                        """
+PAGE_MARKER = re.compile(r'--- PAGE (\d+) ---')
+
+
+def build_config():
+    """Generation config for File Search grounded answers."""
+    from google.genai import types  # deferred: heavy, and only needed once a question is asked
+
+    return types.GenerateContentConfig(
+        temperature=0.0,
+        system_instruction=SYSTEM_INSTRUCTION,
+        tools=[
+            types.Tool(
+                file_search=types.FileSearch(
+                    file_search_store_names=[FILE_SEARCH_STORE]
+                )
+            )
+        ]
+    )
+
+
+def extract_chunks(candidates):
+    """Returns the [{"title", "text"}] grounding chunks of the first candidate."""
+    chunks = []
+    if candidates and candidates[0].grounding_metadata:
+        metadata = candidates[0].grounding_metadata
+        if metadata.grounding_chunks:
+            for chunk in metadata.grounding_chunks:
+                source = chunk.retrieved_context
+                if source and source.text:
+                    chunks.append({"title": source.title, "text": source.text})
+    return chunks
+
+
+def parse_marked_sources(chunks):
+    """Returns [{"title", "page"}] for chunks that carry a page marker."""
+    source_list = []
+    for chunk in chunks:
+        page_match = PAGE_MARKER.search(chunk["text"])
+        if page_match:
+            source_list.append({"title": chunk["title"], "page": int(page_match.group(1))})
+    return source_list
+
+
+def extract_sources(response, resolver=None):
+    """
+    Returns the sources of a response. `resolver` maps grounding chunks to
+    sources (see modules.citation.resolve_chunks); by default only chunks with
+    a page marker are kept.
+    """
+    chunks = extract_chunks(response.candidates)
+    return resolver(chunks) if resolver else parse_marked_sources(chunks)
+
+
+def normalize_source_name(source_name: str, available_files: list) -> str:
+    """
+    Matches the source name from Gemini to the actual file in the data directory.
+    Tries exact match, then adding .pdf.
+    """
+    if source_name in available_files:
+        return source_name
+
+    # Try adding .pdf
+    candidate = f"{source_name}.pdf"
+    if candidate in available_files:
+        return candidate
+
+    return source_name
+
+
+def dedupe_sources(sources):
+    """Drops repeated (title, page) sources, keeping the first occurrence."""
+    unique_sources = []
+    seen = set()
+    for s in sources:
+        key = (s['title'], s['page'])
+        if key not in seen:
+            seen.add(key)
+            unique_sources.append(s)
+    return unique_sources
+
+
+def answer_key(question, cache=ANSWER_CACHE):
+    """The answer-cache key of `question` under the current model, instruction and store."""
+    return cache.make_key(question, MODEL_NAME, SYSTEM_INSTRUCTION, FILE_SEARCH_STORE)
+
+
+def cached_answer(question, cache=ANSWER_CACHE):
+    """Returns (result or None, cache key) without calling Gemini."""
+    started = time.perf_counter()
+    cache_key = answer_key(question, cache)
+    return _cached_result(cache, cache_key, started), cache_key
+
+
+def _cached_result(cache, cache_key, started):
+    hit = cache.get(cache_key)
+    metrics.incr("answer_cache_requests", result="miss" if hit is None else "hit")
+    if hit is None:
+        return None
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    return {
+        "text": hit["answer"],
+        "sources": hit["sources"],
+        "cached": True,
+        "cache_key": cache_key,
+        "timings": {"ttft_ms": elapsed_ms, "total_ms": elapsed_ms},
+    }
+
+
+def answer_question(client, question, cache=ANSWER_CACHE, resolver=None, check_cache=True):
+    """
+    Answers a question through Gemini File Search, serving repeated questions
+    from the local answer cache (unless `check_cache` is False because the
+    caller already looked).
+
+    Returns {"text", "sources", "cached", "cache_key", "timings"}.
+    """
+    started = time.perf_counter()
+    cache_key = answer_key(question, cache)
+    cached = _cached_result(cache, cache_key, started) if check_cache else None
+    if cached is not None:
+        return cached
+
+    with metrics.span("gemini", mode="sync"):
+        response = client.models.generate_content(
+            model=MODEL_NAME,
+            contents=question,
+            config=build_config(),
+        )
+    text = response.text
+    with metrics.span("sources"):
+        source_list = extract_sources(response, resolver)
+    total_ms = (time.perf_counter() - started) * 1000
+    if text:
+        cache.put(cache_key, question, FILE_SEARCH_STORE, text, source_list)
+    return {
+        "text": text,
+        "sources": source_list,
+        "cached": False,
+        "cache_key": cache_key,
+        "timings": {"ttft_ms": total_ms, "total_ms": total_ms},
+    }
+
+
+def stream_answer(client, question, on_text=None, cache=ANSWER_CACHE, resolver=None, check_cache=True):
+    """
+    Streaming variant of answer_question(). `on_text` is called with the
+    accumulated answer text every time a chunk arrives; grounding metadata is
+    gathered from every chunk and parsed once the stream is finished.
+
+    Returns the same dict as answer_question(); timings["ttft_ms"] is the
+    time to the first non-empty text chunk.
+    """
+    started = time.perf_counter()
+    cache_key = answer_key(question, cache)
+    cached = _cached_result(cache, cache_key, started) if check_cache else None
+    if cached is not None:
+        if on_text:
+            on_text(cached["text"])
+        return cached
+
+    parts = []
+    chunks = []
+    ttft_ms = None
+    with metrics.span("gemini", mode="stream"):
+        for chunk in client.models.generate_content_stream(
+            model=MODEL_NAME,
+            contents=question,
+            config=build_config(),
+        ):
+            chunks.extend(extract_chunks(chunk.candidates))
+            if chunk.text:
+                if ttft_ms is None:
+                    ttft_ms = (time.perf_counter() - started) * 1000
+                    metrics.observe("gemini.ttft", ttft_ms / 1000)
+                parts.append(chunk.text)
+                if on_text:
+                    on_text("".join(parts))
+
+    text = "".join(parts)
+    with metrics.span("sources"):
+        source_list = resolver(chunks) if resolver else parse_marked_sources(chunks)
+    total_ms = (time.perf_counter() - started) * 1000
+    if text:
+        cache.put(cache_key, question, FILE_SEARCH_STORE, text, source_list)
+    return {
+        "text": text,
+        "sources": source_list,
+        "cached": False,
+        "cache_key": cache_key,
+        "timings": {"ttft_ms": ttft_ms if ttft_ms is not None else total_ms, "total_ms": total_ms},
+    }
@@ -0,0 +1,133 @@
+"""
+Rasterising and encoding pages with PyMuPDF and Pillow.
+
+Kept free of Streamlit so render worker processes (modules.render_service)
+can import it cheaply.
+"""
+import io
+import os
+from collections import OrderedDict
+
+IMAGE_FORMATS = ("png", "jpeg", "webp")
+MIN_DPI = 36
+MAX_DPI = 300
+HIGHLIGHT_FILL = (255, 230, 0, 90)
+HIGHLIGHT_OUTLINE = (255, 170, 0, 200)
+WORKER_OPEN_DOCUMENTS = int(os.getenv("RENDER_WORKER_DOCUMENTS", "4"))
+
+
+# =====================================================
+# 해상도 선택 / 인코딩
+# =====================================================
+def fit_dpi(page_width_pt: float, target_width_px: int) -> int:
+    """Returns the DPI at which a page `page_width_pt` wide fills `target_width_px` pixels."""
+    dpi = int(round(target_width_px * 72.0 / max(page_width_pt, 1.0)))
+    return max(MIN_DPI, min(dpi, MAX_DPI))
+
+
+def encode_pixmap(pix, fmt: str = "png", quality: int = 85, highlights=(), scale: float = 1.0) -> bytes:
+    """
+    Encodes a pixmap as PNG, JPEG or WebP (`quality` is ignored for PNG).
+    `highlights` are (x0, y0, x1, y1) rectangles in PDF points, drawn as a
+    translucent overlay after multiplying by `scale` (dpi / 72).
+    """
+    fmt = _check_format(fmt)
+    if fmt == "png" and not highlights:
+        return pix.tobytes("png")
+
+    # Pillow's encoders are several times faster than Pixmap.tobytes("jpeg")
+    from PIL import Image
+
+    mode = "RGBA" if pix.alpha else "RGB"
+    img = Image.frombytes(mode, (pix.width, pix.height), pix.samples)
+    return _encode_image(_draw_highlights(img, highlights, scale), fmt, quality)
+
+
+def overlay_highlights(data: bytes, fmt: str, quality: int, highlights, scale: float) -> bytes:
+    """
+    Draws `highlights` over an already encoded page image, so a highlighted
+    page reuses the cached plain render instead of rasterising it again.
+    """
+    from PIL import Image
+
+    fmt = _check_format(fmt)
+    with Image.open(io.BytesIO(data)) as img:
+        img.load()
+        return _encode_image(_draw_highlights(img, highlights, scale), fmt, quality)
+
+
+def _check_format(fmt: str) -> str:
+    fmt = fmt.lower()
+    if fmt not in IMAGE_FORMATS + ("jpg",):
+        raise ValueError(f"Unsupported image format: {fmt}")
+    return fmt
+
+
+def _draw_highlights(img, highlights, scale: float):
+    if not highlights:
+        return img
+    from PIL import Image, ImageDraw
+
+    overlay = Image.new("RGBA", img.size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(overlay)
+    for x0, y0, x1, y1 in highlights:
+        draw.rectangle(
+            [x0 * scale, y0 * scale, x1 * scale, y1 * scale],
+            fill=HIGHLIGHT_FILL,
+            outline=HIGHLIGHT_OUTLINE,
+        )
+    return Image.alpha_composite(img.convert("RGBA"), overlay)
+
+
+def _encode_image(img, fmt: str, quality: int) -> bytes:
+    buf = io.BytesIO()
+    if fmt == "png":
+        img.save(buf, format="PNG")
+    elif fmt == "webp":
+        img.save(buf, format="WEBP", quality=int(quality), method=2)
+    else:
+        img.convert("RGB").save(buf, format="JPEG", quality=int(quality))
+    return buf.getvalue()
+
+
+def rasterize(doc, page: int, dpi: int):
+    """Renders a 1-based page of an open document to a pixmap (page is clamped)."""
+    page = max(1, min(int(page), doc.page_count))
+    p = doc.load_page(page - 1)
+    return p.get_pixmap(dpi=int(dpi), annots=False)
+
+
+# =====================================================
+# 렌더 워커 프로세스
+# =====================================================
+_worker_docs = OrderedDict()  # abs path -> (sig, fitz.Document), per worker process
+
+
+def warm_imports():
+    """Pool initializer: pays for the imports when a worker starts, not on its first page."""
+    import fitz  # noqa: F401
+    import PIL.Image  # noqa: F401
+
+
+def _worker_document(pdf_path: str, sig: str):
+    import fitz
+
+    entry = _worker_docs.get(pdf_path)
+    if entry is not None and entry[0] == sig:
+        _worker_docs.move_to_end(pdf_path)
+        return entry[1]
+    if entry is not None:
+        del _worker_docs[pdf_path]
+        entry[1].close()
+    doc = fitz.open(pdf_path)
+    _worker_docs[pdf_path] = (sig, doc)
+    while len(_worker_docs) > WORKER_OPEN_DOCUMENTS:
+        _, (_, oldest) = _worker_docs.popitem(last=False)
+        oldest.close()
+    return doc
+
+
+def render_job(pdf_path: str, sig: str, page: int, dpi: int, fmt: str, quality: int) -> bytes:
+    """Rasterises and encodes one page in a render worker process (see modules.render_service)."""
+    pix = rasterize(_worker_document(pdf_path, sig), page, dpi)
+    return encode_pixmap(pix, fmt, quality)
@@ -0,0 +1,133 @@
+import os
+import threading
+import time
+
+from modules.fileio import TMP_PREFIX, atomic_write_bytes
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CACHE_DIR = os.getenv("RENDER_DISK_CACHE_DIR", os.path.join(BASE_DIR, "cache", "renders"))
+CACHE_BYTES = int(os.getenv("RENDER_DISK_CACHE_MB", "1024")) * 1024 * 1024
+LOW_WATERMARK = 0.9  # evict down to this fraction of the budget
+TMP_GRACE_SECONDS = 30  # younger .tmp- files may belong to a write in progress
+
+
+class DiskRenderCache:
+    """
+    Content-addressed on-disk cache of rendered pages, shared by every worker
+    process that points at the same directory.
+
+    Entries live at <dir>/<sig[:2]>/<sig>/p<page>-d<dpi>-q<quality>.<fmt>, so
+    an edited PDF (new content hash) never sees images of the old one. Writes
+    go through a temp file + os.replace, so readers never see partial files.
+    Hits touch the file's mtime, which eviction uses as its LRU clock.
+    """
+
+    def __init__(self, cache_dir: str = CACHE_DIR, max_bytes: int = CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size = None  # lazily measured on first write
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+    def path_for(self, key) -> str:
+        sig, page, dpi, fmt, quality = key
+        name = f"p{int(page)}-d{int(dpi)}-q{int(quality)}.{fmt}"
+        return os.path.join(self.cache_dir, sig[:2], sig, name)
+
+    def get(self, key):
+        path = self.path_for(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass  # evicted by another worker meanwhile; the bytes are still valid
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def __contains__(self, key) -> bool:
+        return os.path.exists(self.path_for(key))
+
+    def put(self, key, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        path = self.path_for(key)
+        # Best effort: a read-only, full or inaccessible cache directory must
+        # not fail the render that produced `data`.
+        try:
+            atomic_write_bytes(path, data)
+        except OSError:
+            return
+
+        with self._lock:
+            self.writes += 1
+            if self._size is None:
+                self._size = self._scan_size()
+            else:
+                self._size += len(data)
+            over_budget = self._size > self.max_bytes
+        if over_budget:
+            self.evict()
+
+    def evict(self):
+        """Deletes least-recently-used files until the cache is under the low watermark."""
+        files = []
+        now = time.time()
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if name.startswith(TMP_PREFIX) and now - stat.st_mtime < TMP_GRACE_SECONDS:
+                    continue  # another writer's file, about to be renamed into place
+                files.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        target = int(self.max_bytes * LOW_WATERMARK)
+        evicted = 0
+        for _, size, path in sorted(files):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            evicted += 1
+
+        with self._lock:
+            self._size = total
+            self.evictions += evicted
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "dir": self.cache_dir,
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "writes": self.writes,
+                "evictions": self.evictions,
+            }
+
+    def _scan_size(self) -> int:
+        total = 0
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass
+        return total
@@ -0,0 +1,256 @@
+"""
+Page rendering on a pool of worker processes.
+
+render_page() rasterises on the calling thread, so one slow high-DPI page
+holds the interpreter and delays every other session served by the same
+Streamlit process. RENDER_SERVICE moves cache misses onto a process pool:
+  * requests are (file signature, page, DPI, format[, quality]); cache hits
+    are answered on the caller's thread and never reach the pool, and
+    highlights are drawn over the plain render there as well;
+  * identical requests in flight at the same time share one job;
+  * every session may have at most RENDER_SESSION_PENDING jobs outstanding
+    and the pool at most RENDER_QUEUE_LIMIT; a request that cannot get a slot
+    within the timeout raises RenderBusyError instead of queueing unbounded;
+  * a finished job lands in the memory/disk render cache even if every
+    waiter has given up, so a retry is a cache hit. The cache write runs on
+    a small thread of its own, never on the pool's result thread, which
+    would otherwise stall every other job's completion behind a disk write.
+
+The pool starts in the background on the first cache miss; until its
+workers are up, misses are rendered on the caller's thread as before, so
+first paint never waits for worker processes to boot.
+
+Workers import only PyMuPDF and Pillow (modules.raster.render_job) and keep
+their own small set of open documents. The encoded image is pickled once
+across the pipe; the resulting bytes object is what the render cache stores
+and what every waiter receives, with no further copies.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from modules import metrics
+from modules.pdf_processor import cached_render, highlight_render, render_uncached, store_render
+from modules.procpool import spawn_pool
+from modules.raster import render_job, warm_imports
+
+RENDER_SERVICE_ENABLED = os.getenv("RENDER_SERVICE", "1") == "1"
+RENDER_PROCESSES = int(os.getenv("RENDER_PROCESSES", "0")) or os.cpu_count() or 1
+RENDER_SESSION_PENDING = int(os.getenv("RENDER_SESSION_PENDING", "4"))
+RENDER_QUEUE_LIMIT = int(os.getenv("RENDER_QUEUE_LIMIT", "64"))
+RENDER_TIMEOUT = float(os.getenv("RENDER_TIMEOUT", "30"))
+
+_log = logging.getLogger(__name__)
+
+
+class RenderBusyError(RuntimeError):
+    """Raised when a render cannot be queued or finished within the timeout."""
+
+
+# =====================================================
+# 렌더 서비스 (프로세스 공유)
+# =====================================================
+class RenderService:
+    """Deduplicating, back-pressured front end to a render process pool."""
+
+    def __init__(
+        self,
+        processes: int = RENDER_PROCESSES,
+        session_pending: int = RENDER_SESSION_PENDING,
+        queue_limit: int = RENDER_QUEUE_LIMIT,
+        timeout: float = RENDER_TIMEOUT,
+        job=render_job,
+    ):
+        self.processes = max(1, int(processes))
+        self.session_pending = max(1, int(session_pending))
+        self.queue_limit = max(1, int(queue_limit))
+        self.timeout = timeout
+        self._job = job
+        self._cond = threading.Condition()
+        self._pool = None
+        self._starting = False
+        self._jobs = {}      # render key -> Future
+        self._pending = {}   # session id -> outstanding jobs
+        self._store = ThreadPoolExecutor(max_workers=1, thread_name_prefix="render-store")
+        self.submitted = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self.failed = 0
+
+    # -------------------------------------------------
+    # Pool
+    # -------------------------------------------------
+    def start(self, wait: bool = False) -> bool:
+        """
+        Launches the worker processes in the background (idempotent). Returns
+        whether the pool is up; with wait=True, first waits for the launch.
+        """
+        with self._cond:
+            if self._pool is None and not self._starting:
+                self._starting = True
+                threading.Thread(target=self._spawn, name="render-pool-start", daemon=True).start()
+            while wait and self._starting:
+                self._cond.wait()
+            return self._pool is not None
+
+    def _spawn(self):
+        try:
+            pool = spawn_pool(self.processes, initializer=warm_imports)
+        except Exception:
+            pool = None  # renders keep running inline; the next miss retries
+        with self._cond:
+            self._pool = pool
+            self._starting = False
+            self._cond.notify_all()
+
+    def shutdown(self):
+        with self._cond:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    # -------------------------------------------------
+    # Requests
+    # -------------------------------------------------
+    def submit(
+        self,
+        pdf_path: str,
+        sig: str,
+        page: int,
+        dpi: int,
+        fmt: str = "png",
+        quality: int = 85,
+        session_id: str = "shared",
+        timeout: float = None,
+    ) -> Future:
+        """
+        Returns a Future of the encoded plain image. Cached pages come back as a
+        finished Future; a page already being rendered returns that job's
+        Future. Raises RenderBusyError when the session (or the whole pool)
+        has no free slot within `timeout` seconds.
+        """
+        key, data = cached_render(sig, page, dpi, fmt, quality)
+        if data is not None:
+            done = Future()
+            done.set_result(data)
+            return done
+
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                future = self._jobs.get(key)
+                if future is not None:
+                    self.coalesced += 1
+                    metrics.incr("render_jobs", result="coalesced")
+                    return future
+                if self._pending.get(session_id, 0) < self.session_pending and len(self._jobs) < self.queue_limit:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.rejected += 1
+                    metrics.incr("render_jobs", result="rejected")
+                    raise RenderBusyError("페이지 렌더링 요청이 많습니다. 잠시 후 다시 시도해 주세요.")
+                self._cond.wait(remaining)
+
+            args = (os.path.abspath(pdf_path), sig, int(page), int(dpi), fmt.lower(), int(quality))
+            pool = self._pool
+            if pool is not None:
+                try:
+                    future = pool.submit(self._job, *args)
+                except BrokenProcessPool:
+                    # A worker died (e.g. OOM on a huge page); replace the whole pool
+                    self._pool = None
+                    pool.shutdown(wait=False)
+                    pool = None
+            if pool is None:
+                # Until the workers are up, render on this thread as before
+                self.start()
+                future = Future()
+            self._jobs[key] = future
+            self._pending[session_id] = self._pending.get(session_id, 0) + 1
+            self.submitted += 1
+        metrics.incr("render_jobs", result="submitted" if pool is not None else "inline")
+        future.add_done_callback(lambda f: self._finish_later(key, session_id, f))
+        if pool is None:
+            try:
+                future.set_result(render_uncached(pdf_path, page, dpi, fmt, quality))
+            except Exception as e:
+                future.set_exception(e)
+        return future
+
+    def render(
+        self,
+        pdf_path: str,
+        sig: str,
+        page: int,
+        dpi: int,
+        fmt: str = "png",
+        quality: int = 85,
+        highlights: tuple = (),
+        session_id: str = "shared",
+        timeout: float = None,
+    ) -> bytes:
+        """
+        Drop-in for pdf_processor.render_page() that renders on the pool.
+        Raises RenderBusyError if no slot frees up or the job does not finish
+        within `timeout` seconds (the job itself still completes and is cached).
+        """
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        future = self.submit(pdf_path, sig, page, dpi, fmt, quality, session_id, timeout)
+        with metrics.span("render.wait", fmt=fmt):
+            try:
+                data = future.result(max(0.0, deadline - time.monotonic()))
+            except FutureTimeoutError:
+                metrics.incr("render_jobs", result="timeout")
+                raise RenderBusyError("페이지 렌더링이 지연되고 있습니다. 잠시 후 다시 시도해 주세요.") from None
+        if highlights:
+            data = highlight_render(sig, page, dpi, fmt, quality, highlights, data)
+        return data
+
+    def _finish_later(self, key, session_id, future):
+        # Runs on whichever thread completed the job (the pool's result thread for pooled jobs)
+        try:
+            self._store.submit(self._finish, key, session_id, future)
+        except RuntimeError:
+            self._finish(key, session_id, future)  # interpreter shutting down
+
+    def _finish(self, key, session_id, future):
+        try:
+            if not future.cancelled() and future.exception() is None:
+                store_render(key, future.result())
+            else:
+                self.failed += 1
+                metrics.incr("render_jobs", result="failed")
+        except Exception:
+            _log.exception("caching a finished render failed")
+        finally:
+            # Leave the table only after caching, so a new request sees the cached page
+            with self._cond:
+                self._jobs.pop(key, None)
+                left = self._pending.get(session_id, 1) - 1
+                if left > 0:
+                    self._pending[session_id] = left
+                else:
+                    self._pending.pop(session_id, None)
+                self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "processes": self.processes,
+                "in_flight": len(self._jobs),
+                "sessions": len(self._pending),
+                "submitted": self.submitted,
+                "coalesced": self.coalesced,
+                "rejected": self.rejected,
+                "failed": self.failed,
+            }
+
+
+RENDER_SERVICE = RenderService()
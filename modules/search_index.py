@@ -0,0 +1,190 @@
+"""
+Local page-level full-text index over the PDFs in data/.
+
+Pages are tokenised into Hangul character bigrams plus whole Latin/number
+words, and ranked with BM25. Each PDF's postings are persisted as one JSON
+file named after its content hash, so a rebuild only re-extracts files that
+changed.
+
+    python -m modules.search_index build
+    python -m modules.search_index query "신용리스크 표준방법"
+"""
+import heapq
+import json
+import math
+import os
+import re
+import sys
+import time
+import unicodedata
+from collections import Counter, defaultdict
+
+from modules.fileio import atomic_write_json
+from modules.pdf_processor import file_signature, open_document
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(BASE_DIR, "data")
+INDEX_DIR = os.path.join(BASE_DIR, "cache", "search_index")
+INDEX_VERSION = 1
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+SNIPPET_CHARS = 60
+
+_WORD = re.compile(r"\w+")
+_HANGUL = re.compile(r"[가-힣]")
+
+
+def tokenize(text: str) -> list:
+    """Hangul words become character bigrams (unigram if one syllable); other words stay whole."""
+    tokens = []
+    for word in _WORD.findall(unicodedata.normalize("NFKC", text).lower()):
+        if _HANGUL.search(word):
+            if len(word) == 1:
+                tokens.append(word)
+            else:
+                tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+        else:
+            tokens.append(word)
+    return tokens
+
+
+def extract_pages(pdf_path: str) -> list:
+    """Returns the text of every page, in order."""
+    with open_document(pdf_path) as doc:
+        return [doc.load_page(i).get_text() for i in range(doc.page_count)]
+
+
+def _index_path(sig: str) -> str:
+    return os.path.join(INDEX_DIR, f"{sig}.json")
+
+
+def build_file_index(pdf_path: str, sig: str) -> dict:
+    """Extracts and indexes one PDF, persisting the result under its content hash."""
+    pages = extract_pages(pdf_path)
+    postings = defaultdict(list)
+    lengths = []
+    for page_no, text in enumerate(pages, start=1):
+        counts = Counter(tokenize(text))
+        lengths.append(sum(counts.values()))
+        for term, tf in counts.items():
+            postings[term].append([page_no, tf])
+    payload = {
+        "version": INDEX_VERSION,
+        "file": os.path.basename(pdf_path),
+        "sig": sig,
+        "pages": pages,
+        "lengths": lengths,
+        "postings": postings,
+    }
+    atomic_write_json(_index_path(sig), payload)
+    return payload
+
+
+def load_file_index(pdf_path: str, sig: str) -> dict:
+    """Loads the persisted index for this exact file content, building it if missing."""
+    path = _index_path(sig)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            payload = json.load(f)
+        if payload.get("version") == INDEX_VERSION:
+            payload["file"] = os.path.basename(pdf_path)
+            return payload
+    except (OSError, json.JSONDecodeError):
+        pass
+    return build_file_index(pdf_path, sig)
+
+
+class SearchIndex:
+    """In-memory BM25 index over every page of a set of PDFs."""
+
+    def __init__(self, file_indexes):
+        self.docs = []         # doc id -> (file, page)
+        self.texts = []        # doc id -> page text
+        self.lengths = []      # doc id -> token count
+        self.postings = defaultdict(list)  # term -> [(doc id, tf)]
+        for payload in file_indexes:
+            base = len(self.docs)
+            for page_no, text in enumerate(payload["pages"], start=1):
+                self.docs.append((payload["file"], page_no))
+                self.texts.append(text)
+            self.lengths.extend(payload["lengths"])
+            for term, plist in payload["postings"].items():
+                self.postings[term].extend((base + page_no - 1, tf) for page_no, tf in plist)
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+
+    def query(self, text: str, limit: int = 10) -> list:
+        """Returns [(file, page, score, snippet)] best match first."""
+        terms = set(tokenize(text))
+        if not terms or not self.docs:
+            return []
+        n_docs = len(self.docs)
+        scores = defaultdict(float)
+        for term in terms:
+            plist = self.postings.get(term)
+            if not plist:
+                continue
+            idf = math.log(1 + (n_docs - len(plist) + 0.5) / (len(plist) + 0.5))
+            for doc_id, tf in plist:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[doc_id] / (self.avg_length or 1))
+                scores[doc_id] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+        best = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+        return [
+            (self.docs[doc_id][0], self.docs[doc_id][1], score, make_snippet(self.texts[doc_id], text))
+            for doc_id, score in best
+        ]
+
+
+def make_snippet(page_text: str, query: str) -> str:
+    """Returns a short excerpt around the first occurrence of a query word (or bigram)."""
+    flat = re.sub(r"\s+", " ", page_text).strip()
+    lowered = flat.lower()
+    pos = -1
+    for word in sorted(_WORD.findall(query.lower()), key=len, reverse=True):
+        pos = lowered.find(word)
+        if pos < 0 and len(word) > 2:
+            pos = lowered.find(word[:2])
+        if pos >= 0:
+            break
+    start = max(0, pos - SNIPPET_CHARS // 2) if pos >= 0 else 0
+    snippet = flat[start:start + SNIPPET_CHARS * 2]
+    return ("…" if start > 0 else "") + snippet + ("…" if start + SNIPPET_CHARS * 2 < len(flat) else "")
+
+
+def list_pdfs(data_dir: str = DATA_DIR) -> list:
+    if not os.path.isdir(data_dir):
+        return []
+    return sorted(os.path.join(data_dir, f) for f in os.listdir(data_dir) if f.lower().endswith(".pdf"))
+
+
+def build_index(data_dir: str = DATA_DIR, prune: bool = True) -> SearchIndex:
+    """Loads or (re)builds per-file indexes for every PDF in `data_dir`."""
+    payloads = [load_file_index(path, file_signature(path)) for path in list_pdfs(data_dir)]
+    if prune and os.path.isdir(INDEX_DIR):
+        live = {f"{p['sig']}.json" for p in payloads}
+        for name in os.listdir(INDEX_DIR):
+            if name.endswith(".json") and name not in live:
+                os.remove(os.path.join(INDEX_DIR, name))
+    return SearchIndex(payloads)
+
+
+def main(argv=None):
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if not argv or argv[0] not in ("build", "query"):
+        print(__doc__)
+        return 2
+    t0 = time.perf_counter()
+    index = build_index()
+    print(f"indexed {len(index.docs)} pages in {(time.perf_counter() - t0) * 1000:.0f} ms")
+    if argv[0] == "query":
+        t0 = time.perf_counter()
+        results = index.query(" ".join(argv[1:]))
+        print(f"query took {(time.perf_counter() - t0) * 1000:.1f} ms")
+        for file, page, score, snippet in results:
+            print(f"{score:6.2f}  {file} p.{page}  {snippet}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,197 @@
+"""
+Page thumbnails packed into sprite sheets.
+
+Every page of a PDF is rendered at low resolution into a fixed-size cell,
+labelled with its page number. Cells are packed row by row into JPEG sheets of
+SHEET_COLUMNS x SHEET_ROWS pages, so a whole range of pages arrives in one
+image request. An offset index maps each page to (sheet, x, y, w, h).
+
+Sheets and index live under cache/thumbnails/<sig>/ and are only rebuilt when
+the document's content signature changes. Each sheet is one task on a process
+pool, so building the sheets of a large manual uses every core.
+
+    python -m modules.thumbnails build
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from modules.fileio import TMP_PREFIX, atomic_write_json
+from modules.procpool import spawn_pool
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(BASE_DIR, "data")
+THUMB_DIR = os.getenv("THUMB_DIR", os.path.join(BASE_DIR, "cache", "thumbnails"))
+THUMB_VERSION = 1
+
+CELL_WIDTH = int(os.getenv("THUMB_WIDTH_PX", "96"))
+CELL_HEIGHT = int(CELL_WIDTH * 1.5)
+LABEL_HEIGHT = 14
+SHEET_COLUMNS = 10
+SHEET_ROWS = 10
+SHEET_QUALITY = 70
+SHEET_BACKGROUND = (236, 238, 241)
+THUMB_WORKERS = int(os.getenv("THUMB_WORKERS", "0")) or os.cpu_count() or 1
+
+INDEX_NAME = "index.json"
+
+
+def render_sheet(pdf_path: str, first_page: int, last_page: int, out_path: str) -> list:
+    """
+    Renders pages first..last (1-based, inclusive) into one sheet at `out_path`.
+    Returns [[x, y, w, h], ...] for those pages, in order.
+
+    Runs in pool workers, so it only imports fitz and PIL.
+    """
+    import fitz
+    from PIL import Image, ImageDraw
+
+    count = last_page - first_page + 1
+    rows = (count + SHEET_COLUMNS - 1) // SHEET_COLUMNS
+    sheet = Image.new("RGB", (SHEET_COLUMNS * CELL_WIDTH, rows * CELL_HEIGHT), SHEET_BACKGROUND)
+    draw = ImageDraw.Draw(sheet)
+    offsets = []
+    with fitz.open(pdf_path) as doc:
+        for i, page_no in enumerate(range(first_page, last_page + 1)):
+            page = doc.load_page(page_no - 1)
+            zoom = min((CELL_WIDTH - 4) / page.rect.width, (CELL_HEIGHT - LABEL_HEIGHT - 4) / page.rect.height)
+            pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csRGB, alpha=False, annots=False)
+            thumb = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+
+            row, col = divmod(i, SHEET_COLUMNS)
+            x = col * CELL_WIDTH + (CELL_WIDTH - pix.width) // 2
+            y = row * CELL_HEIGHT + 2
+            sheet.paste(thumb, (x, y))
+            draw.text((col * CELL_WIDTH + 4, (row + 1) * CELL_HEIGHT - LABEL_HEIGHT), str(page_no), fill=(60, 60, 60))
+            offsets.append([x, y, pix.width, pix.height])
+    sheet.save(out_path, "JPEG", quality=SHEET_QUALITY, optimize=True)
+    return offsets
+
+
+def sheet_dir(sig: str) -> str:
+    return os.path.join(THUMB_DIR, sig)
+
+
+def sheet_path(sig: str, sheet_no: int) -> str:
+    return os.path.join(sheet_dir(sig), f"sheet-{sheet_no:03d}.jpg")
+
+
+def load_index(sig: str):
+    """The persisted index for this exact file content, or None if it must be built."""
+    try:
+        with open(os.path.join(sheet_dir(sig), INDEX_NAME), "r", encoding="utf-8") as f:
+            index = json.load(f)
+        if index.get("version") == THUMB_VERSION and index.get("cell") == [CELL_WIDTH, CELL_HEIGHT]:
+            return index
+    except (OSError, json.JSONDecodeError):
+        pass
+    return None
+
+
+def build_sheets(pdf_path: str, sig: str, page_count: int, workers: int = THUMB_WORKERS) -> dict:
+    """
+    Returns the sheet index of `pdf_path`, building the sheets if needed:
+    {"version", "sig", "pages", "cell", "columns", "sheets": [[first, last], ...],
+     "offsets": [[sheet, x, y, w, h] per page]}.
+    """
+    index = load_index(sig)
+    if index is not None:
+        return index
+
+    per_sheet = SHEET_COLUMNS * SHEET_ROWS
+    ranges = [(first, min(first + per_sheet - 1, page_count)) for first in range(1, page_count + 1, per_sheet)]
+    os.makedirs(THUMB_DIR, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=THUMB_DIR, prefix=TMP_PREFIX)
+    try:
+        jobs = [
+            (pdf_path, first, last, os.path.join(tmp_dir, os.path.basename(sheet_path(sig, n))))
+            for n, (first, last) in enumerate(ranges)
+        ]
+        workers = max(1, min(int(workers), len(jobs)))
+        if workers == 1:
+            results = [render_sheet(*job) for job in jobs]
+        else:
+            with spawn_pool(workers) as pool:
+                results = list(pool.map(render_sheet, *zip(*jobs)))
+
+        offsets = []
+        for sheet_no, sheet_offsets in enumerate(results):
+            offsets.extend([sheet_no] + rect for rect in sheet_offsets)
+        index = {
+            "version": THUMB_VERSION,
+            "sig": sig,
+            "pages": page_count,
+            "cell": [CELL_WIDTH, CELL_HEIGHT],
+            "columns": SHEET_COLUMNS,
+            "sheets": [list(r) for r in ranges],
+            "offsets": offsets,
+        }
+        atomic_write_json(os.path.join(tmp_dir, INDEX_NAME), index)
+        target = sheet_dir(sig)
+        stale = None
+        if os.path.isdir(target) and load_index(sig) is None:
+            # Sheets from an older THUMB_VERSION or cell size: os.replace() cannot
+            # overwrite a non-empty directory, so move them aside first.
+            stale = tempfile.mkdtemp(dir=THUMB_DIR, prefix=TMP_PREFIX)
+            try:
+                os.replace(target, stale)
+            except FileNotFoundError:
+                pass  # another process already moved them
+        try:
+            os.replace(tmp_dir, target)
+        except OSError:
+            # Another process finished the same sheets first; theirs are identical
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        if stale is not None:
+            shutil.rmtree(stale, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    return index
+
+
+def sheet_of_page(index: dict, page: int) -> int:
+    page = max(1, min(int(page), index["pages"]))
+    return index["offsets"][page - 1][0]
+
+
+def prune(live_sigs):
+    """Removes sheets of document versions that are no longer in data/."""
+    if not os.path.isdir(THUMB_DIR):
+        return
+    for name in os.listdir(THUMB_DIR):
+        if name not in live_sigs and not name.startswith(TMP_PREFIX):
+            shutil.rmtree(os.path.join(THUMB_DIR, name), ignore_errors=True)
+
+
+def build_all(workers: int = THUMB_WORKERS) -> dict:
+    """Builds (or loads) the sheets of every manual in data/. Returns {name: index}."""
+    from modules.manifest import MANIFEST
+
+    indexes = {}
+    for doc in MANIFEST.documents():
+        pdf_path = os.path.join(MANIFEST.data_dir, doc["name"])
+        indexes[doc["name"]] = build_sheets(pdf_path, doc["sha256"], doc["pages"], workers)
+    prune({doc["sha256"] for doc in MANIFEST.documents()})
+    return indexes
+
+
+def main(argv=None):
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if not argv or argv[0] != "build":
+        print(__doc__)
+        return 2
+    t0 = time.perf_counter()
+    indexes = build_all()
+    for name, index in indexes.items():
+        size = sum(os.path.getsize(sheet_path(index["sig"], n)) for n in range(len(index["sheets"])))
+        print(f"{name}: {index['pages']} pages in {len(index['sheets'])} sheets, {size / 1024:.0f} KiB")
+    print(f"done in {(time.perf_counter() - t0) * 1000:.0f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
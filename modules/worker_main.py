@@ -0,0 +1,7 @@
+"""
+The __main__ module of spawned worker processes (see modules.procpool).
+
+The "spawn" start method re-imports the parent's __main__ in every child.
+When that is the Streamlit script, it points its __spec__ here, so workers
+import this empty module instead of running the whole app again.
+"""
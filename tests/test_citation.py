@@ -0,0 +1,47 @@
+import fitz
+import pytest
+
+from modules import citation
+
+HEADING = "Chapter 3 Credit risk weights for exposures"
+BODY = "Exposures to sovereigns are weighted at zero percent."
+
+
+@pytest.fixture(autouse=True)
+def layout_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(citation, "LAYOUT_DIR", str(tmp_path / "layouts"))
+    citation.load_layout.cache_clear()
+    yield
+    citation.load_layout.cache_clear()
+
+
+def make_pdf(path, pages):
+    doc = fitz.open()
+    for lines in pages:
+        page = doc.new_page()
+        for i, line in enumerate(lines):
+            page.insert_text((72, 72 + 20 * i), line, fontsize=11)
+    doc.save(str(path))
+    doc.close()
+    return str(path)
+
+
+def test_exact_match_on_a_later_page_beats_a_probe_hit_on_an_earlier_one(tmp_path):
+    # Page 1 repeats the heading (table of contents); page 2 holds the chunk
+    pdf = make_pdf(tmp_path / "a.pdf", [[HEADING, "Contents"], [HEADING, BODY]])
+    hits = citation.resolve_text(pdf, "sig-a", f"{HEADING}\n{BODY}")
+    assert [hit["page"] for hit in hits] == [2]
+    assert hits[0]["rects"]
+
+
+def test_probe_prefers_a_page_matching_both_ends(tmp_path):
+    # The chunk's middle was reflowed and does not match anywhere exactly
+    pdf = make_pdf(tmp_path / "b.pdf", [[HEADING, "Contents"], [HEADING, "(reflowed)", BODY]])
+    hits = citation.resolve_text(pdf, "sig-b", f"{HEADING}\n{BODY}")
+    assert [hit["page"] for hit in hits] == [2]
+
+
+def test_hint_page_wins_among_equal_matches(tmp_path):
+    pdf = make_pdf(tmp_path / "c.pdf", [[HEADING, BODY], [HEADING, BODY]])
+    hits = citation.resolve_text(pdf, "sig-c", f"--- PAGE 2 ---\n{HEADING}\n{BODY}")
+    assert [hit["page"] for hit in hits] == [2]
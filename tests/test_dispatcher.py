@@ -0,0 +1,288 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from modules.dispatcher import GeminiBusyError, GeminiDispatcher, TokenBucket
+
+
+# =====================================================
+# 대역 (클라이언트 / 시계 / 답변 캐시)
+# =====================================================
+class FakeClock:
+    """monotonic() and sleep() for a clock that only moves when slept on."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class ApiError(Exception):
+    def __init__(self, code):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+
+
+def response(text, chunks=None):
+    metadata = SimpleNamespace(grounding_chunks=chunks) if chunks else None
+    return SimpleNamespace(text=text, candidates=[SimpleNamespace(grounding_metadata=metadata)])
+
+
+CHUNK = SimpleNamespace(retrieved_context=SimpleNamespace(title="시행세칙", text="--- PAGE 12 ---\n위험가중치"))
+
+
+class FakeModels:
+    """Answers with a fixed text after raising `failures` in order; `gate` holds every call until set."""
+
+    def __init__(self, failures=(), gate=None):
+        self.failures = list(failures)
+        self.gate = gate
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _call(self):
+        with self._lock:
+            self.calls += 1
+        if self.gate is not None:
+            assert self.gate.wait(5)
+        with self._lock:
+            if self.failures:
+                raise self.failures.pop(0)
+
+    def generate_content(self, **_):
+        self._call()
+        return response("답변입니다.", [CHUNK])
+
+    def generate_content_stream(self, **_):
+        self._call()
+        yield response("답변")
+        yield response("입니다.")
+        yield response(None, [CHUNK])
+
+
+class MemoryCache:
+    def __init__(self):
+        self.entries = {}
+
+    def make_key(self, question, model, system_instruction, store):
+        return question
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def put(self, key, question, store, answer, sources):
+        self.entries[key] = {"answer": answer, "sources": sources}
+
+
+def make_dispatcher(models, clock=None, **kwargs):
+    clock = clock or FakeClock()
+    kwargs.setdefault("rand", lambda: 1.0)  # always the full backoff
+    return GeminiDispatcher(
+        client=SimpleNamespace(models=models), clock=clock, sleep=clock.sleep, **kwargs
+    )
+
+
+def wait_until(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.005)
+
+
+def ask_concurrently(dispatcher, models, cache, n, stream=True):
+    """Starts `n` identical questions, releases the model once all joined one flight."""
+    outcomes = [None] * n
+
+    def ask(i):
+        try:
+            outcomes[i] = dispatcher.ask("RW가 뭐야?", stream=stream, cache=cache)
+        except BaseException as e:
+            outcomes[i] = e
+
+    threads = [threading.Thread(target=ask, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    wait_until(lambda: dispatcher.coalesced == n - 1 and models.calls == 1)
+    models.gate.set()
+    for t in threads:
+        t.join(5)
+    return outcomes
+
+
+# =====================================================
+# 단일 비행 (동일 질문 합치기)
+# =====================================================
+def test_identical_questions_share_one_call():
+    models = FakeModels(gate=threading.Event())
+    dispatcher = make_dispatcher(models)
+    cache = MemoryCache()
+    try:
+        results = ask_concurrently(dispatcher, models, cache, 3)
+    finally:
+        dispatcher.shutdown()
+
+    assert models.calls == 1
+    assert [r["text"] for r in results] == ["답변입니다."] * 3
+    assert results[0]["sources"] == [{"title": "시행세칙", "page": 12}]
+    assert dispatcher.in_flight() == 0
+    # The next ask is a cache hit, not a new call
+    assert dispatcher.ask("RW가 뭐야?", cache=cache)["cached"] is True
+    assert models.calls == 1
+
+
+def test_coalesced_waiters_get_independent_results():
+    models = FakeModels(gate=threading.Event())
+    dispatcher = make_dispatcher(models)
+    try:
+        first, second = ask_concurrently(dispatcher, models, MemoryCache(), 2)
+    finally:
+        dispatcher.shutdown()
+
+    assert first == second and first is not second
+    first["sources"].append({"title": "다른 문서", "page": 1})
+    first["timings"]["total_ms"] = -1
+    assert second["sources"] == [{"title": "시행세칙", "page": 12}]
+    assert second["timings"]["total_ms"] >= 0
+
+
+def test_coalesced_waiters_get_their_own_error():
+    models = FakeModels(failures=[ApiError(400)], gate=threading.Event())
+    dispatcher = make_dispatcher(models)
+    try:
+        first, second = ask_concurrently(dispatcher, models, MemoryCache(), 2, stream=False)
+    finally:
+        dispatcher.shutdown()
+
+    assert isinstance(first, ApiError) and isinstance(second, ApiError)
+    assert first is not second
+    assert first.code == second.code == 400
+    assert models.calls == 1
+
+
+# =====================================================
+# 토큰 버킷
+# =====================================================
+def test_token_bucket_allows_a_burst_then_paces():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2.0, capacity=2, clock=clock, sleep=clock.sleep)
+
+    assert bucket.acquire() and bucket.acquire()
+    assert clock.sleeps == []
+    assert bucket.acquire()
+    assert clock.sleeps == [pytest.approx(0.5)]
+    assert bucket.acquire()
+    assert clock.now == pytest.approx(1.0)
+
+
+def test_token_bucket_refills_while_idle_up_to_capacity():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=1.0, capacity=2, clock=clock, sleep=clock.sleep)
+    bucket.acquire(), bucket.acquire()
+    clock.now += 60
+
+    for _ in range(2):
+        assert bucket.acquire()
+    assert clock.sleeps == []
+    assert bucket.acquire()
+    assert clock.sleeps == [pytest.approx(1.0)]
+
+
+def test_token_bucket_times_out():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=0.1, capacity=1, clock=clock, sleep=clock.sleep)
+    assert bucket.acquire()
+
+    assert bucket.acquire(timeout=2.0) is False
+    assert clock.now == pytest.approx(2.0)
+
+
+def test_dispatcher_calls_are_throttled():
+    clock = FakeClock()
+    models = FakeModels()
+    dispatcher = make_dispatcher(models, clock, rate_per_min=60, burst=1)
+    cache = MemoryCache()
+    try:
+        dispatcher.ask("첫 질문", stream=False, cache=cache)
+        dispatcher.ask("둘째 질문", stream=False, cache=cache)
+    finally:
+        dispatcher.shutdown()
+
+    assert models.calls == 2
+    assert clock.sleeps == [pytest.approx(1.0)]
+
+
+# =====================================================
+# 429 / 503 재시도
+# =====================================================
+@pytest.mark.parametrize("code", [429, 503])
+def test_quota_and_unavailable_errors_are_retried_with_backoff(code):
+    clock = FakeClock()
+    models = FakeModels(failures=[ApiError(code), ApiError(code)])
+    dispatcher = make_dispatcher(models, clock, backoff_base=1.0, backoff_max=20.0)
+    try:
+        result = dispatcher.ask("RW가 뭐야?", stream=False, cache=MemoryCache())
+    finally:
+        dispatcher.shutdown()
+
+    assert result["text"] == "답변입니다."
+    assert models.calls == 3
+    assert dispatcher.retries == 2
+    assert clock.sleeps == [1.0, 2.0]
+
+
+def test_backoff_is_jittered_and_capped():
+    dispatcher = make_dispatcher(FakeModels(), backoff_base=1.0, backoff_max=5.0, rand=lambda: 0.5)
+
+    assert [dispatcher._backoff(n) for n in range(5)] == [0.5, 1.0, 2.0, 2.5, 2.5]
+
+
+def test_streaming_call_is_retried_before_the_first_chunk():
+    clock = FakeClock()
+    models = FakeModels(failures=[ApiError(503)])
+    dispatcher = make_dispatcher(models, clock)
+    texts = []
+    try:
+        result = dispatcher.ask("RW가 뭐야?", on_text=texts.append, cache=MemoryCache())
+    finally:
+        dispatcher.shutdown()
+
+    assert result["text"] == "답변입니다."
+    assert texts[-1] == "답변입니다."
+    assert models.calls == 2
+
+
+def test_retries_give_up_with_busy_error():
+    clock = FakeClock()
+    models = FakeModels(failures=[ApiError(429)] * 10)
+    dispatcher = make_dispatcher(models, clock, max_retries=2)
+    try:
+        with pytest.raises(GeminiBusyError) as info:
+            dispatcher.ask("RW가 뭐야?", stream=False, cache=MemoryCache())
+    finally:
+        dispatcher.shutdown()
+
+    assert isinstance(info.value.__cause__, ApiError)
+    assert models.calls == 3
+    assert len(clock.sleeps) == 2
+
+
+def test_other_errors_are_not_retried():
+    clock = FakeClock()
+    models = FakeModels(failures=[ApiError(400)])
+    dispatcher = make_dispatcher(models, clock)
+    try:
+        with pytest.raises(ApiError):
+            dispatcher.ask("RW가 뭐야?", stream=False, cache=MemoryCache())
+    finally:
+        dispatcher.shutdown()
+
+    assert models.calls == 1
+    assert clock.sleeps == []
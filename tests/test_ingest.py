@@ -0,0 +1,200 @@
+import itertools
+import types
+
+import fitz
+import pytest
+
+from modules import answer_cache, ingest
+
+
+# =====================================================
+# File Search 스토어 대역
+# =====================================================
+_document_ids = itertools.count(1)  # unique across clients, like real document names
+
+
+class FakeOperation:
+    def __init__(self, name, polls_left, document_name=None, error=None):
+        self.name = name
+        self.polls_left = polls_left
+        self.document_name = document_name
+        self.error = error
+
+    @property
+    def done(self):
+        return self.polls_left <= 0
+
+    @property
+    def response(self):
+        if not self.done or self.error:
+            return None
+        return types.SimpleNamespace(document_name=self.document_name)
+
+
+class FakeDocuments:
+    def __init__(self):
+        self.deleted = []
+
+    def delete(self, name, config=None):
+        self.deleted.append(name)
+
+
+class FakeStores:
+    """upload_to_file_search_store() hands out operations that finish after `polls` polls."""
+
+    def __init__(self, polls=1):
+        self.polls = polls
+        self.documents = FakeDocuments()
+        self.uploads = []
+        self.missing_names = set()   # display names whose response lacks a document name
+        self.errors = {}             # display name -> operation error
+
+    def upload_to_file_search_store(self, file, file_search_store_name, config):
+        name = config["display_name"]
+        self.uploads.append(name)
+        document = None if name in self.missing_names else f"{file_search_store_name}/documents/{name}-{next(_document_ids)}"
+        return FakeOperation(f"operations/{name}", self.polls, document, self.errors.get(name))
+
+
+class FakeOperations:
+    def __init__(self):
+        self.polls = 0
+
+    def get(self, op):
+        self.polls += 1
+        op.polls_left -= 1
+        return op
+
+
+class FakeClient:
+    def __init__(self, polls=1):
+        self.file_search_stores = FakeStores(polls)
+        self.operations = FakeOperations()
+
+
+class FakeAnswerCache:
+    def __init__(self):
+        self.invalidated = []
+
+    def invalidate_store(self, store):
+        self.invalidated.append(store)
+
+
+STORE = "fileSearchStores/test"
+
+
+def write_pdf(path, text):
+    doc = fitz.open()
+    doc.new_page().insert_text((72, 72), text)
+    doc.save(str(path))
+    doc.close()
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    write_pdf(data_dir / "a.pdf", "alpha")
+    write_pdf(data_dir / "b.pdf", "beta")
+    monkeypatch.setattr(ingest, "TEXT_DIR", str(tmp_path / "text"))
+    cache = FakeAnswerCache()
+    monkeypatch.setattr(answer_cache, "ANSWER_CACHE", cache)
+    return types.SimpleNamespace(
+        data_dir=data_dir,
+        manifest_path=str(tmp_path / "manifest.json"),
+        cache=cache,
+    )
+
+
+def run(client, ws, **kwargs):
+    kwargs.setdefault("poll_interval", 0)
+    return ingest.ingest(
+        client, STORE, data_dir=str(ws.data_dir), manifest_path=ws.manifest_path, log=lambda *_: None, **kwargs
+    )
+
+
+# =====================================================
+# 업로드 / 건너뛰기 / 교체
+# =====================================================
+def test_uploads_new_files_and_records_documents(workspace):
+    client = FakeClient()
+    result = run(client, workspace)
+
+    assert result == {"uploaded": ["a.pdf", "b.pdf"], "skipped": [], "failed": {}}
+    entries = ingest.load_manifest(workspace.manifest_path)[STORE]
+    assert entries["a.pdf"]["document"].startswith(f"{STORE}/documents/a-")
+    assert workspace.cache.invalidated == [STORE]
+
+
+def test_unchanged_files_are_skipped(workspace):
+    run(FakeClient(), workspace)
+    client = FakeClient()
+    result = run(client, workspace)
+
+    assert result == {"uploaded": [], "skipped": ["a.pdf", "b.pdf"], "failed": {}}
+    assert client.file_search_stores.uploads == []
+
+
+def test_changed_file_replaces_its_old_document(workspace):
+    run(FakeClient(), workspace)
+    old = ingest.load_manifest(workspace.manifest_path)[STORE]["a.pdf"]["document"]
+    write_pdf(workspace.data_dir / "a.pdf", "alpha, revised")
+
+    client = FakeClient()
+    result = run(client, workspace)
+
+    assert result["uploaded"] == ["a.pdf"]
+    assert result["skipped"] == ["b.pdf"]
+    assert client.file_search_stores.documents.deleted == [old]
+    new = ingest.load_manifest(workspace.manifest_path)[STORE]["a.pdf"]["document"]
+    assert new and new != old
+
+
+def test_missing_document_name_keeps_the_old_document(workspace):
+    run(FakeClient(), workspace)
+    before = ingest.load_manifest(workspace.manifest_path)[STORE]["a.pdf"]
+    write_pdf(workspace.data_dir / "a.pdf", "alpha, revised")
+
+    client = FakeClient()
+    client.file_search_stores.missing_names.add("a")
+    result = run(client, workspace)
+
+    assert "a.pdf" in result["failed"]
+    assert client.file_search_stores.documents.deleted == []
+    assert ingest.load_manifest(workspace.manifest_path)[STORE]["a.pdf"] == before
+
+
+def test_failed_operation_keeps_the_old_document(workspace):
+    run(FakeClient(), workspace)
+    before = ingest.load_manifest(workspace.manifest_path)[STORE]["b.pdf"]
+    write_pdf(workspace.data_dir / "b.pdf", "beta, revised")
+
+    client = FakeClient()
+    client.file_search_stores.errors["b"] = "quota exceeded"
+    result = run(client, workspace)
+
+    assert result["failed"] == {"b.pdf": "quota exceeded"}
+    assert client.file_search_stores.documents.deleted == []
+    assert ingest.load_manifest(workspace.manifest_path)[STORE]["b.pdf"] == before
+
+
+# =====================================================
+# 폴링 마감 시간
+# =====================================================
+def test_indexing_that_never_finishes_times_out(workspace):
+    client = FakeClient(polls=10 ** 9)
+    result = run(client, workspace, timeout=0.05)
+
+    assert result["uploaded"] == []
+    assert result["failed"] == {"a.pdf": "indexing timed out", "b.pdf": "indexing timed out"}
+    assert ingest.load_manifest(workspace.manifest_path)[STORE] == {}
+    assert workspace.cache.invalidated == []
+
+
+def test_wait_all_polls_pending_operations_together():
+    client = FakeClient()
+    ops = {"a": FakeOperation("a", 2), "b": FakeOperation("b", 1), "c": FakeOperation("c", 0)}
+    done = ingest.wait_all(client, ops, poll_interval=0, log=lambda *_: None)
+
+    assert set(done) == {"a", "b", "c"}
+    assert client.operations.polls == 3  # round 1: a, b; round 2: a
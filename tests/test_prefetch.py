@@ -0,0 +1,59 @@
+import threading
+import time
+
+from modules.prefetch import Prefetcher
+
+
+def wait_until(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.005)
+
+
+class GatedRender:
+    """Records rendered pages; every render waits until `gate` is set."""
+
+    def __init__(self):
+        self.gate = threading.Event()
+        self.started = []
+        self.pages = []
+
+    def __call__(self, pdf_path, sig, page, dpi, fmt, quality):
+        self.started.append(page)
+        assert self.gate.wait(5)
+        self.pages.append(page)
+
+
+def request(page):
+    return ("missing.pdf", "f" * 64, page, 100, "jpeg", 80)
+
+
+def test_request_for_a_page_queued_under_a_stale_scope_is_kept():
+    render = GatedRender()
+    prefetcher = Prefetcher(workers=1, render=render)
+    # Occupy the only worker, so the next job stays queued
+    prefetcher.schedule("s", "nav", "a.pdf", [request(1)])
+    wait_until(lambda: render.started == [1])
+    assert prefetcher.schedule("s", "nav", "a.pdf", [request(2)]) == 1
+
+    # The scope moves on, then asks for the same page again
+    prefetcher.cancel("s", "nav")
+    assert prefetcher.schedule("s", "nav", "b.pdf", [request(2)]) == 1
+
+    render.gate.set()
+    wait_until(lambda: prefetcher.pending() == 0 and render.pages == [1, 2])
+    assert prefetcher.dropped == 0
+
+
+def test_jobs_of_a_cancelled_scope_are_dropped():
+    render = GatedRender()
+    prefetcher = Prefetcher(workers=1, render=render)
+    prefetcher.schedule("s", "nav", "a.pdf", [request(1)])
+    wait_until(lambda: render.started == [1])
+    prefetcher.schedule("s", "nav", "a.pdf", [request(2), request(3)])
+
+    prefetcher.cancel("s", "nav")
+    render.gate.set()
+    wait_until(lambda: prefetcher.dropped == 2)
+    assert render.pages == [1]